@@ -0,0 +1,214 @@
+"""Tile / overlap / micro-batch autotuner with plans persisted to JSON.
+
+Each (tile size, batch size) pair is timed once on random input, together with its peak
+memory: allocated device memory on CUDA, process peak RSS on CPU (Linux /proc). The time for a whole image is then estimated for every overlap from the number of
+tile batches the tiler would run. The fastest plan that fits the memory budget wins, so the
+candidate overlaps should only contain values whose seam quality is acceptable (see
+benchmarks/seam_error.py). Plans are keyed by device, model digest, image size, TTA policy and
+budget, so later runs reuse them without measuring again. The model digest is
+result_cache.model_digest, a hash of every weight, so each checkpoint, dtype and quantized
+variant gets its own plan.
+
+Usage: python autotune.py MODEL --height 6000 --width 4000 [--budget_gib 20] [--device cuda:0]
+"""
+
+import json
+import os
+import platform
+import time
+
+import torch
+
+from result_cache import model_digest
+from tiling import tile_coords
+from tta import resolve, tta_forward
+
+
+TILE_SIZES = (512, 768, 1024, 1536, 2048)
+BATCH_SIZES = (1, 2, 4, 8)
+OVERLAPS = (0.125, 0.25)  # 相对 tile 尺寸
+PLAN_FILE = os.path.join(os.path.expanduser("~"), ".cache", "dehaze", "plans.json")
+
+
+def reset_cpu_peak():
+    """重置进程的峰值 RSS (Linux clear_refs)，不支持时返回 False"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def cpu_peak():
+    """进程自上次 reset_cpu_peak 以来的峰值 RSS 字节数 (/proc/self/status 的 VmHWM)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    raise OSError("VmHWM not available")
+
+
+def is_out_of_memory(error):
+    if isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    message = str(error).lower()
+    # 其他后端 / CPU 分配器的 OOM 以普通 RuntimeError 抛出
+    return "out of memory" in message or "can't allocate memory" in message
+
+
+def device_name(device):
+    device = torch.device(device)
+    if device.type == "cuda":
+        return torch.cuda.get_device_name(device)
+    return f"cpu-{platform.machine()}-{torch.get_num_threads()}t"
+
+
+def plan_key(model, device, height, width, tta=False, memory_budget=None):
+    policy = "+".join(resolve(tta))
+    budget = "none" if memory_budget is None else f"{memory_budget / 2**30:.1f}GiB"
+    return f"{device_name(device)}|{model_digest(model)[:16]}|{height}x{width}|{policy}|{budget}"
+
+
+@torch.inference_mode()
+def measure(model, device, tile, batch, tta=False, iters=2):
+    """返回 (每个 batch 的秒数, 峰值内存字节数)；内存不足时返回 None。
+
+    CUDA 上为已分配显存的峰值，CPU 上为进程峰值 RSS (包括模型权重)，无法测量时为 None。
+    """
+    device = torch.device(device)
+    dtype = next(model.parameters(), torch.empty(0)).dtype
+    x = torch.rand(batch, 3, tile, tile, device=device, dtype=dtype) * 2 - 1
+    transforms = resolve(tta)
+    cpu_tracked = device.type == "cpu" and reset_cpu_peak()
+    try:
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+        tta_forward(model, x, transforms)  # 预热
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        for _ in range(iters):
+            tta_forward(model, x, transforms)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        seconds = (time.perf_counter() - start) / iters
+    except (RuntimeError, MemoryError) as error:
+        if not is_out_of_memory(error):
+            raise
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+        return None
+    if device.type == "cuda":
+        peak = torch.cuda.max_memory_allocated(device)
+    else:
+        peak = cpu_peak() if cpu_tracked else None
+    return seconds, peak
+
+
+def autotune(
+    model,
+    device,
+    height,
+    width,
+    tta=False,
+    memory_budget=None,
+    tile_sizes=TILE_SIZES,
+    batch_sizes=BATCH_SIZES,
+    overlaps=OVERLAPS,
+    verbose=True,
+):
+    """测量所有候选并返回最快的可行 plan (dict)。overlaps 中小于 1 的值按 tile 尺寸的比例计算。"""
+    best = None
+    for tile in tile_sizes:
+        for batch in batch_sizes:
+            result = measure(model, device, tile, batch, tta)
+            if result is None:
+                # 更大的 batch 只会更占显存
+                break
+            seconds, peak = result
+            if memory_budget is not None:
+                if peak is None:
+                    raise ValueError(f"memory_budget needs peak memory, which cannot be measured on {device}")
+                if peak > memory_budget:
+                    break
+            for overlap in overlaps:
+                overlap = int(overlap * tile) // 16 * 16 if overlap < 1 else int(overlap)
+                if overlap >= tile:
+                    continue
+                tiles = len(tile_coords(height, width, tile, overlap))
+                estimate = -(-tiles // batch) * seconds
+                plan = {
+                    "tile_size": tile,
+                    "overlap": overlap,
+                    "batch_size": batch,
+                    "seconds": estimate,
+                    "mp_per_s": height * width / 1e6 / estimate,
+                    "peak_mib": None if peak is None else peak / 2**20,
+                }
+                if verbose:
+                    peak_text = "-" if peak is None else f"{plan['peak_mib']:.0f}"
+                    print(f"tile {tile:>5} overlap {overlap:>4} batch {batch:>2}: "
+                          f"{estimate:8.2f} s/img {plan['mp_per_s']:7.2f} MP/s peak {peak_text} MiB")
+                if best is None or estimate < best["seconds"]:
+                    best = plan
+    if best is None:
+        raise RuntimeError("no tile / batch candidate fits on the device")
+    return best
+
+
+def load_plans(path=PLAN_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_plan(key, plan, path=PLAN_FILE):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    plans = load_plans(path)
+    plans[key] = plan
+    with open(path + ".tmp", "w") as f:
+        json.dump(plans, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def load_or_tune(model, device, height, width, tta=False, memory_budget=None, path=PLAN_FILE, **kwargs):
+    """已有 plan 时直接返回，否则测量后保存"""
+    key = plan_key(model, device, height, width, tta, memory_budget)
+    plans = load_plans(path)
+    if key in plans:
+        return plans[key]
+    plan = autotune(model, device, height, width, tta, memory_budget, **kwargs)
+    save_plan(key, plan, path)
+    return plan
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from checkpoint import load_inference_model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", type=str, help="checkpoint, slim checkpoint directory or .safetensors")
+    parser.add_argument("--height", type=int, default=6000)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--tta", type=str, default="none")
+    parser.add_argument("--budget_gib", type=float, default=None)
+    parser.add_argument("--tiles", type=int, nargs="+", default=list(TILE_SIZES))
+    parser.add_argument("--batches", type=int, nargs="+", default=list(BATCH_SIZES))
+    parser.add_argument("--overlaps", type=float, nargs="+", default=list(OVERLAPS))
+    parser.add_argument("--plans", type=str, default=PLAN_FILE)
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    model = load_inference_model(args.model, args.device, fuse=True)
+    budget = None if args.budget_gib is None else int(args.budget_gib * 2**30)
+
+    plan = autotune(
+        model, args.device, args.height, args.width, args.tta, budget,
+        tuple(args.tiles), tuple(args.batches), tuple(args.overlaps),
+    )
+    save_plan(plan_key(model, args.device, args.height, args.width, args.tta, budget), plan, args.plans)
+    print(f"best: {plan}")
@@ -0,0 +1,145 @@
+"""Inference backends: where the generator runs and which tile / batch sizes suit it.
+
+CUDABackend is the original GPU path. CPUBackend is for CPU-only edge boxes. It pins the
+intra-op / inter-op and OpenCV thread counts, converts the model to channels-last (the tiler
+already produces NHWC-strided tiles), and runs under bf16 autocast when oneDNN supports bf16
+on the CPU. Its default tiles are smaller so the per-tile activations stay closer to the
+caches. GraphBackend runs a graph exported by graph_export.py (.onnx through onnxruntime, .pt2
+through torch.export) with the same tiling, stitching and thread settings.
+"""
+
+import os
+
+import cv2
+import torch
+import torch.nn as nn
+
+from tiling import Tiler
+
+
+class AutocastModule(nn.Module):
+    """在 autocast 下运行被包装的模型，输出转回 float32"""
+
+    def __init__(self, model, device_type, dtype):
+        super().__init__()
+        self.model = model
+        self.device_type = device_type
+        self.dtype = dtype
+
+    def forward(self, x):
+        with torch.autocast(self.device_type, dtype=self.dtype):
+            return self.model(x).float()
+
+
+def cpu_supports_bf16():
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class CUDABackend:
+    needs_model = True
+
+    def __init__(self, device=0, tile_size=2048, overlap=512, batch_size=2):
+        self.device = torch.device("cuda", device)
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+
+    def prepare(self, model):
+        return model.eval().to(self.device)
+
+    def tiler(self, overlap=None):
+        return Tiler(self.tile_size, self.overlap if overlap is None else overlap, self.batch_size, self.device)
+
+
+class CPUBackend(CUDABackend):
+    """Args:
+    threads: intra-op 线程数，默认为可用的全部核心
+    interop_threads: inter-op 线程数，只能在第一次并行计算之前设置
+    opencv_threads: cv2 的线程数，默认 1，避免与 torch 的线程争抢核心
+    bf16: "auto" 按 CPU 是否支持决定，True / False 强制
+    """
+
+    def __init__(
+        self,
+        threads=None,
+        interop_threads=1,
+        opencv_threads=1,
+        bf16="auto",
+        channels_last=True,
+        tile_size=1024,
+        overlap=256,
+        batch_size=1,
+    ):
+        self.device = torch.device("cpu")
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.threads = threads or len(os.sched_getaffinity(0))
+        self.bf16 = cpu_supports_bf16() if bf16 == "auto" else bool(bf16)
+        self.channels_last = channels_last
+
+        torch.set_num_threads(self.threads)
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # 已经有并行计算运行过，保持当前设置
+            pass
+        cv2.setNumThreads(opencv_threads)
+
+    def prepare(self, model):
+        model = model.eval().to(self.device)
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        # int8 模型 (quantize.py) 的量化层要求 float32 输入
+        if self.bf16 and not getattr(model, "int8", False):
+            model = AutocastModule(model, "cpu", torch.bfloat16)
+        return model
+
+
+class GraphBackend(CPUBackend):
+    """执行 graph_export.py 导出的静态图 (.onnx 用 onnxruntime，.pt2 用 torch.export)，tile 尺寸取自图的输入形状。
+
+    线程设置与 CPUBackend 相同，onnxruntime 的 intra-op 线程数也取 threads。
+    prepare() 忽略传入的 PyTorch 模型 (可以为 None)，返回图的封装模块。
+    """
+
+    needs_model = False
+
+    def __init__(
+        self,
+        path,
+        providers=("CPUExecutionProvider",),
+        threads=None,
+        interop_threads=1,
+        opencv_threads=1,
+        overlap=256,
+        batch_size=None,
+    ):
+        from graph_export import load_graph
+
+        # 导出的图固定为 float32 / NCHW，不使用 bf16 autocast 和 channels-last
+        super().__init__(threads, interop_threads, opencv_threads, bf16=False, channels_last=False, overlap=overlap)
+        self.module = load_graph(path, providers, self.threads)
+        self.tile_size = self.module.tile
+        # 默认每次送入与图相同的 batch
+        self.batch_size = batch_size or self.module.batch
+
+    def prepare(self, model=None):
+        return self.module
+
+
+ONNXBackend = GraphBackend
+
+BACKENDS = {"cuda": CUDABackend, "cpu": CPUBackend, "onnx": GraphBackend, "graph": GraphBackend}
+
+
+def make_backend(spec):
+    """spec 为 {"name": "cuda" | "cpu" | "graph" ("onnx"), ...}，其余键作为构造参数"""
+    spec = dict(spec)
+    name = spec.pop("name")
+    if name in BACKENDS:
+        return BACKENDS[name](**spec)
+    raise ValueError(f"unknown backend {name!r}")
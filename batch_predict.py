@@ -0,0 +1,238 @@
+"""Resumable batch prediction sharded across worker processes through a file-based work queue.
+
+OUT/queue/todo holds one marker file per image that is still to be done. A worker claims an
+image by renaming its marker into OUT/queue/claimed, which is atomic, so two workers never
+get the same image. Faster workers simply claim more. Each worker is pinned to one CUDA
+device or to a disjoint set of CPU cores, and runs the usual decode -> tiled inference ->
+metrics / encode pipeline. As in predict.py, PSNR / SSIM are computed on the unrounded float32
+output (metrics.image_metrics), and the image is rounded to uint8 only when saved. The output
+image and OUT/metrics/<image>.json are written atomically (temporary file + rename, JSON
+last), and then the claim is removed.
+
+On restart, images with a metrics file are skipped. Claims left by a crashed run go back to
+todo. Only one runner may own an output directory at a time. When every worker has exited,
+the per-image files are merged into OUT/metrics.csv.
+
+Usage:
+    python batch_predict.py MODEL INPUT_DIR OUT_DIR [--gt_dir GT_DIR] --devices cuda:0 cuda:1
+    python batch_predict.py MODEL INPUT_DIR OUT_DIR --cpu_workers 4 [--tile 1024 --overlap 256]
+    python batch_predict.py MODEL INPUT_DIR OUT_DIR --merge_only
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+def atomic_imwrite(path, image):
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.{os.getpid()}.tmp{ext}"  # cv2 按扩展名选择编码器
+    if not cv2.imwrite(tmp, image):
+        raise OSError(f"could not write {path}")
+    os.replace(tmp, path)
+
+
+def atomic_write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class WorkQueue:
+    """out_dir/queue 下的 todo / claimed 标记文件"""
+
+    def __init__(self, out_dir):
+        self.todo = os.path.join(out_dir, "queue", "todo")
+        self.claimed = os.path.join(out_dir, "queue", "claimed")
+        os.makedirs(self.todo, exist_ok=True)
+        os.makedirs(self.claimed, exist_ok=True)
+
+    def fill(self, names, done=()):
+        """上次运行遗留的认领放回 todo，去掉已完成的，再为 names 中尚未排队的图像创建标记，返回排队数量"""
+        for name in os.listdir(self.claimed):
+            os.replace(os.path.join(self.claimed, name), os.path.join(self.todo, name))
+        queued = set(os.listdir(self.todo))
+        for name in queued & set(done):
+            # 写完 metrics 后、释放认领前中断的图像
+            os.remove(os.path.join(self.todo, name))
+        for name in set(names) - queued - set(done):
+            open(os.path.join(self.todo, name), "w").close()
+        return len(os.listdir(self.todo))
+
+    def claim(self, name, worker):
+        try:
+            os.rename(os.path.join(self.todo, name), os.path.join(self.claimed, name))
+        except FileNotFoundError:
+            # 已被其他 worker 认领
+            return False
+        with open(os.path.join(self.claimed, name), "w") as f:
+            f.write(f"{worker} {os.getpid()}\n")
+        return True
+
+    def claims(self, worker, workers):
+        """惰性产出本 worker 认领到的图像名，直到 todo 为空"""
+        while True:
+            names = sorted(os.listdir(self.todo))
+            if not names:
+                return
+            # 各 worker 从不同位置开始，减少争抢同一个文件
+            start = len(names) * worker // workers
+            for name in names[start:] + names[:start]:
+                if self.claim(name, worker):
+                    yield name
+
+    def release(self, name):
+        os.remove(os.path.join(self.claimed, name))
+
+
+def completed(out_dir):
+    metrics_dir = os.path.join(out_dir, "metrics")
+    if not os.path.isdir(metrics_dir):
+        return set()
+    return {name[: -len(".json")] for name in os.listdir(metrics_dir) if name.endswith(".json")}
+
+
+def merge(out_dir):
+    """合并各图像的 metrics JSON 为 out_dir/metrics.csv"""
+    import pandas as pd
+
+    metrics_dir = os.path.join(out_dir, "metrics")
+    rows = []
+    for name in sorted(completed(out_dir)):
+        with open(os.path.join(metrics_dir, f"{name}.json")) as f:
+            rows.append(json.load(f))
+    df = pd.DataFrame(rows, columns=["image", "psnr", "ssim", "seconds", "worker"])
+    tmp = os.path.join(out_dir, f"metrics.csv.{os.getpid()}.tmp")
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, os.path.join(out_dir, "metrics.csv"))
+    return df
+
+
+def worker_specs(devices=None, cpu_workers=None, tile=None, overlap=None, batch_size=None):
+    """每个 worker 的 backend spec (见 backend.make_backend) 和绑定的 CPU 核心"""
+    tiling = {"tile_size": tile, "overlap": overlap, "batch_size": batch_size}
+    tiling = {k: v for k, v in tiling.items() if v is not None}
+    specs = []
+    for device in devices or []:
+        index = int(device.split(":")[1]) if ":" in device else 0
+        specs.append({"backend": {"name": "cuda", "device": index, **tiling}, "cores": None})
+    if cpu_workers:
+        cores = sorted(os.sched_getaffinity(0))
+        for i in range(cpu_workers):
+            group = cores[len(cores) * i // cpu_workers : len(cores) * (i + 1) // cpu_workers]
+            specs.append({"backend": {"name": "cpu", "threads": len(group), **tiling}, "cores": group})
+    return specs
+
+
+def run_worker(worker, workers, spec, args):
+    if spec["cores"]:
+        os.sched_setaffinity(0, spec["cores"])
+
+    from backend import make_backend
+    from checkpoint import load_inference_model
+    from metrics import image_metrics, to_uint8
+    from pipeline import run_pipeline
+    from tiling import ArraySink, predict_image
+
+    backend = make_backend(spec["backend"])
+    model = backend.prepare(load_inference_model(args["model"], fuse=True))
+    tiler = backend.tiler()
+    queue = WorkQueue(args["out_dir"])
+    image_dir = os.path.join(args["out_dir"], "images")
+    metrics_dir = os.path.join(args["out_dir"], "metrics")
+
+    def decode(name):
+        image = cv2.imread(os.path.join(args["input_dir"], name))
+        gt = None
+        if args["gt_dir"] and os.path.exists(os.path.join(args["gt_dir"], name)):
+            gt = cv2.imread(os.path.join(args["gt_dir"], name))
+        return image, gt
+
+    def compute(name, images):
+        start = time.perf_counter()
+        sink = ArraySink(*images[0].shape[:2])
+        predict_image(model, images[0], tiler, sink, args["tta"], blend=args["blend"])
+        return sink.array, time.perf_counter() - start
+
+    def finish(name, images, result):
+        output, seconds = result
+        gt = images[1]
+        metrics = {"image": name, "psnr": None, "ssim": None, "seconds": seconds, "worker": worker}
+        if gt is not None:
+            psnr_value, ssim_value = image_metrics(output, gt)
+            metrics["psnr"], metrics["ssim"] = float(psnr_value), float(ssim_value)
+        atomic_imwrite(os.path.join(image_dir, name), to_uint8(output))
+        # metrics 最后写入，它的存在表示这张图已经完成
+        atomic_write_json(os.path.join(metrics_dir, f"{name}.json"), metrics)
+        queue.release(name)
+        return metrics
+
+    done = 0
+    for metrics in run_pipeline(
+        queue.claims(worker, workers), decode, compute, finish, args["prefetch"], args["threads"]
+    ):
+        done += 1
+        print(f"[worker {worker}] {metrics['image']} {metrics['seconds']:.1f} s", flush=True)
+    print(f"[worker {worker}] finished {done} images", flush=True)
+
+
+def run(args):
+    specs = worker_specs(args.devices, args.cpu_workers, args.tile, args.overlap, args.batch_size)
+    if not specs:
+        raise SystemExit("no workers: pass --devices and/or --cpu_workers")
+    for name in ("images", "metrics"):
+        os.makedirs(os.path.join(args.out_dir, name), exist_ok=True)
+
+    names = sorted(n for n in os.listdir(args.input_dir) if n.lower().endswith(IMAGE_EXTENSIONS))
+    done = completed(args.out_dir)
+    queued = WorkQueue(args.out_dir).fill(names, done)
+    print(f"{len(names)} images: {len(done & set(names))} already done, {queued} queued, {len(specs)} workers")
+
+    # spawn：子进程各自初始化 CUDA
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(i, len(specs), spec, vars(args)), name=f"worker-{i}")
+        for i, spec in enumerate(specs)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [p.name for p in processes if p.exitcode != 0]
+    if failed:
+        print(f"workers {failed} failed; their claimed images are re-queued on the next run")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", type=str, help="checkpoint, slim checkpoint directory, .safetensors or .int8.pt")
+    parser.add_argument("input_dir", type=str)
+    parser.add_argument("out_dir", type=str)
+    parser.add_argument("--gt_dir", type=str, default=None)
+    parser.add_argument("--devices", type=str, nargs="+", default=None, help="one worker per CUDA device")
+    parser.add_argument("--cpu_workers", type=int, default=None, help="workers on disjoint CPU core sets")
+    parser.add_argument("--tile", type=int, default=None, help="default: the backend's tile size")
+    parser.add_argument("--overlap", type=int, default=None)
+    parser.add_argument("--batch_size", type=int, default=None)
+    parser.add_argument("--tta", type=str, default="none")
+    parser.add_argument("--blend", type=str, default="mean")
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=2, help="decode / encode threads per worker")
+    parser.add_argument("--merge_only", action="store_true")
+    args = parser.parse_args()
+
+    if not args.merge_only:
+        run(args)
+    df = merge(args.out_dir)
+    print(df.describe())
+    print(f"Merged {len(df)} images into {os.path.join(args.out_dir, 'metrics.csv')}")
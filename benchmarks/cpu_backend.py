@@ -0,0 +1,64 @@
+"""CPU backend throughput in megapixels per second for a 6000x4000 image.
+
+Speed does not depend on the weights, so without --ckpt a randomly initialised generator is
+used. Each row is one (threads, dtype, memory format, tile) setting.
+
+Usage: python -m benchmarks.cpu_backend [--ckpt CKPT] [--threads 4 8 16] [--tiles 512 1024]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from backend import CPUBackend, cpu_supports_bf16
+from tiling import ArraySink, predict_image
+
+
+def load(ckpt):
+    from checkpoint import load_inference_model
+    from models.fusenet import convnext_plus_head
+
+    if ckpt is None:
+        return convnext_plus_head(pretrained=False)
+    return load_inference_model(ckpt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ckpt", type=str, default=None)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--tiles", type=int, nargs="+", default=[512, 1024])
+    parser.add_argument("--overlap_ratio", type=float, default=0.25)
+    parser.add_argument("--batch_size", type=int, default=1)
+    args = parser.parse_args()
+
+    base = load(args.ckpt).eval()
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    megapixels = args.height * args.width / 1e6
+    dtypes = [False, True] if cpu_supports_bf16() else [False]
+
+    print(f"{args.width}x{args.height} ({megapixels:.1f} MP), bf16 supported: {cpu_supports_bf16()}")
+    print(f"{'threads':>8}{'dtype':>7}{'layout':>15}{'tile':>6}{'s':>9}{'MP/s':>8}")
+    for threads in args.threads:
+        for bf16 in dtypes:
+            for channels_last in (False, True):
+                for tile in args.tiles:
+                    overlap = int(tile * args.overlap_ratio) // 16 * 16
+                    backend = CPUBackend(
+                        threads, bf16=bf16, channels_last=channels_last,
+                        tile_size=tile, overlap=overlap, batch_size=args.batch_size,
+                    )
+                    model = backend.prepare(base)
+                    start = time.perf_counter()
+                    predict_image(model, image, backend.tiler(), ArraySink(*image.shape[:2], np.uint8))
+                    seconds = time.perf_counter() - start
+                    layout = "channels_last" if channels_last else "contiguous"
+                    print(f"{threads:>8}{'bf16' if bf16 else 'fp32':>7}{layout:>15}{tile:>6}"
+                          f"{seconds:>9.1f}{megapixels / seconds:>8.3f}")
+                    # prepare() 可能改变了参数的 memory format，恢复后再测下一组
+                    base = base.to(memory_format=torch.contiguous_format)
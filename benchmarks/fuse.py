@@ -0,0 +1,53 @@
+"""Forward time and output difference before and after models.fuse.fuse_for_inference.
+
+Usage: python -m benchmarks.fuse [--ckpt CKPT] [--tile 1024] [--batch 1] [--device cuda:0]
+"""
+
+import argparse
+import copy
+import time
+
+import torch
+
+from models.fuse import fuse_for_inference
+from models.fusenet import convnext_plus_head
+
+
+def timed(model, x, iters):
+    with torch.inference_mode():
+        model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize(x.device)
+        start = time.perf_counter()
+        for _ in range(iters):
+            out = model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize(x.device)
+    return out, (time.perf_counter() - start) / iters * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ckpt", type=str, default=None, help="random weights when omitted")
+    parser.add_argument("--tile", type=int, default=1024)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--iters", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    if args.ckpt is None:
+        model = convnext_plus_head(pretrained=False)
+    else:
+        from checkpoint import load_inference_model
+
+        model = load_inference_model(args.ckpt)
+    model = model.to(device).eval()
+    fused, counts = fuse_for_inference(copy.deepcopy(model))
+    print("folded:", ", ".join(f"{k} {v}" for k, v in counts.items()))
+
+    x = torch.rand(args.batch, 3, args.tile, args.tile, device=device) * 2 - 1
+    reference, base_ms = timed(model, x, args.iters)
+    output, fused_ms = timed(fused, x, args.iters)
+    print(f"max abs diff {(output - reference).abs().max().item():.2e}")
+    print(f"eager {base_ms:.1f} ms, fused {fused_ms:.1f} ms, speedup {base_ms / fused_ms:.3f}x")
@@ -0,0 +1,146 @@
+"""Equivalence check and benchmark of pytorch_msssim against the previous dense-window implementation.
+
+Usage: python -m benchmarks.msssim --device cuda:0 --size 336 --batch 8
+"""
+
+import argparse
+import time
+from math import exp
+
+import torch
+import torch.nn.functional as F
+
+from pytorch_msssim import msssim, ssim
+
+
+# --- Reference implementation (dense 2D window rebuilt on every call) ---
+def reference_create_window(window_size, channel=1):
+    gauss = torch.Tensor(
+        [exp(-((x - window_size // 2) ** 2) / float(2 * 1.5**2)) for x in range(window_size)]
+    )
+    _1D_window = (gauss / gauss.sum()).unsqueeze(1)
+    _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
+    return _2D_window.expand(channel, 1, window_size, window_size).contiguous()
+
+
+def reference_ssim(img1, img2, window_size=11, size_average=True, full=False, val_range=None):
+    if val_range is None:
+        max_val = 255 if torch.max(img1) > 128 else 1
+        min_val = -1 if torch.min(img1) < -0.5 else 0
+        L = max_val - min_val
+    else:
+        L = val_range
+
+    (_, channel, height, width) = img1.size()
+    real_size = min(window_size, height, width)
+    window = reference_create_window(real_size, channel=channel).to(img1.device, img1.dtype)
+
+    mu1 = F.conv2d(img1, window, groups=channel)
+    mu2 = F.conv2d(img2, window, groups=channel)
+    mu1_sq = mu1.pow(2)
+    mu2_sq = mu2.pow(2)
+    mu1_mu2 = mu1 * mu2
+    sigma1_sq = F.conv2d(img1 * img1, window, groups=channel) - mu1_sq
+    sigma2_sq = F.conv2d(img2 * img2, window, groups=channel) - mu2_sq
+    sigma12 = F.conv2d(img1 * img2, window, groups=channel) - mu1_mu2
+
+    C1 = (0.01 * L) ** 2
+    C2 = (0.03 * L) ** 2
+    v1 = 2.0 * sigma12 + C2
+    v2 = sigma1_sq + sigma2_sq + C2
+    cs = torch.mean(v1 / v2)
+    ssim_map = ((2 * mu1_mu2 + C1) * v1) / ((mu1_sq + mu2_sq + C1) * v2)
+
+    ret = ssim_map.mean() if size_average else ssim_map.mean(1).mean(1).mean(1)
+    if full:
+        return ret, cs
+    return ret
+
+
+def reference_msssim(img1, img2, window_size=11, size_average=True, val_range=None, normalize=False):
+    weights = torch.FloatTensor([0.0448, 0.2856, 0.3001, 0.2363, 0.1333]).to(img1.device)
+    mssim, mcs = [], []
+    for _ in range(weights.size()[0]):
+        sim, cs = reference_ssim(
+            img1, img2, window_size, size_average, full=True, val_range=val_range
+        )
+        mssim.append(sim)
+        mcs.append(cs)
+        img1 = F.avg_pool2d(img1, (2, 2))
+        img2 = F.avg_pool2d(img2, (2, 2))
+    mssim = torch.stack(mssim)
+    mcs = torch.stack(mcs)
+    if normalize:
+        mssim = (mssim + 1) / 2
+        mcs = (mcs + 1) / 2
+    return torch.prod((mcs**weights)[:-1] * (mssim**weights)[-1])
+
+
+def check_equivalence(device, atol=1e-5):
+    torch.manual_seed(0)
+    cases = [
+        # shape, val_range, size_average, normalize
+        ((2, 3, 336, 336), 2, True, True),
+        ((2, 3, 336, 336), None, True, True),
+        ((1, 3, 256, 200), None, False, False),
+        ((4, 1, 64, 64), 1, True, False),
+    ]
+    for shape, val_range, size_average, normalize in cases:
+        y = torch.rand(shape, device=device, dtype=torch.float64) * 2 - 1
+        x = (y + 0.1 * torch.randn_like(y)).clamp(-1, 1)
+        x_new = x.clone().requires_grad_(True)
+        x_ref = x.clone().requires_grad_(True)
+
+        s_new, cs_new = ssim(x_new, y, size_average=size_average, full=True, val_range=val_range)
+        s_ref, cs_ref = reference_ssim(x_ref, y, size_average=size_average, full=True, val_range=val_range)
+        torch.testing.assert_close(s_new, s_ref, atol=atol, rtol=0)
+        torch.testing.assert_close(cs_new, cs_ref, atol=atol, rtol=0)
+
+        if size_average:
+            m_new = msssim(x_new, y, val_range=val_range, normalize=normalize)
+            m_ref = reference_msssim(x_ref, y, val_range=val_range, normalize=normalize)
+            torch.testing.assert_close(m_new, m_ref, atol=atol, rtol=0)
+            m_new.backward()
+            m_ref.backward()
+            torch.testing.assert_close(x_new.grad, x_ref.grad, atol=atol, rtol=1e-4)
+        print(f"ok  shape={shape} val_range={val_range} size_average={size_average}")
+
+
+def benchmark(fn, x, y, iters, device):
+    def run():
+        x.grad = None
+        fn(x, y).backward()
+
+    for _ in range(3):
+        run()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        run()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iters * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--size", type=int, default=336)
+    parser.add_argument("--iters", type=int, default=20)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    check_equivalence(device)
+
+    y = torch.rand(args.batch, 3, args.size, args.size, device=device) * 2 - 1
+    x = (y + 0.1 * torch.randn_like(y)).clamp(-1, 1).requires_grad_(True)
+    ref_ms = benchmark(
+        lambda a, b: reference_msssim(a, b, normalize=True), x, y, args.iters, device
+    )
+    new_ms = benchmark(
+        lambda a, b: msssim(a, b, val_range=2, normalize=True), x, y, args.iters, device
+    )
+    print(f"msssim fwd+bwd {tuple(x.shape)}: reference {ref_ms:.2f} ms, new {new_ms:.2f} ms "
+          f"({ref_ms / new_ms:.2f}x)")
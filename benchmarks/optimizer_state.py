@@ -0,0 +1,76 @@
+"""Optimizer-state memory and step time for each --optim_state / --optim_factored / --optim_offload mode.
+
+Usage: python -m benchmarks.optimizer_state --device cuda:0 --model convnext
+"""
+
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+import torchvision
+
+from models.fusenet import Block
+from optimizer import LeanAdamW, state_bytes
+
+
+MODES = {
+    "torch AdamW fp32": None,
+    "fp32": dict(state_dtype="fp32"),
+    "bf16": dict(state_dtype="bf16"),
+    "int8": dict(state_dtype="int8"),
+    "int8+factored": dict(state_dtype="int8", factored=True),
+    "bf16+offload": dict(state_dtype="bf16", offload=True),
+    "int8+factored+offload": dict(state_dtype="int8", factored=True, offload=True),
+}
+
+
+def build_model(name):
+    if name == "dnet":
+        return torchvision.models.densenet201(num_classes=1)
+    # The 27 stage-3 blocks at dim 1024 hold most of the generator's parameters
+    return nn.Sequential(*[Block(1024) for _ in range(27)])
+
+
+def measure(model, kwargs, device, iters):
+    params = list(model.parameters())
+    if kwargs is None:
+        optimizer = torch.optim.AdamW(params, lr=1e-4, betas=(0.9, 0.95), foreach=True)
+    else:
+        optimizer = LeanAdamW(params, lr=1e-4, betas=(0.9, 0.95), caution=True, **kwargs)
+    for p in params:
+        p.grad = torch.randn_like(p) * 1e-3
+
+    optimizer.step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        optimizer.step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    ms = (time.perf_counter() - start) / iters * 1000
+
+    sizes = state_bytes(optimizer)
+    del optimizer
+    return ms, sizes.get(device.type, 0) / 2**20, sizes.get("cpu", 0) / 2**20 if device.type != "cpu" else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--model", type=str, default="convnext", choices=["convnext", "dnet"])
+    parser.add_argument("--iters", type=int, default=5)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    model = build_model(args.model).to(device)
+    n_params = sum(p.numel() for p in model.parameters())
+    print(f"{args.model}: {n_params / 1e6:.1f}M parameters, "
+          f"{n_params * 4 / 2**20:.1f} MiB of fp32 weights")
+    print(f"{'mode':<24}{'step ms':>10}{'device MiB':>12}{'host MiB':>10}")
+    for name, kwargs in MODES.items():
+        if kwargs and kwargs.get("offload") and device.type != "cuda":
+            continue
+        ms, device_mib, host_mib = measure(model, kwargs, device, args.iters)
+        print(f"{name:<24}{ms:>10.1f}{device_mib:>12.1f}{host_mib:>10.1f}")
@@ -0,0 +1,72 @@
+"""Compare FusedPixelLoss against summing the separate pixel losses from utils.py.
+
+Usage: python -m benchmarks.pixel_loss --device cuda:0
+"""
+
+import argparse
+import time
+
+import torch
+
+from utils import CharbonnierLoss, FusedPixelLoss, SmoothFocalL1Loss, SqrtLoss
+
+
+WEIGHTS = {"l1": 1.0, "charbonnier": 0.5, "focal": 0.25, "sqrt": 0.1}
+
+
+def separate_losses():
+    l1, charbonnier = torch.nn.L1Loss(), CharbonnierLoss()
+    focal, sqrt = SmoothFocalL1Loss(), SqrtLoss()
+
+    def loss(x, y):
+        return (
+            WEIGHTS["l1"] * l1(x, y)
+            + WEIGHTS["charbonnier"] * charbonnier(x, y)
+            + WEIGHTS["focal"] * focal(x, y)
+            + WEIGHTS["sqrt"] * sqrt(x, y)
+        )
+
+    return loss
+
+
+def measure(loss_fn, shape, device, iters):
+    y = torch.rand(shape, device=device) * 2 - 1
+    x = (torch.rand(shape, device=device) * 2 - 1).requires_grad_(True)
+
+    def run():
+        x.grad = None
+        loss_fn(x, y).backward()
+
+    for _ in range(3):
+        run()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        run()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        peak = (torch.cuda.max_memory_allocated(device) - base) / 2**20
+    else:
+        peak = float("nan")
+    return (time.perf_counter() - start) / iters * 1000, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--iters", type=int, default=20)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    candidates = {
+        "separate": separate_losses(),
+        "fused": FusedPixelLoss(**WEIGHTS),
+        "fused+compile": FusedPixelLoss(**WEIGHTS, compile=True),
+    }
+    for shape in [(8, 3, 336, 336), (1, 3, 2048, 2048)]:
+        for name, loss_fn in candidates.items():
+            ms, mib = measure(loss_fn, shape, device, args.iters)
+            print(f"{str(shape):<20} {name:<14} {ms:8.2f} ms  peak {mib:8.1f} MiB")
@@ -0,0 +1,104 @@
+"""Seam error of tiled inference against whole-image inference, per blend mode and overlap.
+
+The reference is one forward pass over the whole image, so --tile should be small enough that a
+few tiles fit in the image and the full pass still fits in memory. "seam MAE" is the error on
+the rows/columns where a tile starts or ends, "PSNR" is over the whole image (against the
+reference, not the ground truth).
+
+The "patch" rows repeat the mean blend with the old per-patch padding (copyMakeBorder of the
+crop, see tiling.py). "padded" counts the edge tiles whose padding is longer than the part inside
+the image. Only those tiles differ between the two paths. "vs tiler" is the MAE against the
+current tiler output.
+
+Usage: python -m benchmarks.seam_error CKPT IMAGE --tile 512 --overlaps 0 32 64 128 --device cuda:0
+"""
+
+import argparse
+from unittest import mock
+
+import cv2
+import numpy as np
+import torch
+
+from checkpoint import load_inference_model
+from tiling import BLEND_MODES, ArraySink, Tiler, predict_image
+
+
+def seam_mask(height, width, coords, size):
+    mask = np.zeros((height, width), dtype=bool)
+    for x, y in coords:
+        for row in (x, x + size - 1):
+            if 0 < row < height - 1:
+                mask[row, y : y + size] = True
+        for col in (y, y + size - 1):
+            if 0 < col < width - 1:
+                mask[x : x + size, col] = True
+    return mask
+
+
+def crop_tile_per_patch(image, x, y, size):
+    """旧的 split_image_into_patches_with_overlap：先裁剪到图像内，再对裁剪结果做 BORDER_REFLECT"""
+    h, w = image.shape[:2]
+    patch = np.asarray(image[x : min(x + size, h), y : min(y + size, w)])
+    bottom, right = size - patch.shape[0], size - patch.shape[1]
+    if bottom or right:
+        patch = cv2.copyMakeBorder(patch, 0, bottom, 0, right, cv2.BORDER_REFLECT)
+    return patch
+
+
+def padded_tiles(height, width, coords, size):
+    """填充长度超过 tile 在图像内部分的 tile 数，只有这些 tile 的两种反射方式不同"""
+    return sum(
+        size - min(size, height - x) > height - x or size - min(size, width - y) > width - y
+        for x, y in coords
+    )
+
+
+@torch.inference_mode()
+def full_image(model, image, device):
+    dtype = next(model.parameters()).dtype
+    x = torch.from_numpy(image).to(device).permute(2, 0, 1)[None].to(dtype) / 127.5 - 1
+    out = ((model(x).float()[0] + 1) * 127.5).clamp(0, 255).to(torch.uint8)
+    return out.permute(1, 2, 0).cpu().numpy().astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ckpt", type=str, help="checkpoint, slim checkpoint directory or .safetensors")
+    parser.add_argument("image", type=str)
+    parser.add_argument("--tile", type=int, default=512)
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0, 32, 64, 128])
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    model = load_inference_model(args.ckpt, device)
+
+    image = cv2.imread(args.image)
+    # 整图推理要求尺寸是 32 的倍数
+    h, w = (s // 32 * 32 for s in image.shape[:2])
+    image = np.ascontiguousarray(image[:h, :w])
+    reference = full_image(model, image, device)
+
+    print(f"{'blend':<10}{'overlap':>8}{'tiles':>7}{'padded':>8}{'seam MAE':>10}{'MAE':>8}{'PSNR':>8}{'vs tiler':>10}")
+    for overlap in args.overlaps:
+        tiler = Tiler(args.tile, overlap, args.batch_size, device)
+        coords = tiler.coords(h, w)
+        mask = seam_mask(h, w, coords, args.tile)
+        padded = padded_tiles(h, w, coords, args.tile)
+        outputs = {}
+        for blend in (*BLEND_MODES, "patch"):
+            if blend == "patch":
+                with mock.patch("tiling.crop_tile", crop_tile_per_patch):
+                    sink = predict_image(model, image, tiler, ArraySink(h, w), blend="mean")
+            else:
+                sink = predict_image(model, image, tiler, ArraySink(h, w), blend=blend)
+            outputs[blend] = sink.array
+            error = np.abs(sink.array - reference)
+            mse = float(np.mean(error**2))
+            psnr = 10 * np.log10(255**2 / mse) if mse > 0 else float("inf")
+            seam = float(error[mask].mean()) if mask.any() else 0.0
+            versus = float(np.abs(sink.array - outputs["mean"]).mean())
+            print(f"{blend:<10}{overlap:>8}{len(coords):>7}{padded:>8}{seam:>10.3f}{error.mean():>8.3f}"
+                  f"{psnr:>8.2f}{versus:>10.3f}")
@@ -0,0 +1,55 @@
+"""Generator start-up time: eager construction + load_state_dict vs meta-device construction + assign.
+
+Usage: python -m benchmarks.startup CKPT [--artifact OUT.safetensors] [--device cuda:0] [--forward]
+"""
+
+import argparse
+import time
+
+import torch
+
+from checkpoint import generator_state_dict, load_inference_model
+from models.fusenet import convnext_plus_head
+
+
+def legacy(state_dict):
+    # 原来的流程：读 ImageNet 权重、随机初始化，再被 checkpoint 整体覆盖
+    model = convnext_plus_head()
+    model.load_state_dict(state_dict)
+    return model
+
+
+def timed(fn, device):
+    start = time.perf_counter()
+    model = fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return model, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("ckpt", type=str, help="Lightning checkpoint or slim checkpoint directory")
+    parser.add_argument("--artifact", type=str, default=None, help="exported .safetensors")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--forward", action="store_true", help="also time the first 2048 tile")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    cases = {
+        "eager + load_state_dict": lambda: legacy(generator_state_dict(args.ckpt)).to(device),
+        "meta + assign (ckpt)": lambda: load_inference_model(args.ckpt, device),
+    }
+    if args.artifact:
+        cases["meta + assign (mmap)"] = lambda: load_inference_model(args.artifact, device)
+
+    print(f"{'path':<28}{'load s':>10}{'first tile s':>14}")
+    for name, fn in cases.items():
+        model, seconds = timed(fn, device)
+        first = float("nan")
+        if args.forward:
+            x = torch.randn(1, 3, 2048, 2048, device=device, dtype=next(model.parameters()).dtype)
+            with torch.inference_mode():
+                _, first = timed(lambda: model.eval()(x), device)
+        print(f"{name:<28}{seconds:>10.2f}{first:>14.2f}")
+        del model
@@ -0,0 +1,68 @@
+"""Latency and quality of each TTA policy for tiled inference.
+
+For every policy the images are run through the batched tiler; the table reports seconds per
+image, megapixels per second and mean PSNR / SSIM against the ground truth (or against the
+no-TTA output when no GT directory is given).
+
+Usage: python -m benchmarks.tta_policies CKPT INPUT_DIR [--gt GT_DIR] [--policies none hflip flips d4]
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+from skimage.metrics import peak_signal_noise_ratio as psnr
+from skimage.metrics import structural_similarity as ssim
+
+from checkpoint import load_inference_model
+from tiling import ArraySink, Tiler, predict_image
+from tta import POLICIES
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ckpt", type=str, help="checkpoint, slim checkpoint directory or .safetensors")
+    parser.add_argument("input", type=str, help="directory of hazy images")
+    parser.add_argument("--gt", type=str, default=None)
+    parser.add_argument("--policies", type=str, nargs="+", default=list(POLICIES), choices=list(POLICIES))
+    parser.add_argument("--limit", type=int, default=5, help="number of images")
+    parser.add_argument("--tile", type=int, default=2048)
+    parser.add_argument("--overlap", type=int, default=512)
+    parser.add_argument("--batch_size", type=int, default=1, help="tiles per batch, each expanded by the TTA set")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    model = load_inference_model(args.ckpt, device)
+
+    names = sorted(os.listdir(args.input))[: args.limit]
+    images = [cv2.imread(os.path.join(args.input, name)) for name in names]
+    references = None
+    if args.gt:
+        references = [cv2.imread(os.path.join(args.gt, name)) for name in names]
+    tiler = Tiler(args.tile, args.overlap, args.batch_size, device)
+    megapixels = sum(image.shape[0] * image.shape[1] for image in images) / 1e6
+
+    print(f"{'policy':<8}{'passes':>7}{'s/img':>8}{'MP/s':>8}{'PSNR':>8}{'SSIM':>8}")
+    for policy in args.policies:
+        outputs = []
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        for image in images:
+            sink = predict_image(model, image, tiler, ArraySink(*image.shape[:2], dtype=np.uint8), policy)
+            outputs.append(sink.array)
+        seconds = time.perf_counter() - start
+        if references is None:
+            # 没有 GT 时以第一个策略 (默认 none) 的输出为参照
+            references = outputs
+        scores = [
+            (psnr(ref, out, data_range=255), ssim(ref, out, data_range=255, channel_axis=2))
+            for ref, out in zip(references, outputs)
+        ]
+        mean_psnr, mean_ssim = np.mean(scores, axis=0)
+        print(f"{policy:<8}{len(POLICIES[policy]):>7}{seconds / len(images):>8.2f}"
+              f"{megapixels / seconds:>8.2f}{mean_psnr:>8.2f}{mean_ssim:>8.4f}")
@@ -0,0 +1,98 @@
+"""读取生成器权重与构建推理模型，只依赖 torch；训练时的 AsyncSlimCheckpoint 在 slim_checkpoint.py。"""
+
+import glob
+import os
+
+import torch
+
+
+BIAS_KEY = "convnext_branch.attention0.conv1.bias"  # 训练时 bias=True 的生成器才有
+
+
+def generator_state_dict(path, ema=False, base=None):
+    """读取生成器权重。
+
+    path 可以是 Lightning 训练 checkpoint (去掉 "model." 前缀，丢弃 lpips / DNet 等)、
+    AsyncSlimCheckpoint 写出的目录或 export.py 的 .safetensors (是否 EMA 在导出时已确定)；
+    ema=True 时用 EMA shadow 覆盖对应参数。
+    LoRA 训练的 checkpoint 只有 adapter，与基础权重合并后返回完整的生成器权重；
+    基础权重默认取训练时记录的 --init_ckpt，base 可以覆盖它。
+    """
+    if path.endswith(".safetensors"):
+        from export import load_artifact
+
+        return load_artifact(path)[0]
+    if os.path.isdir(path):
+        state_dict = load_part(path, "generator")
+        if ema:
+            state_dict.update(load_part(path, "ema"))
+        lora_path = os.path.join(path, "lora.pt")
+        lora = torch.load(lora_path, weights_only=False) if os.path.exists(lora_path) else None
+    else:
+        ckpt = torch.load(path, map_location="cpu", weights_only=False)
+        state_dict = {
+            k[len("model.") :]: v for k, v in ckpt["state_dict"].items() if k.startswith("model.")
+        }
+        if ema:
+            if "ema" not in ckpt:
+                raise KeyError(f"{path} has no EMA shadow")
+            state_dict.update(ckpt["ema"])
+        lora = ckpt.get("lora")
+    if lora is None:
+        return state_dict
+
+    from models.lora import merge_lora_state_dict
+
+    base = base or lora.get("base")
+    if not base:
+        raise ValueError(
+            f"{path} only holds a LoRA adapter (rank {lora['rank']}) and records no base weights; "
+            "pass base= the --init_ckpt it was trained from"
+        )
+    return merge_lora_state_dict(generator_state_dict(base), state_dict, lora["rank"], lora.get("alpha"))
+
+
+def load_part(dirpath, part):
+    """读取 AsyncSlimCheckpoint 保存的一个部分，按 rank 分片保存时自动合并"""
+    path = os.path.join(dirpath, f"{part}.pt")
+    if os.path.exists(path):
+        return torch.load(path, map_location="cpu", weights_only=False)
+    shards = sorted(glob.glob(os.path.join(dirpath, f"{part}.rank*.pt")))
+    if not shards:
+        raise FileNotFoundError(f"no '{part}' in {dirpath}")
+    state_dict = {}
+    for shard in shards:
+        state_dict.update(torch.load(shard, map_location="cpu", weights_only=False))
+    return state_dict
+
+
+def build_inference_model(state_dict, device="cpu"):
+    """由完整的生成器权重构建 eval 模式的模型，训练时是否 bias=True 由 BIAS_KEY 判断"""
+    from models.fusenet import build_generator
+
+    return build_generator(state_dict, bias=BIAS_KEY in state_dict, device=device).eval()
+
+
+def load_inference_model(path, device="cpu", ema=False, fuse=False):
+    """按文件类型构建 eval 模式的生成器，各推理入口共用。
+
+    path 可以是 quantize.py 的 .int8.pt (只能在 CPU 上运行，忽略 device)、export.py 的 .safetensors、
+    Lightning checkpoint 或精简 checkpoint 目录 (包括 LoRA adapter，见 generator_state_dict)。
+    fuse=True 时再做 models.fuse.fuse_for_inference 的等价折叠。
+    """
+    if path.endswith(".int8.pt"):
+        from quantize import load_quantized
+
+        return load_quantized(path)
+    if path.endswith(".safetensors"):
+        from export import load_generator
+
+        model, _ = load_generator(path, device)
+    else:
+        model = build_inference_model(generator_state_dict(path, ema=ema), device)
+    model.eval()
+    if fuse:
+        from models.fuse import fuse_for_inference
+
+        model, _ = fuse_for_inference(model)
+    return model
@@ -10,16 +10,17 @@ from albumentations.pytorch import ToTensorV2
 from option import get_option
 from sklearn.model_selection import train_test_split
 
-opt = get_option()
 
-train_transform = A.Compose(
-    [
-        A.RandomCrop(opt.image_size, opt.image_size),
-        A.RandomGridShuffle((2, 2)),
-        A.HorizontalFlip(p=0.5),
-        ToTensorV2(transpose_mask=True),
-    ]
-)
+def get_train_transform(image_size):
+    return A.Compose(
+        [
+            A.RandomCrop(image_size, image_size),
+            A.RandomGridShuffle((2, 2)),
+            A.HorizontalFlip(p=0.5),
+            ToTensorV2(transpose_mask=True),
+        ]
+    )
+
 
 valid_transform = A.Compose(
     [
@@ -32,6 +33,12 @@ valid_transform = A.Compose(
 )
 
 
+def split_image_list(dataset_root, valid_rate):
+    """训练 / 验证划分 (不加载图像)，Dataset 与 quantize.py 等脚本的验证报告共用"""
+    image_list = os.listdir(os.path.join(dataset_root, "train", "gt"))
+    return train_test_split(image_list, test_size=valid_rate, random_state=413)
+
+
 class Dataset(torch.utils.data.Dataset):
     def __init__(self, phase, opt, transform=None):
         self.phase = phase
@@ -39,13 +46,11 @@ class Dataset(torch.utils.data.Dataset):
         self.dataset_root = opt.dataset_root
         self.transform = transform
         self.crops_per_image = opt.crops_per_image if phase == "train" else 1
-        self.dataset_root = os.path.join(self.dataset_root, "train")
-        self.image_list = os.listdir(os.path.join(self.dataset_root, "gt"))
-
         # Split data into train and validation sets
-        train_images, val_images = train_test_split(
-            self.image_list, test_size=opt.valid_image_rate, random_state=413
+        train_images, val_images = split_image_list(
+            self.dataset_root, opt.valid_image_rate
         )
+        self.dataset_root = os.path.join(self.dataset_root, "train")
 
         if self.phase == "train":
             self.image_list = train_images
@@ -136,9 +141,21 @@ class Dataset(torch.utils.data.Dataset):
         return len(self.input_list) * self.crops_per_image
 
 
-def get_dataloader(opt):
-    train_dataset = Dataset(phase="train", opt=opt, transform=train_transform)
+def get_valid_dataloader(opt):
     valid_dataset = Dataset(phase="valid", opt=opt, transform=valid_transform)
+    return torch.utils.data.DataLoader(
+        valid_dataset,
+        batch_size=1,
+        shuffle=False,
+        num_workers=opt.num_workers,
+        pin_memory=True,
+    )
+
+
+def get_dataloader(opt):
+    train_dataset = Dataset(
+        phase="train", opt=opt, transform=get_train_transform(opt.image_size)
+    )
     train_dataloader = torch.utils.data.DataLoader(
         train_dataset,
         batch_size=opt.batch_size,
@@ -147,17 +164,11 @@ def get_dataloader(opt):
         pin_memory=True,
         drop_last=True,
     )
-    valid_dataloader = torch.utils.data.DataLoader(
-        valid_dataset,
-        batch_size=1,
-        shuffle=False,
-        num_workers=opt.num_workers,
-        pin_memory=True,
-    )
-    return train_dataloader, valid_dataloader
+    return train_dataloader, get_valid_dataloader(opt)
 
 
 if __name__ == "__main__":
+    opt = get_option()
     train_dataloader, valid_dataloader = get_dataloader(opt)
     for i, (low, high) in enumerate(train_dataloader):
         pass
@@ -0,0 +1,98 @@
+"""Multi-checkpoint ensembles that run as a single model.
+
+An Ensemble holds N generators and returns the weighted mean of their outputs. To the tiler
+it is just another model, so every image is decoded and tiled once and every tile goes
+through all members before it is blended into the canvas. Members can be plain checkpoints
+or weight averages of several checkpoints (one forward pass for the price of N).
+
+TTA can run inside the ensemble: either every member runs the full transform set, or with
+interleave=True member i runs only transform i (mod the set), spreading the transforms across
+members instead of multiplying the passes.
+"""
+
+import torch
+import torch.nn as nn
+
+from checkpoint import build_inference_model, generator_state_dict, load_inference_model
+from tta import resolve, tta_forward
+
+
+def average_state_dicts(state_dicts, weights=None):
+    """按权重平均多组 state_dict (model soup)，浮点张量在 float32 中累加后转回原 dtype"""
+    weights = weights or [1.0] * len(state_dicts)
+    total = sum(weights)
+    averaged = {}
+    for key, value in state_dicts[0].items():
+        if not value.is_floating_point():
+            averaged[key] = value
+            continue
+        acc = sum(w * sd[key].float() for w, sd in zip(weights, state_dicts))
+        averaged[key] = (acc / total).to(value.dtype)
+    return averaged
+
+
+def load_member(paths, weights=None, device="cpu", ema=False):
+    """构建一个成员；paths 为多个路径时使用它们的权重平均。
+
+    单个路径与 predict.py 相同地由 checkpoint.load_inference_model 加载 (支持 .int8.pt)，
+    ema=True 时使用 checkpoint 中的 EMA shadow。
+    """
+    if isinstance(paths, str):
+        return load_inference_model(paths, device, ema=ema)
+    if any(p.endswith(".int8.pt") for p in paths):
+        raise ValueError(f"int8 models cannot be weight-averaged: {paths}")
+    state_dicts = [generator_state_dict(p, ema=ema) for p in paths]
+    return build_inference_model(average_state_dicts(state_dicts, weights), device)
+
+
+class Ensemble(nn.Module):
+    def __init__(self, members, weights=None, tta=False, interleave=False, max_batch=None):
+        super().__init__()
+        self.members = nn.ModuleList(members)
+        self.weights = list(weights or [1.0] * len(members))
+        if len(self.weights) != len(self.members):
+            raise ValueError(f"{len(self.members)} members but {len(self.weights)} weights")
+        self.transforms = resolve(tta)
+        self.interleave = interleave
+        self.max_batch = max_batch
+
+    def member_transforms(self, index):
+        if self.interleave:
+            return (self.transforms[index % len(self.transforms)],)
+        return self.transforms
+
+    def forward(self, x):
+        total = None
+        for i, (member, weight) in enumerate(zip(self.members, self.weights)):
+            dtype = next(member.parameters()).dtype
+            output = tta_forward(member, x.to(dtype), self.member_transforms(i), self.max_batch)
+            total = weight * output if total is None else total + weight * output
+        return total / sum(self.weights)
+
+
+def build_ensemble(specs, ckpt_paths=None, tta=False, interleave=False, device="cpu", ema=False):
+    """按 predict.py 的配置构建 Ensemble，ema 对所有成员生效。
+
+    每个 spec 为 {"ckpt": 路径或路径列表, "weight": 集成权重, "average_weights": 平均权重}，
+    也可以用 "ckpt_index" (整数或列表) 引用 ckpt_paths。
+    """
+    members, weights = [], []
+    for spec in specs:
+        paths = spec.get("ckpt")
+        if paths is None:
+            index = spec["ckpt_index"]
+            paths = ckpt_paths[index] if isinstance(index, int) else [ckpt_paths[i] for i in index]
+        print(f"Loading ensemble member: {paths}")
+        members.append(load_member(paths, spec.get("average_weights"), device, ema))
+        weights.append(spec.get("weight", 1.0))
+    return Ensemble(members, weights, tta, interleave)
+
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+    members = [nn.Conv2d(3, 3, 3, padding=1) for _ in range(3)]
+    x = torch.randn(2, 3, 32, 32)
+    ensemble = Ensemble(members, [1.0, 2.0, 1.0], tta="d4", interleave=True)
+    print(ensemble(x).shape)
+    soup = average_state_dicts([m.state_dict() for m in members])
+    print({k: v.shape for k, v in soup.items()})
@@ -0,0 +1,131 @@
+"""Export the generator into a standalone inference artifact.
+
+The file uses the safetensors layout (8-byte little-endian header size, JSON header with
+per-tensor dtype/shape/offsets and a "__metadata__" entry, then the raw tensor bytes), so it can
+be memory-mapped and loaded without unpickling a training checkpoint.
+
+Usage: python export.py CKPT OUT.safetensors [--ema] [--dtype fp16] [--lora ADAPTER]
+"""
+
+import argparse
+import json
+import struct
+
+import numpy as np
+import torch
+
+
+DTYPES = {
+    torch.float32: ("F32", np.float32),
+    torch.float16: ("F16", np.float16),
+    # numpy has no bfloat16, the raw bits are mapped as uint16 and reinterpreted by torch
+    torch.bfloat16: ("BF16", np.uint16),
+}
+DTYPE_NAMES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+ALIGNMENT = 64
+
+
+def save_artifact(state_dict, path, metadata=None):
+    header = {}
+    offset = 0
+    for name, tensor in state_dict.items():
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": DTYPES[tensor.dtype][0],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+    header["__metadata__"] = {k: str(v) for k, v in (metadata or {}).items()}
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    # 头部补齐到 ALIGNMENT，mmap 出来的张量起始地址对齐
+    header_bytes += b" " * (-(8 + len(header_bytes)) % ALIGNMENT)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for tensor in state_dict.values():
+            tensor = tensor.detach().cpu().contiguous()
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            f.write(tensor.numpy().tobytes())
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size))
+    return header, 8 + size
+
+
+def load_artifact(path):
+    """返回 (state_dict, metadata)。张量是文件的 copy-on-write 内存映射，读取时才真正从磁盘载入。"""
+    header, data_start = read_header(path)
+    metadata = header.pop("__metadata__", {})
+    buffer = np.memmap(path, dtype=np.uint8, mode="c", offset=data_start)
+    names = {v[0]: k for k, v in DTYPES.items()}
+    state_dict = {}
+    for name, info in header.items():
+        dtype = names[info["dtype"]]
+        begin, end = info["data_offsets"]
+        array = buffer[begin:end].view(DTYPES[dtype][1]).reshape(info["shape"])
+        tensor = torch.from_numpy(array)
+        state_dict[name] = tensor.view(torch.bfloat16) if dtype == torch.bfloat16 else tensor
+    return state_dict, metadata
+
+
+def load_generator(path, device="cpu"):
+    """按 artifact 的元数据构建生成器，参数直接使用 mmap 的张量，返回 (model, metadata)"""
+    from models.fusenet import build_generator
+
+    state_dict, metadata = load_artifact(path)
+    if metadata.get("architecture", "convnext_plus_head") != "convnext_plus_head":
+        raise ValueError(f"unsupported architecture: {metadata['architecture']}")
+    model = build_generator(
+        state_dict, bias=metadata.get("bias", "False") == "True", device=device
+    )
+    return model.eval(), metadata
+
+
+def export(ckpt, out, ema=False, dtype="fp32", lora=None, tile_size=2048, overlap=512):
+    from checkpoint import BIAS_KEY, generator_state_dict, load_inference_model
+
+    if lora is None:
+        state_dict = generator_state_dict(ckpt, ema=ema)
+    else:
+        # 合并 adapter 后导出，推理时不需要 LoRA 层
+        from models.lora import load_lora_adapter
+
+        model = load_inference_model(ckpt, ema=ema)
+        load_lora_adapter(model, lora, merge=True)
+        state_dict = {
+            k: v for k, v in model.state_dict().items() if "lora_" not in k
+        }
+
+    state_dict = {k: v.to(DTYPE_NAMES[dtype]) for k, v in state_dict.items()}
+    metadata = {
+        "architecture": "convnext_plus_head",
+        "bias": BIAS_KEY in state_dict,
+        "dtype": dtype,
+        "ema": ema,
+        "lora": lora,
+        "tile_size": tile_size,
+        "overlap": overlap,
+        "source": ckpt,
+    }
+    save_artifact(state_dict, out, metadata)
+    size = sum(v.numel() * v.element_size() for v in state_dict.values())
+    print(f"Exported {len(state_dict)} tensors ({size / 2**20:.1f} MiB) to {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ckpt", type=str, help="Lightning checkpoint or slim checkpoint directory")
+    parser.add_argument("out", type=str, help="output .safetensors path")
+    parser.add_argument("--ema", action="store_true", help="export the EMA shadow weights")
+    parser.add_argument("--dtype", type=str, default="fp32", choices=list(DTYPE_NAMES))
+    parser.add_argument("--lora", type=str, default=None, help="LoRA adapter merged before export")
+    parser.add_argument("--tile_size", type=int, default=2048)
+    parser.add_argument("--overlap", type=int, default=512)
+    args = parser.parse_args()
+    export(args.ckpt, args.out, args.ema, args.dtype, args.lora, args.tile_size, args.overlap)
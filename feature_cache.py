@@ -0,0 +1,182 @@
+"""--decoder_only 训练用的编码器特征缓存：冻结的 ConvNeXt 编码器输出只计算一次，存为 fp16 .npy memmap。"""
+
+import json
+import os
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+
+FEATURES = ("layer1", "layer2", "out")
+# (通道数, 相对输入的下采样倍数)，对应 ConvNeXt 编码器的三个输出
+FEATURE_SHAPES = {"layer1": (256, 4), "layer2": (512, 8), "out": (1024, 16)}
+
+
+def crop_grid(height, width, size, grid):
+    """在图像上均匀取 grid x grid 个 size x size 的裁剪框，返回左上角坐标"""
+    tops = np.linspace(0, height - size, grid).round().astype(int)
+    lefts = np.linspace(0, width - size, grid).round().astype(int)
+    return [(int(t), int(l)) for t in tops for l in lefts]
+
+
+def cache_exists(cache_dir):
+    # meta.json 最后写入，存在即说明缓存完整
+    return os.path.exists(os.path.join(cache_dir, "meta.json"))
+
+
+def cache_signature(opt, model):
+    """决定缓存内容的设置：裁剪尺寸 / 网格、训练数据和编码器权重 (LoRA 旁路 B 初始为 0，不影响编码器输出)"""
+    from result_cache import model_digest
+
+    return {
+        "size": opt.image_size,
+        "grid": opt.cache_grid,
+        "dataset_root": opt.dataset_root,
+        "valid_image_rate": opt.valid_image_rate,
+        "extra_data": opt.extra_data,
+        "init_ckpt": opt.init_ckpt,
+        "encoder": model_digest(model.convnext_branch.encoder, skip=("lora_",)),
+    }
+
+
+def cached_signature(cache_dir):
+    with open(os.path.join(cache_dir, "meta.json")) as f:
+        return json.load(f).get("signature")
+
+
+@torch.inference_mode()
+def build_feature_cache(
+    model, input_list, target_list, cache_dir, size, grid, device, batch_size=8, signature=None
+):
+    """对每张训练图像的固定裁剪网格预先计算编码器输出，以 fp16 写入 .npy memmap。
+
+    Args:
+        model: convnext_plus_head，使用其 encode()
+        input_list / target_list: BGR uint8 图像 (与 Dataset.input_list 相同)
+        cache_dir: 输出目录，包含 layer1/layer2/out/target.npy 和 meta.json
+        signature: cache_signature 的结果，写入 meta.json 供之后检查缓存是否过期
+    """
+    if size % 16 != 0:
+        raise ValueError(f"crop size must be a multiple of 16, got {size}")
+    os.makedirs(cache_dir, exist_ok=True)
+    # 覆盖旧缓存时先去掉完成标记，中途失败不会留下看似完整的缓存
+    if cache_exists(cache_dir):
+        os.remove(os.path.join(cache_dir, "meta.json"))
+
+    crops = [
+        (i, top, left)
+        for i, image in enumerate(input_list)
+        for top, left in crop_grid(image.shape[0], image.shape[1], size, grid)
+    ]
+    n = len(crops)
+    arrays = {
+        name: np.lib.format.open_memmap(
+            os.path.join(cache_dir, f"{name}.npy"),
+            mode="w+",
+            dtype=np.float16,
+            shape=(n, channels, size // stride, size // stride),
+        )
+        for name, (channels, stride) in FEATURE_SHAPES.items()
+    }
+    targets = np.lib.format.open_memmap(
+        os.path.join(cache_dir, "target.npy"), mode="w+", dtype=np.uint8, shape=(n, size, size, 3)
+    )
+
+    was_training = model.training
+    model.eval().to(device)
+    for start in tqdm(range(0, n, batch_size), desc="Caching encoder features"):
+        batch = crops[start : start + batch_size]
+        x = np.stack([input_list[i][t : t + size, l : l + size] for i, t, l in batch])
+        x = torch.from_numpy(x).to(device).permute(0, 3, 1, 2).float() / 127.5 - 1
+        for name, feature in zip(FEATURES, model.encode(x)):
+            arrays[name][start : start + len(batch)] = feature.half().cpu().numpy()
+        for k, (i, t, l) in enumerate(batch):
+            targets[start + k] = target_list[i][t : t + size, l : l + size]
+    model.train(was_training)
+
+    for array in (*arrays.values(), targets):
+        array.flush()
+    with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+        json.dump(
+            {"size": size, "grid": grid, "num_crops": n, "crops": crops, "signature": signature}, f
+        )
+
+
+class FeatureCacheDataset(torch.utils.data.Dataset):
+    """从 build_feature_cache 的输出读取 (layer1, layer2, out, target)。
+
+    特征保持 fp16 以减少拷贝量，由训练步转换为 float。memmap 在每个 worker 内首次访问时打开。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.arrays = None
+
+    def _open(self):
+        self.arrays = {
+            name: np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode="r")
+            for name in (*FEATURES, "target")
+        }
+
+    def __getitem__(self, index):
+        if self.arrays is None:
+            self._open()
+        features = [torch.from_numpy(np.array(self.arrays[name][index])) for name in FEATURES]
+        target = torch.from_numpy(np.array(self.arrays["target"][index])).permute(2, 0, 1)
+        return (*features, target.float() / 127.5 - 1.0)
+
+    def __len__(self):
+        return self.meta["num_crops"]
+
+
+def cache_device(devices=None):
+    """构建缓存用的设备：trainer 的第一个 GPU (即 rank 0 的设备)；没有 CUDA 时退回 CPU"""
+    if not torch.cuda.is_available():
+        return torch.device("cpu")
+    if isinstance(devices, (list, tuple)) and devices:
+        return torch.device("cuda", devices[0])
+    return torch.device("cuda", torch.cuda.current_device())
+
+
+def get_feature_cache_dataloader(opt, model, dataset_cls=None, devices=None):
+    """返回基于特征缓存的训练 dataloader，缓存不存在或已过期时先 (重新) 构建。
+
+    构建缓存需要原始训练图像，由 dataset_cls (dataset.Dataset) 加载；缓存有效时不再读取图像。
+    meta.json 中的 signature 与当前的 image_size / cache_grid / 数据 / init_ckpt / 编码器权重
+    不一致时视为过期。DDP 下只有 rank 0 在 trainer.fit 之前构建，其余进程启动时缓存已是最新。
+    devices 与传给 pl.Trainer 的相同，缓存在其中第一个设备上构建 (见 cache_device)。
+    """
+    signature = cache_signature(opt, model)
+    exists = cache_exists(opt.feature_cache_dir)
+    stale = exists and cached_signature(opt.feature_cache_dir) != signature
+    if not exists or stale:
+        state = "stale" if stale else "missing"
+        if int(os.environ.get("LOCAL_RANK", 0)) != 0:
+            raise RuntimeError(f"feature cache {opt.feature_cache_dir} is {state}")
+        print(f"Feature cache {opt.feature_cache_dir} is {state}, rebuilding")
+        train_dataset = dataset_cls(phase="train", opt=opt, transform=None)
+        build_feature_cache(
+            model,
+            train_dataset.input_list,
+            train_dataset.target_list,
+            opt.feature_cache_dir,
+            opt.image_size,
+            opt.cache_grid,
+            cache_device(devices),
+            batch_size=opt.batch_size,
+            signature=signature,
+        )
+        del train_dataset
+        model.cpu()
+
+    return torch.utils.data.DataLoader(
+        FeatureCacheDataset(opt.feature_cache_dir),
+        batch_size=opt.batch_size,
+        shuffle=True,
+        num_workers=opt.num_workers,
+        pin_memory=True,
+        drop_last=True,
+    )
@@ -0,0 +1,163 @@
+"""Export the generator as a static-shape graph for one tile size (ONNX or torch.export).
+
+The graph takes a N x 3 x tile x tile float32 batch in [-1, 1] and returns the dehazed batch.
+TTA can be folded into the graph, in which case the transforms are stacked, run and averaged
+inside it. Every export is checked against eager PyTorch on a random batch.
+
+OnnxRuntimeModule runs an exported .onnx file and ExportedProgramModule a .pt2 file behind the
+same interface as the PyTorch model, so the tiler, blending and stitching in tiling.py work
+unchanged (see backend.GraphBackend).
+
+Usage: python graph_export.py MODEL OUT.onnx|OUT.pt2 [--tile 1024] [--batch 1] [--tta hflip]
+"""
+
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from tta import resolve, tta_forward
+
+
+class TTAGraph(nn.Module):
+    """把 TTA 折叠进导出的图中"""
+
+    def __init__(self, model, tta=False):
+        super().__init__()
+        self.model = model
+        self.transforms = resolve(tta)
+
+    def forward(self, x):
+        return tta_forward(self.model, x, self.transforms)
+
+
+def example_input(tile, batch, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand(batch, 3, tile, tile, generator=generator) * 2 - 1
+
+
+def export_onnx(model, path, tile=1024, batch=1, tta=False, opset=17):
+    graph = TTAGraph(model, tta).eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            graph,
+            (example_input(tile, batch),),
+            path,
+            input_names=["input"],
+            output_names=["output"],
+            opset_version=opset,
+            dynamo=False,
+        )
+    return path
+
+
+def export_program(model, path, tile=1024, batch=1, tta=False):
+    graph = TTAGraph(model, tta).eval()
+    with torch.no_grad():
+        program = torch.export.export(graph, (example_input(tile, batch),))
+    torch.export.save(program, path)
+    return path
+
+
+def run_static(x, batch, tile, run):
+    """按图固定的 batch 分块执行，不足时补零，输出去掉补齐部分"""
+    if tuple(x.shape[1:]) != (3, tile, tile):
+        raise ValueError(f"graph was exported for 3x{tile}x{tile} tiles, got {tuple(x.shape[1:])}")
+    outputs = []
+    for chunk in x.float().split(batch):
+        n = len(chunk)
+        if n < batch:
+            chunk = torch.cat([chunk, chunk.new_zeros(batch - n, *chunk.shape[1:])])
+        outputs.append(run(chunk)[:n])
+    return torch.cat(outputs)
+
+
+class OnnxRuntimeModule(nn.Module):
+    """用 onnxruntime 执行导出的图。
+
+    图的 batch 和 tile 尺寸是固定的：输入按图的 batch 分块，不足时补零，输出去掉补齐部分。
+    没有参数，tiling.predict_tiles 按 float32 准备输入。
+    """
+
+    def __init__(self, path, providers=("CPUExecutionProvider",), threads=None):
+        super().__init__()
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=list(providers))
+        meta = self.session.get_inputs()[0]
+        self.input_name = meta.name
+        self.batch, _, self.tile, _ = meta.shape
+
+    def _run(self, chunk):
+        array = np.ascontiguousarray(chunk.detach().cpu().numpy())
+        return torch.from_numpy(self.session.run(None, {self.input_name: array})[0])
+
+    def forward(self, x):
+        return run_static(x, self.batch, self.tile, self._run).to(x.device)
+
+
+class ExportedProgramModule(nn.Module):
+    """执行 export_program 保存的 .pt2 (torch.export)，接口与 OnnxRuntimeModule 相同。
+
+    图的 batch 和 tile 尺寸从输入占位符的形状读取；参数是图中的 float32 常量，在 CPU 上运行。
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        program = torch.export.load(path)
+        user_inputs = set(program.graph_signature.user_inputs)
+        placeholder = next(n for n in program.graph.nodes if n.op == "placeholder" and n.name in user_inputs)
+        self.batch, _, self.tile, _ = (int(s) for s in placeholder.meta["val"].shape)
+        self.graph = program.module()
+
+    def forward(self, x):
+        with torch.no_grad():
+            return run_static(x.cpu(), self.batch, self.tile, self.graph).to(x.device)
+
+
+def load_graph(path, providers=("CPUExecutionProvider",), threads=None):
+    """按扩展名载入导出的图：.onnx 用 onnxruntime，.pt2 用 torch.export"""
+    if path.endswith(".onnx"):
+        return OnnxRuntimeModule(path, providers, threads)
+    if path.endswith(".pt2"):
+        return ExportedProgramModule(path)
+    raise ValueError(f"expected an .onnx or .pt2 graph, got {path}")
+
+
+def check_parity(model, path, tile, batch, tta=False):
+    """在随机输入上比较导出的图与 eager 模型的最大绝对误差"""
+    x = example_input(tile, batch, seed=1)
+    with torch.no_grad():
+        expected = TTAGraph(model, tta).eval()(x)
+        actual = load_graph(path)(x)
+    return float((expected - actual).abs().max())
+
+
+if __name__ == "__main__":
+    from checkpoint import load_inference_model
+    from models.fuse import fuse_for_inference
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", type=str, help="checkpoint, slim checkpoint directory or .safetensors")
+    parser.add_argument("out", type=str, help=".onnx (onnxruntime) or .pt2 (torch.export)")
+    parser.add_argument("--tile", type=int, default=1024)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--tta", type=str, default="none", help="TTA policy folded into the graph")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--tolerance", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    model, _ = fuse_for_inference(load_inference_model(args.model).float())
+
+    if args.out.endswith(".onnx"):
+        export_onnx(model, args.out, args.tile, args.batch, args.tta, args.opset)
+    else:
+        export_program(model, args.out, args.tile, args.batch, args.tta)
+    error = check_parity(model, args.out, args.tile, args.batch, args.tta)
+    print(f"Exported {args.out}: max abs error vs eager {error:.2e}")
+    if error > args.tolerance:
+        raise SystemExit(f"parity check failed (tolerance {args.tolerance})")
@@ -0,0 +1,258 @@
+"""Receptive-field-aware halo tiling.
+
+Each tile is an output core plus a halo of input context on every side; the model output is
+cropped back to the core and written once, so there is no overlap averaging. The halo is taken
+from the measured effective receptive field (ERF): the theoretical receptive field of the
+stride-16 ConvNeXt encoder is well over a thousand pixels, but almost all of the gradient mass
+of an output pixel lies much closer.
+
+The CALayer global pooling in CP_Attention_block sees only the tile, which makes every tile
+depend on all of its input. GlobalPooling captures the pooled vectors from one pass over the
+whole image downscaled to max_size and injects them into every tile. All tiles then share one
+set of image-level statistics, and the remaining dependence is local. The vectors come from a
+downscaled image, so they only approximate the full-resolution ones, and the output
+approximates whole-image inference rather than matching it. `python halo.py stats` measures both
+errors against a full-resolution whole-image pass for a given checkpoint and image.
+
+Usage:
+    python halo.py measure MODEL [--size 1024] [--energy 0.99]
+    python halo.py predict MODEL INPUT OUTPUT [--tile 2048] [--halo 256] [--global_stats]
+    python halo.py stats MODEL INPUT [--max_sizes 512 1024 2048] [--tile 1024] [--halo 256]
+"""
+
+import math
+from contextlib import contextmanager, nullcontext
+
+import cv2
+import numpy as np
+import torch
+
+from models.fusenet import CALayer
+from tiling import tile_coords
+
+
+STRIDE = 16  # 编码器总下采样倍数，tile 和 halo 都按它对齐
+
+
+class GlobalPooling:
+    """捕获 / 注入 CALayer 中 AdaptiveAvgPool2d 的输出 (N x C x 1 x 1)"""
+
+    def __init__(self, model):
+        self.pools = [m.avg_pool for m in model.modules() if isinstance(m, CALayer)]
+        self.vectors = None
+
+    @contextmanager
+    def _hooks(self, hook):
+        handles = [pool.register_forward_hook(hook(i)) for i, pool in enumerate(self.pools)]
+        try:
+            yield self
+        finally:
+            for handle in handles:
+                handle.remove()
+
+    def capture(self):
+        self.vectors = [None] * len(self.pools)
+
+        def hook(i):
+            def fn(module, inputs, output):
+                self.vectors[i] = output.detach()
+
+            return fn
+
+        return self._hooks(hook)
+
+    def inject(self):
+        if self.vectors is None or any(v is None for v in self.vectors):
+            raise RuntimeError("no pooled vectors captured")
+
+        def hook(i):
+            def fn(module, inputs, output):
+                vector = self.vectors[i].to(output.dtype)
+                return vector.expand(output.shape[0], -1, -1, -1)
+
+            return fn
+
+        return self._hooks(hook)
+
+
+def _to_input(image, device, dtype):
+    x = torch.from_numpy(np.ascontiguousarray(image)).to(device)
+    return x.permute(2, 0, 1)[None].to(dtype) / 127.5 - 1
+
+
+@torch.inference_mode()
+def capture_global_statistics(model, image, max_size=1024):
+    """在缩小到长边不超过 max_size 的整图上推理一次，记录各 CALayer 的池化向量。
+
+    缩小后的统计量只是全分辨率统计量的近似，误差见 global_statistics_error。
+    """
+    param = next(model.parameters())
+    h, w = image.shape[:2]
+    scale = min(1.0, max_size / max(h, w))
+    th, tw = (max(STRIDE, round(s * scale / STRIDE) * STRIDE) for s in (h, w))
+    if (th, tw) != (h, w):
+        image = cv2.resize(image, (tw, th), interpolation=cv2.INTER_AREA)
+    pooling = GlobalPooling(model)
+    with pooling.capture():
+        model(_to_input(image, param.device, param.dtype))
+    return pooling
+
+
+@torch.inference_mode()
+def global_statistics_error(model, image, tiler, halo, max_sizes=(512, 1024, 2048)):
+    """与全分辨率整图推理比较：各 max_size 下池化向量的相对误差 (各 CALayer 的平均 / 最大)，
+    以及注入这些向量后 halo tiling 输出的 MAE / PSNR (uint8)。
+
+    image 的高宽需为 32 的倍数，且整图推理能放进内存。返回 {max_size: (mean, max, mae, psnr)}。
+    """
+    from tiling import ArraySink
+
+    h, w = image.shape[:2]
+    param = next(model.parameters())
+    exact = GlobalPooling(model)
+    with exact.capture():
+        reference = model(_to_input(image, param.device, param.dtype))
+    reference = ((reference.float()[0] + 1) * 127.5).clamp(0, 255).to(torch.uint8)
+    reference = reference.permute(1, 2, 0).cpu().numpy().astype(np.float32)
+
+    results = {}
+    for max_size in max_sizes:
+        pooling = capture_global_statistics(model, image, max_size)
+        relative = [
+            float((a.float() - e.float()).norm() / e.float().norm().clamp_min(1e-12))
+            for a, e in zip(pooling.vectors, exact.vectors)
+        ]
+        output = predict_halo(model, image, tiler, halo, ArraySink(h, w, np.uint8), pooling=pooling).array
+        mse = float(np.mean((output - reference) ** 2))
+        psnr = 10 * np.log10(255**2 / mse) if mse > 0 else float("inf")
+        results[max_size] = (float(np.mean(relative)), max(relative), float(np.abs(output - reference).mean()), psnr)
+    return results
+
+
+def measure_receptive_field(model, size=1024, energy=0.99, global_stats=True):
+    """对中心输出像素求输入梯度，返回理论感受野半径和包含 energy 比例梯度质量的 ERF 半径 (像素，Chebyshev 距离)。
+
+    global_stats=True 时 CALayer 的池化向量固定为常数 (与 halo 推理时注入的一致)，否则梯度会覆盖整幅输入。
+    rf_radius 达到 size // 2 说明理论感受野超出了测量窗口。
+    """
+    param = next(model.parameters())
+    generator = torch.Generator().manual_seed(0)
+    x = torch.rand(1, 3, size, size, generator=generator) * 2 - 1
+    x = x.to(param.device, param.dtype)
+
+    context = nullcontext()
+    if global_stats:
+        pooling = GlobalPooling(model)
+        with torch.no_grad(), pooling.capture():
+            model(x)
+        context = pooling.inject()
+
+    center = size // 2
+    x.requires_grad_(True)
+    with torch.enable_grad(), context:
+        out = model(x)
+        (grad,) = torch.autograd.grad(out[0, :, center, center].sum(), x)
+    grad = grad[0].abs().sum(0).float().cpu().numpy()
+
+    offset = np.abs(np.arange(size) - center)
+    distance = np.maximum(offset[:, None], offset[None, :])
+    nonzero = distance[grad > 0]
+    mass = np.bincount(distance.ravel(), weights=grad.ravel())
+    cumulative = np.cumsum(mass) / mass.sum()
+    return {
+        "rf_radius": int(nonzero.max()) if nonzero.size else 0,
+        "erf_radius": int(np.searchsorted(cumulative, energy)),
+        "clipped": bool(nonzero.size and nonzero.max() >= size - 1 - center),
+    }
+
+
+def halo_for(radius):
+    return int(math.ceil(radius / STRIDE)) * STRIDE
+
+
+def halo_coords(height, width, core, halo):
+    """每个 tile 的输入左上角 (可以为负，越界部分反射)，输出 core 按光栅顺序铺满图像"""
+    return [(x - halo, y - halo) for x, y in tile_coords(height, width, core + 2 * halo, 2 * halo)]
+
+
+def predict_halo(model, image, tiler, halo, sink, tta=False, pooling=None, progress=None):
+    """halo tiling 推理：tiler.size 为含 halo 的输入尺寸，输出核心为 tiler.size - 2 * halo。
+
+    结果直接裁剪拼接，不做平均；完成的行带交给 sink.write(top, band)，返回 sink。
+    pooling 为 capture_global_statistics 的结果时，推理期间注入整图的池化向量。
+    """
+    from tiling import predict_tiles
+
+    core = tiler.size - 2 * halo
+    if core <= 0 or halo % STRIDE or tiler.size % STRIDE:
+        raise ValueError(f"tile {tiler.size} / halo {halo} must be multiples of {STRIDE} with a positive core")
+    h, w = image.shape[:2]
+    coords = halo_coords(h, w, core, halo)
+    band = np.empty((core, w, 3), dtype=np.uint8)
+    top = 0
+
+    batches = predict_tiles(model, image, tiler, tta, coords)
+    if progress is not None:
+        batches = progress(batches, total=-(-len(coords) // tiler.batch_size))
+    with pooling.inject() if pooling is not None else nullcontext():
+        for batch, outputs in batches:
+            outputs = outputs[:, halo : halo + core, halo : halo + core].cpu().numpy()
+            for (x, y), output in zip(batch, outputs):
+                x, y = x + halo, y + halo
+                if x != top:
+                    sink.write(top, band[: min(core, h - top)])
+                    top = x
+                rows, cols = min(core, h - x), min(core, w - y)
+                band[:rows, y : y + cols] = output[:rows, :cols]
+    sink.write(top, band[: min(core, h - top)])
+    sink.close()
+    return sink
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from checkpoint import load_inference_model
+    from tiling import ArraySink, MemmapSink, Tiler
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["measure", "predict", "stats"])
+    parser.add_argument("model", type=str, help="checkpoint, slim checkpoint directory or .safetensors")
+    parser.add_argument("input", type=str, nargs="?")
+    parser.add_argument("output", type=str, nargs="?")
+    parser.add_argument("--size", type=int, default=1024, help="measurement window")
+    parser.add_argument("--energy", type=float, default=0.99, help="gradient mass inside the ERF")
+    parser.add_argument("--tile", type=int, default=2048, help="tile size including the halo")
+    parser.add_argument("--halo", type=int, default=None, help="default: measured ERF rounded up to 16")
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--global_stats", action="store_true", help="inject low-resolution CA pooling vectors")
+    parser.add_argument("--max_sizes", type=int, nargs="+", default=[512, 1024, 2048], help="stats: downscaled passes")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    model = load_inference_model(args.model, device)
+
+    halo = args.halo
+    if args.command == "measure" or halo is None:
+        field = measure_receptive_field(model, args.size, args.energy, args.global_stats or args.command == "stats")
+        halo = halo_for(field["erf_radius"])
+        print(f"receptive field radius {field['rf_radius']}{'+ (clipped)' if field['clipped'] else ''}, "
+              f"ERF({args.energy:.0%}) radius {field['erf_radius']} -> halo {halo}")
+    if args.command == "predict":
+        image = np.load(args.input, mmap_mode="r") if args.input.endswith(".npy") else cv2.imread(args.input)
+        h, w = image.shape[:2]
+        sink = MemmapSink(args.output, h, w) if args.output.endswith(".npy") else ArraySink(h, w, np.uint8)
+        pooling = capture_global_statistics(model, image) if args.global_stats else None
+        predict_halo(model, image, Tiler(args.tile, 2 * halo, args.batch_size, device), halo, sink, pooling=pooling)
+        if not args.output.endswith(".npy"):
+            cv2.imwrite(args.output, sink.array)
+    if args.command == "stats":
+        image = cv2.imread(args.input)
+        # 整图推理要求尺寸是 32 的倍数
+        image = np.ascontiguousarray(image[: image.shape[0] // 32 * 32, : image.shape[1] // 32 * 32])
+        tiler = Tiler(args.tile, 2 * halo, args.batch_size, device)
+        print(f"{image.shape[1]}x{image.shape[0]}, tile {args.tile}, halo {halo}, vs full-resolution whole image")
+        print(f"{'max_size':>9}{'vec mean':>10}{'vec max':>9}{'MAE':>8}{'PSNR':>8}")
+        for max_size, (mean, worst, mae, psnr) in global_statistics_error(model, image, tiler, halo, args.max_sizes).items():
+            print(f"{max_size:>9}{mean:>10.2%}{worst:>9.2%}{mae:>8.3f}{psnr:>8.2f}")
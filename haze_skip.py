@@ -0,0 +1,194 @@
+"""Adaptive tiling: only hazy tiles go through the full generator.
+
+Before inference, every tile gets a haze score from the dark channel prior (He et al.).
+The dark channel of the whole image is computed once at low resolution and normalised by the
+estimated atmospheric light. Each tile's mean is then read from one integral image, so the
+score costs the same for any number of tiles. The score is the estimated haze density
+omega * (1 - t) in [0, 1].
+
+Tiles scoring under the threshold take a cheap path: either the input pixels are passed through,
+or a lighter model runs (for example an int8 model or a smaller checkpoint). Both streams are
+merged back in raster order into the same StreamingReconstructor. A feathered blend mode
+("cosine" / "linear") hides the transition between skipped and processed tiles. Bright
+haze-free surfaces (white walls, overcast sky) have a high dark channel as well. They are
+processed, so errors go toward doing the work.
+
+Usage:
+    python haze_skip.py scores IMAGE [--tile 2048] [--overlap 512]
+    python haze_skip.py report MODEL [--dataset_root ./dehaze_data_1/] [--images 8]
+        [--thresholds 0.05 0.1 0.2] [--cheap CKPT]
+"""
+
+import heapq
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from tiling import StreamingReconstructor, blend_window, crop_tile, predict_tiles
+
+
+def dark_channel(image, scale=4, patch=7):
+    """缩小 scale 倍后的暗通道 (patch 为缩小后的窗口边长)，返回 (float32 暗通道, 缩小后的图像)"""
+    h, w = image.shape[:2]
+    if scale > 1:
+        image = cv2.resize(image, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_AREA)
+    kernel = np.ones((patch, patch), np.uint8)
+    return cv2.erode(np.asarray(image).min(axis=2), kernel).astype(np.float32), image
+
+
+def atmospheric_light(image, dark, top=0.001):
+    """暗通道最亮的 top 比例像素中，各通道的最大值"""
+    count = max(1, int(dark.size * top))
+    index = np.argpartition(dark.ravel(), -count)[-count:]
+    return np.maximum(image.reshape(-1, 3)[index].max(axis=0).astype(np.float32), 1)
+
+
+def haze_scores(image, coords, size, scale=4, patch=7, omega=0.95):
+    """每个 tile 的雾浓度估计 omega * mean(dark(I / A))，与 coords 一一对应"""
+    dark, small = dark_channel(image, scale, patch)
+    light = atmospheric_light(small, dark)
+    normalized = cv2.erode((small / light).min(axis=2).astype(np.float32), np.ones((patch, patch), np.uint8))
+    integral = cv2.integral(normalized.astype(np.float64))
+    sh, sw = normalized.shape
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    # 越界部分按反射取值，近似为只统计图像内的部分
+    x0 = np.clip(coords[:, 0] // scale, 0, sh - 1)
+    y0 = np.clip(coords[:, 1] // scale, 0, sw - 1)
+    x1 = np.clip(-(-(coords[:, 0] + size) // scale), x0 + 1, sh)
+    y1 = np.clip(-(-(coords[:, 1] + size) // scale), y0 + 1, sw)
+    total = integral[x1, y1] - integral[x0, y1] - integral[x1, y0] + integral[x0, y0]
+    return omega * total / ((x1 - x0) * (y1 - y0))
+
+
+def _passthrough(image, coords, size):
+    for x, y in coords:
+        yield (x, y), crop_tile(image, x, y, size)
+
+
+def _unbatch(batches):
+    for coords, outputs in batches:
+        yield from zip(coords, outputs.cpu().numpy())
+
+
+def predict_adaptive(
+    model,
+    image,
+    tiler,
+    sink,
+    threshold=0.1,
+    tta=False,
+    cheap=None,
+    blend="cosine",
+    scores=None,
+    progress=None,
+):
+    """雾浓度不低于 threshold 的 tile 用 model 推理，其余走 cheap 路径，流式重建到 sink。
+
+    cheap 为 None 时直接使用输入像素，否则为与 model 接口相同的轻量模型 (不做 TTA)。
+    返回 (sink, stats)：stats 含 tiles / skipped / fraction / scores。
+    """
+    h, w = image.shape[:2]
+    coords = tiler.coords(h, w)
+    if scores is None:
+        scores = haze_scores(image, coords, tiler.size)
+    hazy = [c for c, s in zip(coords, scores) if s >= threshold]
+    clear = [c for c, s in zip(coords, scores) if s < threshold]
+
+    # 两路都按光栅顺序产出，按 tile 序号归并；predict_tiles 在产出前已完成前向，可以共用 tiler 的 buffer
+    streams = [_unbatch(predict_tiles(model, image, tiler, tta, hazy)) if hazy else iter(())]
+    if cheap is None:
+        streams.append(_passthrough(image, clear, tiler.size))
+    elif clear:
+        streams.append(_unbatch(predict_tiles(cheap, image, tiler, False, clear)))
+    order = {c: i for i, c in enumerate(coords)}
+    tiles = heapq.merge(*streams, key=lambda item: order[item[0]])
+    if progress is not None:
+        tiles = progress(tiles, total=len(coords))
+
+    window = None if blend == "mean" else blend_window(tiler.size, tiler.overlap, blend)
+    reconstructor = StreamingReconstructor(h, w, tiler.size, sink, window)
+    for coord, tile in tiles:
+        reconstructor.add([coord], tile[None])
+    reconstructor.close()
+    stats = {
+        "tiles": len(coords),
+        "skipped": len(clear),
+        "fraction": len(clear) / max(1, len(coords)),
+        "scores": np.asarray(scores),
+    }
+    return sink, stats
+
+
+def report(model, names, dataset_root, thresholds, tiler, cheap=None, blend="cosine"):
+    """在验证集图像上比较全量推理与各阈值的 PSNR / SSIM、跳过比例和耗时"""
+    from skimage.metrics import peak_signal_noise_ratio as psnr
+    from skimage.metrics import structural_similarity as ssim
+
+    from tiling import ArraySink, predict_image
+
+    rows = {t: [] for t in ("full", *thresholds)}
+    for name in names:
+        image = cv2.imread(os.path.join(dataset_root, "train", "input", name))
+        gt = cv2.imread(os.path.join(dataset_root, "train", "gt", name))
+        scores = haze_scores(image, tiler.coords(*image.shape[:2]), tiler.size)
+        for threshold in rows:
+            sink = ArraySink(*image.shape[:2], np.uint8)
+            start = time.perf_counter()
+            if threshold == "full":
+                predict_image(model, image, tiler, sink, blend=blend)
+                fraction = 0.0
+            else:
+                _, stats = predict_adaptive(model, image, tiler, sink, threshold, cheap=cheap, blend=blend, scores=scores)
+                fraction = stats["fraction"]
+            seconds = time.perf_counter() - start
+            rows[threshold].append(
+                (psnr(gt, sink.array, data_range=255), ssim(gt, sink.array, data_range=255, channel_axis=2),
+                 fraction, seconds)
+            )
+    full = np.mean(rows["full"], axis=0)
+    print(f"{'threshold':<10}{'PSNR':>8}{'SSIM':>8}{'skipped':>9}{'s/img':>8}{'speedup':>9}")
+    for threshold, values in rows.items():
+        p, s, f, t = np.mean(values, axis=0)
+        label = threshold if threshold == "full" else f"{threshold:g}"
+        print(f"{label:<10}{p:>8.3f}{s:>8.4f}{f:>9.1%}{t:>8.2f}{full[3] / t:>8.2f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from tiling import Tiler
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["scores", "report"])
+    parser.add_argument("target", type=str, help="image (scores) or checkpoint / .safetensors (report)")
+    parser.add_argument("--tile", type=int, default=2048)
+    parser.add_argument("--overlap", type=int, default=512)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--dataset_root", type=str, default="./dehaze_data_1/")
+    parser.add_argument("--valid_image_rate", type=float, default=0.12)
+    parser.add_argument("--images", type=int, default=8, help="number of validation images for the report")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.05, 0.1, 0.2])
+    parser.add_argument("--cheap", type=str, default=None, help="lighter model for skipped tiles (default: pass-through)")
+    parser.add_argument("--blend", type=str, default="cosine")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    if args.command == "scores":
+        image = cv2.imread(args.target)
+        coords = Tiler(args.tile, args.overlap, 1, "cpu").coords(*image.shape[:2])
+        scores = haze_scores(image, coords, args.tile)
+        rows = sorted({x for x, _ in coords})
+        for row in rows:
+            print(" ".join(f"{s:.3f}" for (x, _), s in zip(coords, scores) if x == row))
+    else:
+        from checkpoint import load_inference_model
+        from dataset import split_image_list
+
+        model = load_inference_model(args.target, args.device, fuse=True)
+        cheap = load_inference_model(args.cheap, args.device, fuse=True) if args.cheap else None
+        _, valid_names = split_image_list(args.dataset_root, args.valid_image_rate)
+        tiler = Tiler(args.tile, args.overlap, args.batch_size, args.device)
+        report(model, sorted(valid_names)[: args.images], args.dataset_root, args.thresholds, tiler, cheap, args.blend)
@@ -12,17 +12,35 @@ torch.set_float32_matmul_precision("high")
 
 if __name__ == "__main__":
     opt = get_option()
+    # 训练使用的 GPU；--decoder_only 的特征缓存在第一个 (rank 0 的) 设备上构建
+    devices = [4, 5]
     """定义网络"""
 
-    from models.fusenet import convnext_plus_head
+    from models.fusenet import build_generator
 
-    model = convnext_plus_head()
+    if opt.init_ckpt:
+        from checkpoint import generator_state_dict
+
+        # 权重全部来自 checkpoint，不再读取 ImageNet 预训练权重
+        model = build_generator(generator_state_dict(opt.init_ckpt))
+    else:
+        model = build_generator()
+    if opt.lora_rank > 0:
+        from models.lora import apply_lora
+
+        apply_lora(model, opt.lora_rank, opt.lora_alpha)
 
     """模型编译"""
     # model = torch.compile(model)
 
     """导入数据集"""
-    train_dataloader, valid_dataloader = get_dataloader(opt)
+    if opt.decoder_only:
+        from feature_cache import get_feature_cache_dataloader
+
+        train_dataloader = get_feature_cache_dataloader(opt, model, Dataset, devices)
+        valid_dataloader = get_valid_dataloader(opt)
+    else:
+        train_dataloader, valid_dataloader = get_dataloader(opt)
 
     """Lightning 模块定义"""
     pl.seed_everything(opt.seed)
@@ -33,9 +51,29 @@ if __name__ == "__main__":
         config=opt,
     )
 
+    if opt.async_ckpt:
+        from slim_checkpoint import AsyncSlimCheckpoint
+
+        checkpoint_callback = AsyncSlimCheckpoint(
+            dirpath="./checkpoints/" + opt.exp_name,
+            monitor="valid_psnr",
+            mode="max",
+            save_top_k=2,
+            shard=opt.ckpt_shard,
+        )
+    else:
+        checkpoint_callback = pl.callbacks.ModelCheckpoint(
+            dirpath="./checkpoints/" + opt.exp_name,
+            monitor="valid_psnr",
+            mode="max",
+            save_top_k=2,
+            save_last=False,
+            filename="{epoch}-{valid_psnr:.4f}",
+        )
+
     trainer = pl.Trainer(
         accelerator="auto",
-        devices=[4, 5],
+        devices=devices,
         strategy="ddp_find_unused_parameters_true",
         max_epochs=opt.epochs,
         default_root_dir="./",
@@ -44,16 +82,9 @@ if __name__ == "__main__":
         val_check_interval=opt.val_check,
         log_every_n_steps=opt.log_step,
         accumulate_grad_batches=1,
-        callbacks=[
-            pl.callbacks.ModelCheckpoint(
-                dirpath="./checkpoints/" + opt.exp_name,
-                monitor="valid_psnr",
-                mode="max",
-                save_top_k=2,
-                save_last=False,
-                filename="{epoch}-{valid_psnr:.4f}",
-            ),
-        ],
+        # AsyncSlimCheckpoint 不是 ModelCheckpoint，关闭 Lightning 默认添加的同步 checkpoint
+        enable_checkpointing=not opt.async_ckpt,
+        callbacks=[checkpoint_callback],
     )
     if not os.path.exists("./checkpoints/" + opt.exp_name + "/training_image"):
         os.makedirs("./checkpoints/" + opt.exp_name + "/training_image")
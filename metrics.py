@@ -0,0 +1,18 @@
+"""predict.py 与 batch_predict.py 共用的图像指标：在模型的 float32 输出 (未取整) 上计算。"""
+
+import numpy as np
+from skimage.metrics import peak_signal_noise_ratio as psnr
+from skimage.metrics import structural_similarity as ssim
+
+
+def image_metrics(output, gt):
+    """output 为 HxWx3 的 float32 (0-255，未取整)，gt 为整数图像；返回 (psnr, ssim)"""
+    return (
+        psnr(output, gt, data_range=255),
+        ssim(output, gt, data_range=255, channel_axis=2),
+    )
+
+
+def to_uint8(output):
+    """保存用：四舍五入到 uint8 (与 tiling.ArraySink 的整数输出相同)"""
+    return np.clip(np.rint(output), 0, 255).astype(np.uint8)
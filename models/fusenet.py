@@ -194,16 +194,19 @@ class ConvNeXt(nn.Module):
             LayerNorm(dims[0], eps=1e-6, data_format="channels_first"),
         )
         self.downsample_layers.append(stem)
-        for i in range(3):
+        # forward 只用到 stem 和前两个下采样层 (stage 0-2)，1024->2048 的第 4 个不再构建
+        for i in range(2):
             downsample_layer = nn.Sequential(
                 LayerNorm(dims[i], eps=1e-6, data_format="channels_first"),
                 nn.Conv2d(dims[i], dims[i + 1], kernel_size=2, stride=2),
             )
             self.downsample_layers.append(downsample_layer)
+        self._register_load_state_dict_pre_hook(self._drop_unused_keys)
 
         self.stages = nn.ModuleList()
-        dpath_rates = [x.item() for x in torch.linspace(0, drop_path_rate, sum(depths))]
-        dpout_rates = [x.item() for x in torch.linspace(0, drop_out_rate, sum(depths))]
+        # 在 CPU 上计算，meta device 下构建时也能 .item()
+        dpath_rates = torch.linspace(0, drop_path_rate, sum(depths), device="cpu").tolist()
+        dpout_rates = torch.linspace(0, drop_out_rate, sum(depths), device="cpu").tolist()
         cur = 0
         for i in range(3):
             stage = nn.Sequential(
@@ -220,6 +223,13 @@ class ConvNeXt(nn.Module):
             self.stages.append(stage)
             cur += depths[i]
 
+    @staticmethod
+    def _drop_unused_keys(state_dict, prefix, *args):
+        # 旧 checkpoint 中还有未使用的 downsample_layers.3
+        for k in list(state_dict.keys()):
+            if k.startswith(prefix + "downsample_layers.3."):
+                state_dict.pop(k)
+
     def forward(self, x):
         x_layer1 = self.downsample_layers[0](x)
         x_layer1 = self.stages[0](x_layer1)
@@ -303,7 +313,9 @@ class LayerNorm(nn.Module):
             u = x.mean(1, keepdim=True)
             s = (x - u).pow(2).mean(1, keepdim=True)
             x = (x - u) / torch.sqrt(s + self.eps)
-            x = self.weight[:, None, None] * x + self.bias[:, None, None]
+            # fuse_for_inference 把仿射参数折叠进后面的层后 weight / bias 为 None
+            if self.weight is not None:
+                x = self.weight[:, None, None] * x + self.bias[:, None, None]
             return x
 
 
@@ -355,7 +367,7 @@ class CP_Attention_block(nn.Module):
 
 
 class knowledge_adaptation_convnext(nn.Module):
-    def __init__(self, bias):
+    def __init__(self, bias, pretrained=True):
         super(knowledge_adaptation_convnext, self).__init__()
         self.encoder = ConvNeXt(
             Block,
@@ -367,14 +379,15 @@ class knowledge_adaptation_convnext(nn.Module):
             layer_scale_init_value=1e-6,
         )
 
-        checkpoint = torch.load("./models/convnext_xlarge_22k_1k_384_ema.pth")
+        if pretrained:
+            checkpoint = torch.load("./models/convnext_xlarge_22k_1k_384_ema.pth")
 
-        model_dict = self.encoder.state_dict()
-        key_dict = {k: v for k, v in checkpoint["model"].items() if k in model_dict}
-        model_dict.update(key_dict)
-        self.encoder.load_state_dict(model_dict)
-        del checkpoint
-        del model_dict
+            model_dict = self.encoder.state_dict()
+            key_dict = {k: v for k, v in checkpoint["model"].items() if k in model_dict}
+            model_dict.update(key_dict)
+            self.encoder.load_state_dict(model_dict)
+            del checkpoint
+            del model_dict
 
         self.up_block = nn.PixelShuffle(2)
         self.attention0 = CP_Attention_block(default_conv, 1024, 3, bias)
@@ -384,8 +397,9 @@ class knowledge_adaptation_convnext(nn.Module):
         self.attention4 = CP_Attention_block(default_conv, 28, 5, bias)
 
     def forward(self, inputs):
-        x_layer1, x_layer2, x_output = self.encoder(inputs)
+        return self.decode(*self.encoder(inputs))
 
+    def decode(self, x_layer1, x_layer2, x_output):
         x_mid = self.attention0(x_output)  # [1024,24,24]
 
         x = self.up_block(x_mid)  # [256,48,48]
@@ -406,9 +420,9 @@ class knowledge_adaptation_convnext(nn.Module):
 
 
 class convnext_plus_head(nn.Module):
-    def __init__(self, bias=False):
+    def __init__(self, bias=False, pretrained=True):
         super(convnext_plus_head, self).__init__()
-        self.convnext_branch = knowledge_adaptation_convnext(bias=bias)
+        self.convnext_branch = knowledge_adaptation_convnext(bias=bias, pretrained=pretrained)
         # self.segmentation_head1 = mscheadv5(28)
         self.segmentation_head1 = nn.Sequential(nn.Conv2d(28, 3, 3, 1, 1), nn.Tanh())
         # self.segmentation_head2 = MST_Plus_Plus(3, 3, 30, 1)
@@ -419,6 +433,28 @@ class convnext_plus_head(nn.Module):
         # pred = self.segmentation_head2(pred)
         return pred
 
+    def encode(self, inputs):
+        """编码器输出 (x_layer1, x_layer2, out)，可缓存后交给 decode"""
+        return self.convnext_branch.encoder(inputs)
+
+    def decode(self, x_layer1, x_layer2, x_output):
+        x_convnext = self.convnext_branch.decode(x_layer1, x_layer2, x_output)
+        return self.segmentation_head1(x_convnext)
+
+
+def build_generator(state_dict=None, bias=False, device="cpu"):
+    """构建 convnext_plus_head。
+
+    给定完整的 state_dict 时在 meta device 上构建：不读取 ImageNet 预训练权重、不做随机初始化，
+    再用 assign=True 直接把 state_dict 中的张量 (可以是 mmap 的) 作为参数，没有额外拷贝。
+    """
+    if state_dict is None:
+        return convnext_plus_head(bias=bias).to(device)
+    with torch.device("meta"):
+        model = convnext_plus_head(bias=bias, pretrained=False)
+    model.load_state_dict(state_dict, assign=True)
+    return model.to(device)
+
 
 if __name__ == "__main__":
     model = convnext_plus_head()
@@ -0,0 +1,228 @@
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from .fusenet import Block, CP_Attention_block
+
+
+class LoRALinear(nn.Linear):
+    """带低秩旁路的 nn.Linear：y = W x + b + scaling * B A x。
+
+    weight / bias 直接复用原层的 Parameter，state_dict 中的 key 不变，基础权重可以照常加载。
+    """
+
+    def __init__(self, linear, rank, alpha=None):
+        super().__init__(
+            linear.in_features,
+            linear.out_features,
+            bias=linear.bias is not None,
+            device="meta",
+        )
+        self.weight = linear.weight
+        self.bias = linear.bias
+        self.rank = rank
+        self.scaling = (alpha if alpha is not None else rank) / rank
+        self.lora_A = nn.Parameter(linear.weight.new_empty(rank, linear.in_features))
+        self.lora_B = nn.Parameter(linear.weight.new_zeros(linear.out_features, rank))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+        self.merged = False
+
+    def delta_weight(self):
+        return self.scaling * (self.lora_B @ self.lora_A)
+
+    def forward(self, x):
+        out = F.linear(x, self.weight, self.bias)
+        if self.merged:
+            return out
+        return out + self.scaling * F.linear(F.linear(x, self.lora_A), self.lora_B)
+
+
+class LoRAConv2d(nn.Conv2d):
+    """带低秩旁路的 nn.Conv2d：A 为 rank 个输出通道、同样 kernel/stride/padding 的卷积，B 为 1x1 卷积。"""
+
+    def __init__(self, conv, rank, alpha=None):
+        if conv.groups != 1:
+            raise ValueError("LoRAConv2d only supports groups=1")
+        super().__init__(
+            conv.in_channels,
+            conv.out_channels,
+            conv.kernel_size,
+            stride=conv.stride,
+            padding=conv.padding,
+            dilation=conv.dilation,
+            bias=conv.bias is not None,
+            padding_mode=conv.padding_mode,
+            device="meta",
+        )
+        self.weight = conv.weight
+        self.bias = conv.bias
+        self.rank = rank
+        self.scaling = (alpha if alpha is not None else rank) / rank
+        self.lora_A = nn.Parameter(
+            conv.weight.new_empty(rank, conv.in_channels, *conv.kernel_size)
+        )
+        self.lora_B = nn.Parameter(conv.weight.new_zeros(conv.out_channels, rank, 1, 1))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+        self.merged = False
+
+    def delta_weight(self):
+        delta = self.lora_B.flatten(1) @ self.lora_A.flatten(1)
+        return self.scaling * delta.view_as(self.weight)
+
+    def forward(self, x):
+        out = self._conv_forward(x, self.weight, self.bias)
+        if self.merged:
+            return out
+        low_rank = self._conv_forward(x, self.lora_A, None)
+        return out + self.scaling * F.conv2d(low_rank, self.lora_B)
+
+
+LORA_MODULES = (LoRALinear, LoRAConv2d)
+
+
+def apply_lora(model, rank, alpha=None):
+    """给 Block 的 pwconv1/pwconv2 和 CP_Attention_block 内的卷积加上 LoRA 旁路，并冻结其余参数。
+
+    已经替换过的层不会重复替换。返回被替换的模块名。
+    """
+    targets = []
+    for name, module in model.named_modules():
+        if isinstance(module, Block):
+            targets += [(module, "pwconv1"), (module, "pwconv2")]
+        elif isinstance(module, CP_Attention_block):
+            targets += [
+                (parent, child_name)
+                for parent in module.modules()
+                for child_name, child in parent.named_children()
+                if type(child) is nn.Conv2d and child.groups == 1
+            ]
+
+    replaced = []
+    for parent, child_name in targets:
+        child = getattr(parent, child_name)
+        if isinstance(child, LORA_MODULES):
+            continue
+        wrapper = LoRALinear if isinstance(child, nn.Linear) else LoRAConv2d
+        setattr(parent, child_name, wrapper(child, rank, alpha))
+        replaced.append(child_name)
+
+    for name, param in model.named_parameters():
+        param.requires_grad_("lora_" in name)
+    return replaced
+
+
+def lora_state_dict(model):
+    return {k: v for k, v in model.state_dict().items() if "lora_" in k}
+
+
+@torch.no_grad()
+def merge_lora(model):
+    """把旁路合并进基础权重，推理时没有额外开销"""
+    for module in model.modules():
+        if isinstance(module, LORA_MODULES) and not module.merged:
+            module.weight += module.delta_weight()
+            module.merged = True
+
+
+@torch.no_grad()
+def unmerge_lora(model):
+    for module in model.modules():
+        if isinstance(module, LORA_MODULES) and module.merged:
+            module.weight -= module.delta_weight()
+            module.merged = False
+
+
+@torch.no_grad()
+def unwrap_lora(model):
+    """把已合并的 LoRA 层换回普通的 nn.Linear / nn.Conv2d (共享 weight / bias)，返回替换的数量。
+
+    fuse_for_inference 等按 type(layer) 精确匹配的处理才能识别这些层；之后不能再 unmerge / 换 adapter。
+    """
+    replaced = 0
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if not isinstance(child, LORA_MODULES):
+                continue
+            if not child.merged:
+                raise RuntimeError("unwrap_lora requires merge_lora() first")
+            if isinstance(child, LoRALinear):
+                plain = nn.Linear(child.in_features, child.out_features, bias=child.bias is not None, device="meta")
+            else:
+                plain = nn.Conv2d(
+                    child.in_channels,
+                    child.out_channels,
+                    child.kernel_size,
+                    stride=child.stride,
+                    padding=child.padding,
+                    dilation=child.dilation,
+                    bias=child.bias is not None,
+                    padding_mode=child.padding_mode,
+                    device="meta",
+                )
+            plain.weight = child.weight
+            plain.bias = child.bias
+            setattr(parent, name, plain.train(child.training))
+            replaced += 1
+    return replaced
+
+
+@torch.no_grad()
+def merge_lora_state_dict(base, adapter, rank, alpha=None):
+    """基础权重 + lora_A / lora_B 合并为普通生成器的 state_dict (W + scaling * B A)，不需要构建模型"""
+    scaling = (alpha if alpha is not None else rank) / rank
+    merged = dict(base)
+    prefixes = {k[: -len("lora_A")] for k in adapter if k.endswith("lora_A")}
+    for prefix in prefixes:
+        weight = base[prefix + "weight"]
+        a = adapter[prefix + "lora_A"].to(weight)
+        b = adapter[prefix + "lora_B"].to(weight)
+        merged[prefix + "weight"] = weight + scaling * (b.flatten(1) @ a.flatten(1)).view_as(weight)
+    # adapter 中的非 LoRA 项 (例如 EMA 覆盖的参数) 照常覆盖
+    merged.update({k: v for k, v in adapter.items() if "lora_" not in k})
+    return merged
+
+
+def load_lora(model, state_dict):
+    """加载 (或热切换) 一组 adapter：先撤销已合并的旧 adapter，再载入新的。"""
+    unmerge_lora(model)
+    expected = set(lora_state_dict(model))
+    missing = expected - set(state_dict)
+    unexpected = set(state_dict) - expected
+    if missing or unexpected:
+        raise KeyError(f"LoRA keys mismatch, missing: {sorted(missing)[:5]}, unexpected: {sorted(unexpected)[:5]}")
+    model.load_state_dict(state_dict, strict=False)
+
+
+def save_lora(model, path):
+    modules = [m for m in model.modules() if isinstance(m, LORA_MODULES)]
+    torch.save(
+        {
+            "rank": modules[0].rank,
+            "alpha": modules[0].scaling * modules[0].rank,
+            "state_dict": {k: v.cpu() for k, v in lora_state_dict(model).items()},
+        },
+        path,
+    )
+
+
+def load_lora_adapter(model, path, merge=True):
+    """加载 save_lora 的文件或 LoRA 训练得到的 Lightning checkpoint。
+
+    模型还没有 LoRA 层时先按文件中的 rank / alpha 添加；merge=True 时合并进权重。
+    """
+    adapter = torch.load(path, map_location="cpu", weights_only=False)
+    if "lora" in adapter:
+        adapter = {
+            **adapter["lora"],
+            "state_dict": {
+                k[len("model.") :]: v
+                for k, v in adapter["state_dict"].items()
+                if k.startswith("model.") and "lora_" in k
+            },
+        }
+    if not any(isinstance(m, LORA_MODULES) for m in model.modules()):
+        apply_lora(model, adapter["rank"], adapter["alpha"])
+    load_lora(model, adapter["state_dict"])
+    if merge:
+        merge_lora(model)
+    return model
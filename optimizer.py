@@ -0,0 +1,303 @@
+import math
+import torch
+import torch.nn.functional as F
+
+
+STATE_DTYPES = {
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+    "int8": torch.int8,
+}
+
+
+def cautious(grad, update):
+    """只保留与梯度方向一致的分量，并按保留比例放大 (与 heavyball 的 caution 相同)"""
+    mask = grad.signbit() ^ update.signbit()
+    update = update.masked_fill(mask, 0)
+    scale = mask.numel() / (mask.numel() - mask.sum()).clamp(min=1)
+    return update.mul_(scale)
+
+
+def quantize_blockwise(x, block_size, signed):
+    """分块 8 bit 量化。码值按平方根压扩，小数值保留更多相对精度。
+
+    Returns:
+        (code, absmax): code 形状为 [n_blocks, block_size]，absmax 为每块的最大绝对值
+    """
+    flat = x.reshape(-1).float()
+    pad = (-flat.numel()) % block_size
+    if pad:
+        flat = F.pad(flat, (0, pad))
+    blocks = flat.view(-1, block_size)
+    absmax = blocks.abs().amax(dim=1)
+    levels = 127 if signed else 255
+    code = torch.sqrt(blocks.abs() / absmax.clamp_min(1e-30)[:, None]).mul_(levels).round_()
+    if signed:
+        return (code * torch.sign(blocks)).to(torch.int8), absmax
+    return code.to(torch.uint8), absmax
+
+
+def dequantize_blockwise(code, absmax, shape):
+    levels = 127 if code.dtype == torch.int8 else 255
+    value = code.float() / levels
+    value = value * value.abs() * absmax[:, None]
+    return value.view(-1)[: math.prod(shape)].view(shape)
+
+
+def state_bytes(optimizer):
+    """统计优化器状态占用的字节数，按设备类型分组"""
+    total = {}
+
+    def visit(value):
+        if torch.is_tensor(value):
+            key = value.device.type
+            total[key] = total.get(key, 0) + value.numel() * value.element_size()
+        elif isinstance(value, dict):
+            for v in value.values():
+                visit(v)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                visit(v)
+
+    for state in optimizer.state.values():
+        visit(state)
+    return total
+
+
+class LeanAdamW(torch.optim.Optimizer):
+    """省显存的 AdamW，更新规则与 heavyball.ForeachAdamW (decoupled weight decay + caution) 一致。
+
+    Args:
+        state_dtype: 一阶/二阶矩的存储格式，"fp32"、"bf16" 或 "int8" (分块量化)
+        factored: 对元素数不少于 factor_min_numel 的 2D 参数 (Linear) 使用 Adafactor 式
+            行/列分解的二阶矩，只存 O(m + n) 而不是 O(mn)
+        offload: 状态存放在 CPU pinned memory 中，每个参数更新前在独立 stream 上预取下一个
+            参数的状态，更新后异步写回
+    """
+
+    def __init__(
+        self,
+        params,
+        lr=1e-3,
+        betas=(0.9, 0.999),
+        eps=1e-8,
+        weight_decay=0.0,
+        caution=False,
+        state_dtype="bf16",
+        factored=False,
+        offload=False,
+        block_size=2048,
+        factor_min_numel=2**16,
+    ):
+        if state_dtype not in STATE_DTYPES:
+            raise ValueError(f"Unknown state_dtype: {state_dtype}")
+        defaults = dict(
+            lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, caution=caution
+        )
+        super().__init__(params, defaults)
+        self.state_dtype = state_dtype
+        self.factored = factored
+        self.offload = offload
+        self.block_size = block_size
+        self.factor_min_numel = factor_min_numel
+        self._copy_streams = {}
+
+    # --- 状态布局 ---
+    def _is_factored(self, p):
+        return self.factored and p.dim() == 2 and p.numel() >= self.factor_min_numel
+
+    def _offloaded(self, p):
+        return self.offload and p.is_cuda
+
+    def _to_storage(self, tensor, p):
+        if self._offloaded(p):
+            out = torch.empty(
+                tensor.shape, dtype=tensor.dtype, device="cpu", pin_memory=True
+            )
+            return out.copy_(tensor)
+        return tensor.to(p.device)
+
+    def _buffer(self, shape, dtype, p):
+        return self._to_storage(torch.zeros(shape, dtype=dtype, device=p.device), p)
+
+    def _init_state(self, p):
+        state = self.state[p]
+        state["step"] = 0
+        for name, signed in (("exp_avg", True), ("exp_avg_sq", False)):
+            if name == "exp_avg_sq" and self._is_factored(p):
+                state["exp_avg_sq_row"] = self._buffer(p.shape[0], torch.float32, p)
+                state["exp_avg_sq_col"] = self._buffer(p.shape[1], torch.float32, p)
+            elif self.state_dtype == "int8":
+                n_blocks = math.ceil(p.numel() / self.block_size)
+                code_dtype = torch.int8 if signed else torch.uint8
+                state[f"{name}_q"] = self._buffer(
+                    (n_blocks, self.block_size), code_dtype, p
+                )
+                state[f"{name}_absmax"] = self._buffer(n_blocks, torch.float32, p)
+            else:
+                state[name] = self._buffer(p.shape, STATE_DTYPES[self.state_dtype], p)
+        return state
+
+    def _read(self, s, name, p):
+        # 返回 fp32 工作副本；fp32 存储时直接返回存储本身，原地更新即写回
+        if f"{name}_q" in s:
+            value = dequantize_blockwise(s[f"{name}_q"], s[f"{name}_absmax"], p.shape)
+            # 二阶矩以 sqrt(v) 量化，保留更大的动态范围
+            return value * value if name == "exp_avg_sq" else value
+        return s[name].float()
+
+    def _write(self, s, name, value):
+        if f"{name}_q" in s:
+            if name == "exp_avg_sq":
+                value = value.sqrt()
+            code, absmax = quantize_blockwise(
+                value, self.block_size, signed=name == "exp_avg"
+            )
+            s[f"{name}_q"].copy_(code)
+            s[f"{name}_absmax"].copy_(absmax)
+        elif s[name].data_ptr() != value.data_ptr():
+            s[name].copy_(value)
+
+    # --- 更新 ---
+    def _update(self, p, s, group, step):
+        beta1, beta2 = group["betas"]
+        grad = p.grad.float()
+
+        exp_avg = self._read(s, "exp_avg", p)
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        self._write(s, "exp_avg", exp_avg)
+
+        if "exp_avg_sq_row" in s:
+            row, col = s["exp_avg_sq_row"], s["exp_avg_sq_col"]
+            grad_sq = grad * grad + 1e-30
+            row.mul_(beta2).add_(grad_sq.mean(dim=1), alpha=1 - beta2)
+            col.mul_(beta2).add_(grad_sq.mean(dim=0), alpha=1 - beta2)
+            exp_avg_sq = torch.outer(row, col).div_(row.mean().clamp_min(1e-30))
+        else:
+            exp_avg_sq = self._read(s, "exp_avg_sq", p)
+            exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+            self._write(s, "exp_avg_sq", exp_avg_sq)
+
+        bias_correction1 = 1 - beta1**step
+        bias_correction2 = 1 - beta2**step
+        denom = (exp_avg_sq / bias_correction2).sqrt_().add_(group["eps"])
+        update = (exp_avg / bias_correction1).div_(denom)
+        if group["caution"]:
+            update = cautious(grad, update)
+
+        if group["weight_decay"] != 0:
+            p.mul_(1 - group["lr"] * group["weight_decay"])
+        p.add_(update.to(p.dtype), alpha=-group["lr"])
+
+    def _copy_stream(self, device):
+        if device not in self._copy_streams:
+            self._copy_streams[device] = torch.cuda.Stream(device)
+        return self._copy_streams[device]
+
+    def _step_offloaded(self, items):
+        """预取下一个参数的状态、更新当前参数、异步写回，三者在两个 stream 上重叠"""
+        device = items[0][0].device
+        copy_stream = self._copy_stream(device)
+        compute_stream = torch.cuda.current_stream(device)
+
+        def fetch(item):
+            p, state, _ = item
+            with torch.cuda.stream(copy_stream):
+                s = {
+                    k: v.to(device, non_blocking=True) if torch.is_tensor(v) else v
+                    for k, v in state.items()
+                }
+                ready = torch.cuda.Event()
+                ready.record(copy_stream)
+            return s, ready
+
+        pending = fetch(items[0])
+        for i, (p, state, group) in enumerate(items):
+            s, ready = pending
+            if i + 1 < len(items):
+                pending = fetch(items[i + 1])
+            compute_stream.wait_event(ready)
+            for v in s.values():
+                if torch.is_tensor(v):
+                    v.record_stream(compute_stream)
+            self._update(p, s, group, state["step"])
+
+            done = torch.cuda.Event()
+            done.record(compute_stream)
+            with torch.cuda.stream(copy_stream):
+                copy_stream.wait_event(done)
+                for k, v in state.items():
+                    if torch.is_tensor(v):
+                        v.copy_(s[k], non_blocking=True)
+        # 写回完成前 CPU 上的状态不可读 (state_dict / 下一次 step)
+        copy_stream.synchronize()
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        offloaded = {}
+        for group in self.param_groups:
+            for p in group["params"]:
+                if p.grad is None:
+                    continue
+                state = self.state[p] if self.state[p] else self._init_state(p)
+                state["step"] += 1
+                if self._offloaded(p):
+                    offloaded.setdefault(p.device, []).append((p, state, group))
+                else:
+                    self._update(p, state, group, state["step"])
+
+        for items in offloaded.values():
+            self._step_offloaded(items)
+        return loss
+
+    def _storage_dtype(self, key):
+        if key == "exp_avg_q":
+            return torch.int8
+        if key == "exp_avg_sq_q":
+            return torch.uint8
+        if key in ("exp_avg", "exp_avg_sq"):
+            return STATE_DTYPES[self.state_dtype]
+        return torch.float32
+
+    def load_state_dict(self, state_dict):
+        # 基类会把状态 (包括 int8 / uint8 码值) 转换为参数的 dtype / device，这里恢复成本优化器的存储格式
+        super().load_state_dict(state_dict)
+        for group in self.param_groups:
+            for p in group["params"]:
+                state = self.state.get(p)
+                if not state:
+                    continue
+                for k, v in state.items():
+                    if torch.is_tensor(v):
+                        state[k] = self._to_storage(v.to(self._storage_dtype(k)), p)
+
+def build_adamw(params, opt):
+    """按 --optim_state / --optim_factored / --optim_offload 构建优化器。
+
+    默认 (fp32，不分解、不 offload) 保持原来的 heavyball.ForeachAdamW。
+    """
+    if opt.optim_state == "fp32" and not opt.optim_factored and not opt.optim_offload:
+        import heavyball
+
+        return heavyball.ForeachAdamW(
+            params,
+            weight_decay=opt.weight_decay,
+            lr=opt.learning_rate,
+            betas=(0.9, opt.beta2),
+            caution=True,
+        )
+    return LeanAdamW(
+        params,
+        weight_decay=opt.weight_decay,
+        lr=opt.learning_rate,
+        betas=(0.9, opt.beta2),
+        caution=True,
+        state_dtype=opt.optim_state,
+        factored=opt.optim_factored,
+        offload=opt.optim_offload,
+    )
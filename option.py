@@ -18,6 +18,16 @@ def parse_args():
     data_group.add_argument(
         "--valid_patch_size", type=int, default=2048, help="验证时裁剪的图像块尺寸"
     )
+    data_group.add_argument(
+        "--valid_overlap", type=int, default=512, help="验证时相邻图像块的重叠像素数"
+    )
+    data_group.add_argument(
+        "--blend_mode",
+        type=str,
+        default="mean",
+        choices=["mean", "linear", "cosine", "gaussian"],
+        help="重叠区域的融合方式，mean 为计数平均，其余为按窗口权重加权平均",
+    )
     data_group.add_argument(
         "--ori_image_rate", type=float, default=0.0, help="使用原始清晰图像的概率"
     )
@@ -30,6 +40,23 @@ def parse_args():
     data_group.add_argument(
         "--extra_data", help="是否使用额外数据集", action="store_true"
     )
+    data_group.add_argument(
+        "--decoder_only",
+        action="store_true",
+        help="只训练解码器和输出头，训练集改为读取预先计算的编码器特征缓存",
+    )
+    data_group.add_argument(
+        "--feature_cache_dir",
+        type=str,
+        default="./feature_cache",
+        help="编码器特征缓存目录 (不存在时自动构建)",
+    )
+    data_group.add_argument(
+        "--cache_grid",
+        type=int,
+        default=4,
+        help="构建特征缓存时每张图像取 cache_grid x cache_grid 个固定裁剪",
+    )
 
     # 训练设置
     training_group = parser.add_argument_group(
@@ -59,11 +86,77 @@ def parse_args():
     training_group.add_argument(
         "--beta2", type=float, default=0.95, help="AdamW 优化器的 beta2 参数"
     )
+    training_group.add_argument(
+        "--optim_state",
+        type=str,
+        default="fp32",
+        choices=["fp32", "bf16", "int8"],
+        help="优化器一阶/二阶矩的存储格式 (int8 为分块量化)",
+    )
+    training_group.add_argument(
+        "--optim_factored",
+        action="store_true",
+        help="大 Linear 层的二阶矩使用行/列分解存储",
+    )
+    training_group.add_argument(
+        "--optim_offload",
+        action="store_true",
+        help="优化器状态放在 CPU pinned memory，更新时异步搬运",
+    )
+
+    training_group.add_argument(
+        "--freeze_stages",
+        type=int,
+        default=0,
+        help="冻结编码器的前 N 个 stage (连同 stem / 下采样层)，0 表示不冻结",
+    )
+    training_group.add_argument(
+        "--freeze_epoch", type=int, default=0, help="从第几个 epoch 开始冻结 --freeze_stages"
+    )
+    training_group.add_argument(
+        "--decoder_only_steps",
+        type=int,
+        default=0,
+        help="前 K 个 global_step 冻结整个编码器，只训练解码器",
+    )
+
+    training_group.add_argument(
+        "--init_ckpt",
+        type=str,
+        default=None,
+        help="用已有训练 checkpoint 初始化生成器 (例如作为 LoRA 的基础权重)",
+    )
+    training_group.add_argument(
+        "--lora_rank",
+        type=int,
+        default=0,
+        help="LoRA adapter 的秩，大于 0 时冻结基础权重只训练 adapter",
+    )
+    training_group.add_argument(
+        "--lora_alpha", type=float, default=None, help="LoRA 缩放系数，默认等于秩"
+    )
 
     # 损失函数配置
     loss_group = parser.add_argument_group(
         "损失函数配置", "与损失函数及其权重相关的参数"
     )
+    loss_group.add_argument(
+        "--l1_rate", type=float, default=1.0, help="L1 损失的权重"
+    )
+    loss_group.add_argument(
+        "--charbonnier_rate", type=float, default=0.0, help="Charbonnier 损失的权重"
+    )
+    loss_group.add_argument(
+        "--focal_rate", type=float, default=0.0, help="SmoothFocalL1 损失的权重"
+    )
+    loss_group.add_argument(
+        "--sqrt_rate", type=float, default=0.0, help="Sqrt 损失的权重"
+    )
+    loss_group.add_argument(
+        "--compile_loss",
+        action="store_true",
+        help="像素损失使用 torch.compile 融合，而不是手写反向",
+    )
     loss_group.add_argument(
         "--msssim_rate", type=float, default=0.0, help="MS-SSIM 损失的权重"
     )
@@ -114,6 +207,14 @@ def parse_args():
     experiment_group.add_argument(
         "--log_step", type=int, default=25, help="日志记录频率 (多少个 batch 记录一次)"
     )
+    experiment_group.add_argument(
+        "--async_ckpt",
+        action="store_true",
+        help="使用后台线程写盘的精简 checkpoint (生成器 / EMA / 判别器分开保存，不含 lpips)",
+    )
+    experiment_group.add_argument(
+        "--ckpt_shard", action="store_true", help="精简 checkpoint 按 rank 分片并行写盘"
+    )
 
     return parser.parse_args()
 
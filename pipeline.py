@@ -0,0 +1,49 @@
+"""Three-stage inference pipeline: threaded decode -> compute -> threaded finish.
+
+Upcoming items are decoded on a thread pool into a bounded prefetch window while the caller's
+thread runs the model, and metrics / resizing / encoding of finished items run on a second
+pool. OpenCV codecs and most numpy / skimage kernels release the GIL, so the device does not
+wait on PNG decode or encode.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_pipeline(items, decode, compute, finish, prefetch=2, workers=2, progress=None):
+    """按顺序产出 finish(item, data, output) 的结果。
+
+    decode(item) -> data 在线程池中提前执行，最多领先 prefetch 个；compute(item, data) -> output
+    在调用线程执行 (GPU 推理)；finish 在另一个线程池执行，最多积压 prefetch 个，限制内存占用。
+    items 可以是惰性迭代器 (在调用线程中按需取下一个)，此时 progress 不知道总数。
+    """
+    if progress is not None:
+        progress = progress(total=len(items) if hasattr(items, "__len__") else None)
+    with ThreadPoolExecutor(workers) as decoder, ThreadPoolExecutor(workers) as finisher:
+        pending = iter(items)
+        decoding = deque()
+        finishing = deque()
+
+        def submit_decode():
+            for item in pending:
+                decoding.append((item, decoder.submit(decode, item)))
+                return
+
+        for _ in range(prefetch):
+            submit_decode()
+        while decoding:
+            item, future = decoding.popleft()
+            data = future.result()
+            submit_decode()
+            output = compute(item, data)
+            finishing.append(finisher.submit(finish, item, data, output))
+            while len(finishing) > prefetch:
+                yield finishing.popleft().result()
+                if progress is not None:
+                    progress.update()
+        while finishing:
+            yield finishing.popleft().result()
+            if progress is not None:
+                progress.update()
+    if progress is not None:
+        progress.close()
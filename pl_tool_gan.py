@@ -2,12 +2,14 @@ import torch
 import lightning.pytorch as pl
 import torchmetrics as tm
 import heavyball
+from optimizer import build_adamw, state_bytes
 import cv2
 import os
 import numpy as np
 from utils import *
 import torchvision
 from pytorch_msssim import msssim
+from tiling import blend_window_tensor
 import heavyball.utils as hu
 import torch.nn.functional as F
 
@@ -29,8 +31,9 @@ class EMA:
                 self.shadow[name] = param.data.clone().to(param.device)
 
     def update(self):
+        # 按注册时的参数遍历，而不是当前的 requires_grad，被冻结的参数仍然参与平均
         for name, param in self.model.named_parameters():
-            if param.requires_grad:
+            if name in self.shadow:
                 # 如果设备不匹配，将shadow移动到正确的设备
                 if self.shadow[name].device != param.device:
                     self.shadow[name] = self.shadow[name].to(param.device)
@@ -41,7 +44,7 @@ class EMA:
 
     def apply_shadow(self):
         for name, param in self.model.named_parameters():
-            if param.requires_grad:
+            if name in self.shadow:
                 # 确保设备匹配
                 if self.shadow[name].device != param.device:
                     self.shadow[name] = self.shadow[name].to(param.device)
@@ -50,7 +53,7 @@ class EMA:
 
     def restore(self):
         for name, param in self.model.named_parameters():
-            if param.requires_grad and name in self.backup:
+            if name in self.backup:
                 param.data = self.backup[name]
 
 
@@ -65,6 +68,13 @@ class LightningModule(pl.LightningModule):
         # self.DNet = DINOv2DNet(opt.dnet_net)
         self.lpips = SemanticLoss(opt.lpips_net)
         self.l1loss = torch.nn.L1Loss()
+        self.pixel_loss = FusedPixelLoss(
+            l1=opt.l1_rate,
+            charbonnier=opt.charbonnier_rate,
+            focal=opt.focal_rate,
+            sqrt=opt.sqrt_rate,
+            compile=opt.compile_loss,
+        )
         self.adversarial_loss = torch.nn.BCEWithLogitsLoss()
         self.automatic_optimization = False
         self.msssim_loss = msssim
@@ -77,6 +87,10 @@ class LightningModule(pl.LightningModule):
         # Initialize EMA after model is moved to correct device
         self.ema = None
         self.ema_enabled = False
+        self.optim_state_logged = False
+        self.frozen_params = set()
+        # LoRA checkpoint 中没有基础权重
+        self.strict_loading = opt.lora_rank == 0
 
     def setup(self, stage):
         if self.ema is None:
@@ -86,21 +100,26 @@ class LightningModule(pl.LightningModule):
         pred = self.model(x)
         return pred
 
+    def on_save_checkpoint(self, checkpoint):
+        if self.ema is not None:
+            checkpoint["ema"] = self.ema.shadow
+        # LoRA 模式只保存 adapter，共享的基础权重由 --init_ckpt 提供并记录在 checkpoint 中
+        if self.opt.lora_rank > 0:
+            checkpoint["lora"] = {
+                "rank": self.opt.lora_rank,
+                "alpha": self.opt.lora_alpha,
+                "base": self.opt.init_ckpt,
+            }
+            state_dict = checkpoint["state_dict"]
+            for k in list(state_dict.keys()):
+                if k.startswith("model.") and "lora_" not in k:
+                    state_dict.pop(k)
+
     def configure_optimizers(self):
-        self.optimizer1 = heavyball.ForeachAdamW(
-            self.model.parameters(),
-            weight_decay=self.opt.weight_decay,
-            lr=self.learning_rate,
-            betas=(0.9, self.opt.beta2),
-            caution=True,
-        )
-        self.optimizer2 = heavyball.ForeachAdamW(
-            self.DNet.parameters(),
-            weight_decay=self.opt.weight_decay,
-            lr=self.learning_rate,
-            betas=(0.9, self.opt.beta2),
-            caution=True,
-        )
+        # LoRA 模式下基础权重已冻结，只为 adapter 建优化器状态
+        self.trainable_params = [p for p in self.model.parameters() if p.requires_grad]
+        self.optimizer1 = build_adamw(self.trainable_params, self.opt)
+        self.optimizer2 = build_adamw(self.DNet.parameters(), self.opt)
 
         self.scheduler1 = torch.optim.lr_scheduler.CosineAnnealingWarmRestarts(
             self.optimizer1, T_0=self.len_trainloader * 2
@@ -126,8 +145,59 @@ class LightningModule(pl.LightningModule):
             },
         )
 
+    def _frozen_modules(self):
+        """根据 --decoder_only_steps / --freeze_stages / --freeze_epoch 返回当前应冻结的模块"""
+        encoder = self.model.convnext_branch.encoder
+        if self.opt.decoder_only or self.global_step < self.opt.decoder_only_steps:
+            return [encoder]
+        if self.opt.freeze_stages > 0 and self.current_epoch >= self.opt.freeze_epoch:
+            return [
+                module
+                for i in range(self.opt.freeze_stages)
+                for module in (encoder.downsample_layers[i], encoder.stages[i])
+            ]
+        return []
+
+    def apply_freeze_schedule(self):
+        """冻结参数：关闭 requires_grad (前面的 stage 不再建图、不做反向)，释放梯度和优化器状态。
+
+        冻结状态只由 global_step / current_epoch 决定，断点续训和 DDP 各进程得到的结果一致。
+        """
+        frozen = {p for m in self._frozen_modules() for p in m.parameters()}
+        if frozen == self.frozen_params:
+            return
+        self.frozen_params = frozen
+        for p in self.trainable_params:
+            p.requires_grad_(p not in frozen)
+            if p in frozen:
+                p.grad = None
+                self.optimizer1.state.pop(p, None)
+        self.print(
+            f"freeze schedule: {sum(p.numel() for p in frozen) / 1e6:.1f}M generator "
+            f"parameters frozen at epoch {self.current_epoch}, step {self.global_step}"
+        )
+
+    def on_load_checkpoint(self, checkpoint):
+        if "ema" in checkpoint:
+            if self.ema is None:
+                self.ema = EMA(self.model, decay=0.9999)
+            self.ema.shadow = checkpoint["ema"]
+
+    def on_train_batch_start(self, batch, batch_idx):
+        self.apply_freeze_schedule()
+
+    def on_train_batch_end(self, outputs, batch, batch_idx):
+        # 优化器状态在第一次 step 时才创建，之后记录一次各模式的显存/内存占用
+        if self.optim_state_logged:
+            return
+        self.optim_state_logged = True
+        for name, optimizer in (("g", self.optimizer1), ("d", self.optimizer2)):
+            for device, size in state_bytes(optimizer).items():
+                self.print(f"optimizer_{name} state on {device}: {size / 2**20:.1f} MiB")
+
     def training_step(self, batch, batch_idx):
-        x, y = batch
+        # --decoder_only 时 batch 为缓存的 (x_layer1, x_layer2, out, y)，否则为 (x, y)
+        *x, y = batch
         optimizer_g, optimizer_d = self.optimizers()
 
         # Train Generator
@@ -161,19 +231,22 @@ class LightningModule(pl.LightningModule):
         self.toggle_optimizer(optimizer_g)
 
         # Forward pass
-        pred = self.model(x)
+        if len(x) == 1:
+            pred = self.model(x[0])
+        else:
+            pred = self.model.decode(*[f.float() for f in x])
         pred = torch.clamp(pred, -1, 1)
 
         # Calculate losses
         losses = {
-            "l1": self.l1loss(pred, y),
+            "l1": self.pixel_loss(pred, y),
             "gan": (
                 self.adversarial_loss(self.DNet(pred), self.valid)
                 if self.opt.gan_g_rate > 0
                 else 0
             ),
             "msssim": (
-                -self.msssim_loss(pred, y, normalize=True)
+                -self.msssim_loss(pred, y, val_range=2, normalize=True)
                 if self.opt.msssim_rate > 0
                 else 0
             ),
@@ -229,7 +302,10 @@ class LightningModule(pl.LightningModule):
         x, y = batch
         b, c, h, w = x.shape
         size = self.opt.valid_patch_size  # 2048
-        stride = 1536  # size // 4
+        stride = size - self.opt.valid_overlap  # 1536
+        window = blend_window_tensor(
+            size, self.opt.valid_overlap, self.opt.blend_mode, x.device
+        )
 
         # 计算需要的padding大小
         pad_h = (size - h % stride) % stride
@@ -241,7 +317,7 @@ class LightningModule(pl.LightningModule):
 
         # 创建输出tensor
         pred_padded = torch.zeros((b, c, h_pad, w_pad), device=x.device)
-        counts = torch.zeros((b, c, h_pad, w_pad), device=x.device, dtype=torch.uint8)
+        weights = torch.zeros((h_pad, w_pad), device=x.device)
 
         # 计算滑窗次数
         m = (h_pad - size) // stride + 1
@@ -258,11 +334,11 @@ class LightningModule(pl.LightningModule):
                 patch = x_padded[:, :, start_h:end_h, start_w:end_w]
                 patch_pred = self.model(patch)
 
-                pred_padded[:, :, start_h:end_h, start_w:end_w] += patch_pred
-                counts[:, :, start_h:end_h, start_w:end_w] += 1
+                pred_padded[:, :, start_h:end_h, start_w:end_w] += patch_pred * window
+                weights[start_h:end_h, start_w:end_w] += window
 
-        # 处理重叠区域的平均值
-        pred_padded = torch.where(counts > 0, pred_padded / counts, pred_padded)
+        # 处理重叠区域的 (加权) 平均值
+        pred_padded = torch.where(weights > 0, pred_padded / weights, pred_padded)
         pred_padded = torch.clamp(pred_padded, -1, 1)
 
         # 裁剪回原始大小
@@ -5,22 +5,74 @@ import os
 import glob
 import pandas as pd
 from tqdm import tqdm
-from skimage.metrics import peak_signal_noise_ratio as psnr
-from skimage.metrics import structural_similarity as ssim
-from models.fusenet import convnext_plus_head
+from checkpoint import load_inference_model
+from metrics import image_metrics
+from models.lora import load_lora_adapter
+from models.fuse import fuse_for_inference
+from tiling import ArraySink, predict_image
+from halo import capture_global_statistics, predict_halo
+from haze_skip import predict_adaptive
+from preview import preview
+from ensemble import build_ensemble
+from pipeline import run_pipeline
+from backend import make_backend
+from autotune import load_or_tune
+from result_cache import ResultCache, cache_key, file_digest, model_digest, settings_digest
 
 # --- Configuration ---
 DOWNSIZE = 1
 DEVICE = 1
 IMAGESIZE = 2048  # Adjusted for memory constraints
 OVERLAP = 512  # Maintain a good overlap
+BATCHSIZE = 2  # Tiles per forward pass
+# CPU-only boxes: {"name": "cpu", "threads": 16} (1024 tiles, 256 overlap, bf16 when supported)
+# Exported graph: {"name": "graph", "path": "generator.onnx" or "generator.pt2"} (see graph_export.py)
+BACKEND = {
+    "name": "cuda",
+    "device": DEVICE,
+    "tile_size": IMAGESIZE,
+    "overlap": OVERLAP,
+    "batch_size": BATCHSIZE,
+}
+# Measure (or reuse from ~/.cache/dehaze/plans.json) the fastest tile / overlap / batch
+# plan for this device, model and image size instead of the BACKEND values
+AUTOTUNE = False
+MEMORY_BUDGET = None  # bytes the plan may use: device memory on CUDA, process peak RSS on CPU
+# Reuse the outputs and metrics of unchanged images across runs. The key hashes the input
+# bytes, the model weights and the inference settings; least recently used entries are
+# evicted beyond RESULT_CACHE_BYTES. Outputs are kept as float32 .npy (about 290 MB for
+# 6000x4000), so cached metrics equal those of a fresh run
+RESULT_CACHE = None  # e.g. "~/.cache/dehaze/results"
+RESULT_CACHE_BYTES = 50 * 2**30
+PREFETCH = 2  # Images decoded ahead of / waiting behind the model
+WORKERS = 2  # Threads for decoding and for metrics + encoding
 DATAMODE = "test"
 EXPNAME = "v3->cautiou+dpath0.2+dropout0.2+extra_data+cc"
 TESTPATH = f"/home/ubuntu/Competition/LowLevel/dehaze_data_{DOWNSIZE}/{DATAMODE}/input"
 GTPATH = f"/home/ubuntu/Competition/LowLevel/dehaze_data_{DOWNSIZE}/{DATAMODE}/gt"
+# Training checkpoints (.ckpt), generator artifacts written by export.py (.safetensors)
+# or int8 models written by quantize.py (.int8.pt, with the cpu backend)
 CKPTPATHS = [
     glob.glob(f"./checkpoints/{EXPNAME}/*.ckpt")[1],
 ]
+# "tta": False | True (hflip) | a tta.POLICIES name ("flips", "rot", "d4") | list of transforms
+# Optional "lora": path to an adapter (save_lora file or LoRA training checkpoint)
+# Optional "ema": True loads the EMA shadow weights of training checkpoints (every ensemble
+# member included); .safetensors artifacts already hold whichever weights were exported
+# Optional "blend": "mean" | "linear" | "cosine" | "gaussian" tile weighting; the feathered
+# modes hide seams at a smaller OVERLAP (see benchmarks/seam_error.py)
+# Optional "halo": context pixels per side (multiple of 16, see `python halo.py measure`);
+# replaces OVERLAP averaging with exact core cropping. "global_stats": True injects CA
+# pooling vectors from a low-resolution whole-image pass into every tile; this approximates
+# the full-resolution statistics (error: `python halo.py stats`).
+# Optional "ensemble": list of {"ckpt_index": i or [i, j] (weight-averaged), "weight": w}
+# replaces "ckpt_index"; "interleave": True gives member k only the k-th TTA transform
+# Optional "haze_skip": dark-channel haze threshold (e.g. 0.1); clearer tiles are passed
+# through, or run through "cheap_ckpt" (a CKPTPATHS index) when given. Use a feathered
+# "blend" so skipped tiles fade into processed ones (see `python haze_skip.py report`)
+# Optional "preview": long side of a single low-resolution pass (e.g. 1024) whose correction
+# is guided-upsampled to full size; seconds per image instead of a full tiled run
+# (latency / quality trade-off: `python preview.py report`)
 CONFIGS = [
     {"tta": True, "ckpt_index": 0, "name": "tta"},
 ]
@@ -30,171 +82,213 @@ BASE_OUTDIR = (
 
 
 # --- Helper Functions ---
-def split_image_into_patches_with_overlap(image, patch_size=IMAGESIZE, overlap=OVERLAP):
-    patches = []
-    coords = []
-    h, w, _ = image.shape
-    stride = patch_size - overlap
-
-    for x in range(0, h, stride):
-        for y in range(0, w, stride):
-            x_end = min(x + patch_size, h)
-            y_end = min(y + patch_size, w)
-
-            # --- Zero-padding on all sides ---
-            top_pad = 0
-            bottom_pad = 0
-            left_pad = 0
-            right_pad = 0
-
-            if x_end - x < patch_size:
-                bottom_pad = patch_size - (x_end - x)
-            if y_end - y < patch_size:
-                right_pad = patch_size - (y_end - y)
-
-            patch = image[x:x_end, y:y_end]
-            patch = cv2.copyMakeBorder(
-                patch,
-                top_pad,
-                bottom_pad,
-                left_pad,
-                right_pad,
-                cv2.BORDER_REFLECT,
-                # value=0,
-            )
-
-            patches.append(patch)
-            coords.append((x, y))
-
-    return patches, coords
-
-
-def preprocess_batch_image(image):
-    image = image.astype(np.float32)
-    image = torch.from_numpy(image).permute(2, 0, 1).unsqueeze(0).float()
-    image = image / 127.5 - 1
-    return image
+def predict_and_reconstruct_with_overlap_v2(image, model, enable_tta, tiler, blend="mean"):
+    sink = ArraySink(*image.shape[:2])
+    predict_image(model, image, tiler, sink, enable_tta, blend=blend)
+    return sink.array
 
 
-def reconstruct_image_with_overlap(
-    patches, coords, image_shape, patch_size=IMAGESIZE, overlap=OVERLAP
-):
-    reconstructed = torch.zeros(image_shape, dtype=torch.float32)
-    vote_map = torch.zeros(image_shape[:2], dtype=torch.int32)
+def predict_with_halo(image, model, enable_tta, tiler, halo, global_stats=False):
+    # Each tile contributes only its central tile_size - 2 * halo core, no averaging
+    pooling = capture_global_statistics(model, image) if global_stats else None
+    sink = ArraySink(*image.shape[:2])
+    predict_halo(model, image, tiler, halo, sink, enable_tta, pooling)
+    return sink.array
 
-    for patch, (x, y) in zip(patches, coords):
-        x_end = min(x + patch_size, image_shape[0])
-        y_end = min(y + patch_size, image_shape[1])
 
-        patch = patch[: x_end - x, : y_end - y]
+def predict_with_haze_skip(image, model, enable_tta, tiler, threshold, cheap=None, blend="cosine"):
+    # Only tiles whose dark-channel haze estimate reaches the threshold run the full model
+    sink = ArraySink(*image.shape[:2])
+    _, stats = predict_adaptive(model, image, tiler, sink, threshold, enable_tta, cheap, blend)
+    return sink.array, stats["fraction"]
 
-        reconstructed[x:x_end, y:y_end, :] += patch
-        vote_map[x:x_end, y:y_end] += 1
 
-    vote_map[vote_map == 0] = 1
-    reconstructed /= vote_map.unsqueeze(-1)
+def load_model(ckpt_path, ema=False):
+    # .safetensors (memory-mapped), .int8.pt (CPU only), Lightning checkpoint or slim checkpoint
+    # directory; LoRA checkpoints are merged with their recorded base weights
+    print(f"Loading checkpoint: {ckpt_path}")
+    return load_inference_model(ckpt_path, ema=ema)
 
-    return reconstructed.cpu().numpy()
 
+def decode_pair(valid):
+    # Each input / GT is read once, on a prefetch thread
+    input_image = cv2.imread(f"{TESTPATH}/{valid}")
+    gt_image_path = f"{GTPATH}/{valid}"
+    if os.path.exists(gt_image_path):
+        gt_image = cv2.imread(gt_image_path).astype(np.uint16)
+    else:
+        gt_image = np.zeros(input_image.shape, dtype=np.uint16)
+    return input_image, gt_image
 
-def predict_and_reconstruct_with_overlap_v2(
-    image_path, model, enable_tta, patch_size=IMAGESIZE, overlap=OVERLAP
-):
-    image = cv2.imread(image_path)
-    image = np.uint16(image)
-    original_shape = image.shape
-    patches, coords = split_image_into_patches_with_overlap(image, patch_size, overlap)
 
-    predicted_patches = []
+def evaluate_and_save(outdir, valid, input_image, gt_image, output_image):
+    # Metrics, resizing and PNG encoding run on a background thread; metrics use the
+    # unrounded output, the same as batch_predict.py
+    psnr_value, ssim_value = image_metrics(output_image, gt_image)
 
-    with torch.no_grad():
-        for patch in tqdm(patches):
-            patch_tensor = preprocess_batch_image(patch).cuda(DEVICE)
+    input_image_resized = cv2.resize(input_image.astype(np.uint16), (0, 0), fx=0.5, fy=0.5)
+    output_image_resized = cv2.resize(output_image, (0, 0), fx=0.5, fy=0.5)
+    gt_image_resized = cv2.resize(gt_image, (0, 0), fx=0.5, fy=0.5)
 
-            if enable_tta:
-                out1 = model(patch_tensor)
-                out2 = torch.flip(model(torch.flip(patch_tensor, [3])), [3])
-                output = (out1 + out2) / 2
-            else:
-                output = model(patch_tensor)
-            output = output.squeeze(0).permute(1, 2, 0).detach().cpu()
-            output = (output + 1) * 127.5
-            output = torch.clamp(output, 0, 255).type(torch.uint16)
-            predicted_patches.append(output)
-
-    reconstructed_image = reconstruct_image_with_overlap(
-        predicted_patches, coords, original_shape
+    concatenated_image = np.concatenate(
+        (input_image_resized, output_image_resized, gt_image_resized), axis=1
     )
-    return reconstructed_image
+    cv2.imwrite(outdir + f"/{valid}", concatenated_image)
+    return psnr_value, ssim_value
 
 
 # --- Main Loop ---
-valid_list = sorted(os.listdir(TESTPATH))
-
-for config in CONFIGS:
-    ENABLE_TTA = config["tta"]
-    OUTDIR = f"{BASE_OUTDIR}_{config['name']}"
-    CKPTPATH = CKPTPATHS[config["ckpt_index"]]
-
-    model = convnext_plus_head()
-    print(f"Loading checkpoint: {CKPTPATH}")
-    ckpt = torch.load(CKPTPATH, map_location="cpu", weights_only=False)["state_dict"]
-    for k in list(ckpt.keys()):
-        if "lpips" in k:
-            ckpt.pop(k)
-        elif "DNet" in k:
-            ckpt.pop(k)
-        elif "gradloss" in k:
-            ckpt.pop(k)
-        elif "model." in k:
-            ckpt[k.replace("model.", "")] = ckpt.pop(k)
-        else:
-            ckpt.pop(k)
-    model.load_state_dict(ckpt)
-    model.eval()
-    model = model.cuda(DEVICE)
-
-    if not os.path.exists(OUTDIR):
-        os.makedirs(OUTDIR)
-
-    psnr_list = []
-    ssim_list = []
-    for _, valid in enumerate(valid_list):
-        input_image_path = f"{TESTPATH}/{valid}"
-        gt_image_path = f"{GTPATH}/{valid}"
-
-        output_image = predict_and_reconstruct_with_overlap_v2(
-            input_image_path, model, ENABLE_TTA, patch_size=IMAGESIZE, overlap=OVERLAP
-        )
-
-        input_image = cv2.imread(input_image_path).astype(np.uint16)
-        if os.path.exists(gt_image_path):
-            gt_image = cv2.imread(gt_image_path).astype(np.uint16)
+if __name__ == "__main__":
+    valid_list = sorted(os.listdir(TESTPATH))
+    backend = make_backend(BACKEND)
+    # The pinned staging buffers are allocated once and reused for every image
+    tiler = backend.tiler()
+
+    for config in CONFIGS:
+        ENABLE_TTA = config["tta"]
+        OUTDIR = f"{BASE_OUTDIR}_{config['name']}"
+
+        if not backend.needs_model:
+            # The exported graph already holds the weights (and any folded-in TTA)
+            model = None
+        elif config.get("ensemble"):
+            # All members see every tile in one pass; TTA runs inside the ensemble
+            model = build_ensemble(
+                config["ensemble"],
+                CKPTPATHS,
+                ENABLE_TTA,
+                config.get("interleave", False),
+                ema=config.get("ema", False),
+            )
+            ENABLE_TTA = False
         else:
-            gt_image = np.zeros_like(input_image)
-
-        psnr_value = psnr(output_image, gt_image, data_range=255)
-        ssim_value = ssim(output_image, gt_image, data_range=255, channel_axis=2)
-        psnr_list.append(psnr_value)
-        ssim_list.append(ssim_value)
+            CKPTPATH = CKPTPATHS[config["ckpt_index"]]
+            model = load_model(CKPTPATH, config.get("ema", False))
+            if config.get("lora"):
+                # 共享的基础权重 + 按客户雾况训练的 adapter，合并后推理没有额外开销
+                print(f"Loading LoRA adapter: {config['lora']}")
+                load_lora_adapter(model, config["lora"])
+        if model is not None:
+            # Exact in eval mode: BN / LayerNorm affine / layer scale folded into the adjacent layers
+            model, _ = fuse_for_inference(model.eval())
+        model = backend.prepare(model)
+
+        cheap_model = None
+        if config.get("cheap_ckpt") is not None:
+            cheap_model = load_model(CKPTPATHS[config["cheap_ckpt"]])
+            cheap_model = backend.prepare(fuse_for_inference(cheap_model.eval())[0])
+
+        if AUTOTUNE and backend.needs_model:
+            height, width = cv2.imread(f"{TESTPATH}/{valid_list[0]}").shape[:2]
+            plan = load_or_tune(model, backend.device, height, width, ENABLE_TTA, MEMORY_BUDGET)
+            print(f"Tile plan: {plan}")
+            backend.tile_size = plan["tile_size"]
+            backend.overlap = plan["overlap"]
+            backend.batch_size = plan["batch_size"]
+            tiler = backend.tiler()
+
+        if config.get("halo"):
+            halo_tiler = backend.tiler(overlap=2 * config["halo"])
+
+        if not os.path.exists(OUTDIR):
+            os.makedirs(OUTDIR)
+
+        cache = None
+        if RESULT_CACHE:
+            cache = ResultCache(RESULT_CACHE, RESULT_CACHE_BYTES)
+            if backend.needs_model:
+                model_id = model_digest(model)
+            else:
+                model_id = file_digest(BACKEND["path"])
+            if cheap_model is not None:
+                model_id += model_digest(cheap_model)
+            settings_id = settings_digest(
+                {
+                    "config": {k: v for k, v in config.items() if k != "name"},
+                    "backend": BACKEND,
+                    "tile_size": backend.tile_size,
+                    "overlap": backend.overlap,
+                }
+            )
 
-        input_image_resized = cv2.resize(input_image, (0, 0), fx=0.5, fy=0.5)
-        output_image_resized = cv2.resize(output_image, (0, 0), fx=0.5, fy=0.5)
-        gt_image_resized = cv2.resize(gt_image, (0, 0), fx=0.5, fy=0.5)
+        def decode(valid):
+            if cache is None:
+                return None, None, None, decode_pair(valid)
+            # Hashing runs on the prefetch threads, next to the decode it may save
+            key = cache_key(file_digest(f"{TESTPATH}/{valid}"), model_id, settings_id)
+            gt_path = f"{GTPATH}/{valid}"
+            gt_id = file_digest(gt_path) if os.path.exists(gt_path) else None
+            cached = cache.get(key)
+            if (
+                cached is not None
+                and cached[1].get("gt") == gt_id
+                and os.path.exists(f"{OUTDIR}/{valid}")
+            ):
+                # Output, metrics and comparison image are all current: nothing to decode
+                return key, gt_id, cached, None
+            return key, gt_id, cached, decode_pair(valid)
+
+        def compute(valid, data):
+            _, _, cached, images = data
+            if cached is not None:
+                return cached[0], cached[1].get("skipped")
+            if config.get("preview"):
+                return preview(model, images[0], config["preview"], ENABLE_TTA)
+            if config.get("halo"):
+                return predict_with_halo(
+                    images[0],
+                    model,
+                    ENABLE_TTA,
+                    halo_tiler,
+                    config["halo"],
+                    config.get("global_stats", False),
+                )
+            if config.get("haze_skip") is not None:
+                return predict_with_haze_skip(
+                    images[0],
+                    model,
+                    ENABLE_TTA,
+                    tiler,
+                    config["haze_skip"],
+                    cheap_model,
+                    config.get("blend", "cosine"),
+                )
+            return predict_and_reconstruct_with_overlap_v2(
+                images[0], model, ENABLE_TTA, tiler, config.get("blend", "mean")
+            )
 
-        concatenated_image = np.concatenate(
-            (input_image_resized, output_image_resized, gt_image_resized), axis=1
+        def finish(valid, data, output_image):
+            key, gt_id, cached, images = data
+            skipped = None
+            if isinstance(output_image, tuple):
+                output_image, skipped = output_image
+            if images is None:
+                return cached[1]["psnr"], cached[1]["ssim"], skipped
+            psnr_value, ssim_value = evaluate_and_save(OUTDIR, valid, *images, output_image)
+            if cache is not None and (cached is None or cached[1].get("gt") != gt_id):
+                meta = {"psnr": float(psnr_value), "ssim": float(ssim_value), "skipped": skipped, "gt": gt_id}
+                cache.put(key, output_image, meta)
+            return psnr_value, ssim_value, skipped
+
+        scores = list(
+            run_pipeline(
+                valid_list, decode, compute, finish, PREFETCH, WORKERS, progress=tqdm
+            )
         )
-        cv2.imwrite(OUTDIR + f"/{valid}", concatenated_image)
-
-    df = pd.DataFrame(
-        {
-            "image": valid_list,
-            "psnr": psnr_list,
-            "ssim": ssim_list,
-        }
-    )
-    df.to_csv(f"{OUTDIR}/metrics.csv", index=False)
 
-    print(df)
-    print(df.describe())
+        df = pd.DataFrame(
+            {
+                "image": valid_list,
+                "psnr": [score[0] for score in scores],
+                "ssim": [score[1] for score in scores],
+            }
+        )
+        if config.get("haze_skip") is not None:
+            # Fraction of tiles that took the cheap path
+            df["skipped"] = [score[2] for score in scores]
+        df.to_csv(f"{OUTDIR}/metrics.csv", index=False)
+
+        print(df)
+        print(df.describe())
+        if cache is not None:
+            print(cache.summary())
@@ -0,0 +1,169 @@
+"""Fast preview: low-resolution inference plus guided upsampling of the correction.
+
+The image is downscaled so its long side is at most max_size (rounded to a multiple of 32) and
+dehazed in one forward pass, or in a few tiles when a Tiler is given. The correction is then
+carried back to full resolution as a per-pixel, per-channel affine map output = a * input + b.
+This is the fast guided filter (He & Sun, 2015) with the input as its own guide. a and b are
+fitted with box filters on the low-resolution input / output pair, bilinearly upsampled and
+applied to the full-resolution input. Edges and texture come from the input, and the haze
+correction comes from the model.
+
+Usage:
+    python preview.py predict MODEL INPUT OUTPUT [--max_size 1024]
+    python preview.py report MODEL [--dataset_root ./dehaze_data_1/] [--images 8]
+        [--max_sizes 512 1024 1536]
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from tta import tta_forward
+
+
+MULTIPLE = 32  # 整图推理要求尺寸是 32 的倍数
+
+
+def preview_size(height, width, max_size=1024):
+    scale = min(1.0, max_size / max(height, width))
+    return tuple(max(MULTIPLE, round(s * scale / MULTIPLE) * MULTIPLE) for s in (height, width))
+
+
+@torch.inference_mode()
+def low_res_inference(model, image, max_size=1024, tta=False, tiler=None):
+    """返回 (缩小后的输入, 模型输出)，均为 uint8 HxWx3"""
+    from tiling import ArraySink, predict_image
+
+    h, w = preview_size(*image.shape[:2], max_size)
+    small = cv2.resize(np.asarray(image), (w, h), interpolation=cv2.INTER_AREA)
+    if tiler is not None:
+        return small, predict_image(model, small, tiler, ArraySink(h, w, np.uint8), tta).array
+    param = next(model.parameters())
+    x = torch.from_numpy(small).to(param.device).permute(2, 0, 1)[None].to(param.dtype) / 127.5 - 1
+    output = ((tta_forward(model, x, tta)[0] + 1) * 127.5).clamp(0, 255).to(torch.uint8)
+    return small, output.permute(1, 2, 0).cpu().numpy()
+
+
+def guided_coefficients(guide, target, radius=4, eps=1e-3):
+    """逐通道拟合局部线性模型 target ≈ a * guide + b (guide / target 为 [0, 1] 的 float32 HxWx3)"""
+    size = (2 * radius + 1, 2 * radius + 1)
+
+    def box(x):
+        return cv2.boxFilter(x, -1, size, borderType=cv2.BORDER_REFLECT)
+
+    mean_i = box(guide)
+    mean_p = box(target)
+    var_i = box(guide * guide) - mean_i * mean_i
+    cov_ip = box(guide * target) - mean_i * mean_p
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return box(a), box(b)
+
+
+def guided_upsample(image, small, output, radius=4, eps=1e-3):
+    """把低分辨率 small -> output 的变换迁移到全分辨率 image，返回 uint8"""
+    h, w = image.shape[:2]
+    a, b = guided_coefficients(small.astype(np.float32) / 255, output.astype(np.float32) / 255, radius, eps)
+    a = cv2.resize(a, (w, h), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(b, (w, h), interpolation=cv2.INTER_LINEAR)
+    result = a * (np.asarray(image, dtype=np.float32) / 255) + b
+    return np.clip(result * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def preview(model, image, max_size=1024, tta=False, radius=4, eps=1e-3, tiler=None):
+    small, output = low_res_inference(model, image, max_size, tta, tiler)
+    return guided_upsample(image, small, output, radius, eps)
+
+
+def report(model, names, dataset_root, max_sizes, tiler, radius=4, eps=1e-3):
+    """比较全量分块推理与各 preview 尺寸的 PSNR / SSIM (对 GT 和对全量结果) 及耗时。
+
+    "bilinear" 行直接放大低分辨率输出，用来衡量引导上采样的收益。
+    """
+    from skimage.metrics import peak_signal_noise_ratio as psnr
+    from skimage.metrics import structural_similarity as ssim
+
+    from tiling import ArraySink, predict_image
+
+    def sync():
+        if tiler.device.type == "cuda":
+            torch.cuda.synchronize(tiler.device)
+
+    rows = {}
+    for name in names:
+        image = cv2.imread(os.path.join(dataset_root, "train", "input", name))
+        gt = cv2.imread(os.path.join(dataset_root, "train", "gt", name))
+        h, w = image.shape[:2]
+        start = time.perf_counter()
+        full = predict_image(model, image, tiler, ArraySink(h, w, np.uint8)).array
+        sync()
+        results = {"full": (full, time.perf_counter() - start)}
+        for size in max_sizes:
+            start = time.perf_counter()
+            small, output = low_res_inference(model, image, size)
+            sync()
+            inference = time.perf_counter() - start
+            results[f"{size} bilinear"] = (
+                cv2.resize(output, (w, h), interpolation=cv2.INTER_LINEAR), time.perf_counter() - start
+            )
+            start = time.perf_counter()
+            results[f"{size} guided"] = (
+                guided_upsample(image, small, output, radius, eps), inference + time.perf_counter() - start
+            )
+        for key, (result, seconds) in results.items():
+            rows.setdefault(key, []).append(
+                (
+                    psnr(gt, result, data_range=255),
+                    ssim(gt, result, data_range=255, channel_axis=2),
+                    psnr(full, result, data_range=255) if key != "full" else np.inf,
+                    seconds,
+                )
+            )
+    reference = np.mean(rows["full"], axis=0)[3]
+    print(f"{'mode':<16}{'PSNR':>8}{'SSIM':>8}{'vs full':>9}{'s/img':>8}{'speedup':>9}")
+    for key, values in rows.items():
+        p, s, f, t = np.mean(values, axis=0)
+        print(f"{key:<16}{p:>8.3f}{s:>8.4f}{f:>9.2f}{t:>8.2f}{reference / t:>8.1f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from checkpoint import load_inference_model
+    from tiling import Tiler
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["predict", "report"])
+    parser.add_argument("model", type=str, help="checkpoint, slim checkpoint directory or .safetensors")
+    parser.add_argument("input", type=str, nargs="?")
+    parser.add_argument("output", type=str, nargs="?")
+    parser.add_argument("--max_size", type=int, default=1024, help="long side of the low-resolution pass")
+    parser.add_argument("--max_sizes", type=int, nargs="+", default=[512, 1024, 1536])
+    parser.add_argument("--radius", type=int, default=4, help="guided filter radius at low resolution")
+    parser.add_argument("--eps", type=float, default=1e-3)
+    parser.add_argument("--tta", type=str, default="none")
+    parser.add_argument("--dataset_root", type=str, default="./dehaze_data_1/")
+    parser.add_argument("--valid_image_rate", type=float, default=0.12)
+    parser.add_argument("--images", type=int, default=8, help="number of validation images for the report")
+    parser.add_argument("--tile", type=int, default=2048, help="tile size of the full path in the report")
+    parser.add_argument("--overlap", type=int, default=512)
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    model = load_inference_model(args.model, args.device, fuse=True)
+
+    if args.command == "predict":
+        image = cv2.imread(args.input)
+        start = time.perf_counter()
+        result = preview(model, image, args.max_size, args.tta, args.radius, args.eps)
+        print(f"Preview of {image.shape[1]}x{image.shape[0]} in {time.perf_counter() - start:.2f} s")
+        cv2.imwrite(args.output, result)
+    else:
+        from dataset import split_image_list
+
+        _, valid_names = split_image_list(args.dataset_root, args.valid_image_rate)
+        tiler = Tiler(args.tile, args.overlap, 1, args.device)
+        report(model, sorted(valid_names)[: args.images], args.dataset_root, args.max_sizes, tiler, args.radius, args.eps)
@@ -1,9 +1,14 @@
 import torch
 import torch.nn.functional as F
+from functools import lru_cache
 from math import exp
+import warnings
 import numpy as np
 
 
+MSSSIM_WEIGHTS = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+
+
 def gaussian(window_size, sigma):
     gauss = torch.Tensor([exp(-(x - window_size//2)**2/float(2*sigma**2)) for x in range(window_size)])
     return gauss/gauss.sum()
@@ -16,47 +21,75 @@ def create_window(window_size, channel=1):
     return window
 
 
-def ssim(img1, img2, window_size=11, window=None, size_average=True, full=False, val_range=None):
+@lru_cache(maxsize=None)
+def _separable_window(window_size, channel, dtype, device):
+    # 2D gaussian = outer(g, g), so two 1D passes give the same result as the dense window.
+    # Cached per (size, channel, dtype, device) instead of being rebuilt on every call.
+    g = gaussian(window_size, 1.5).to(device=device, dtype=dtype)
+    window_h = g.view(1, 1, 1, window_size).expand(channel, 1, 1, window_size).contiguous()
+    window_v = g.view(1, 1, window_size, 1).expand(channel, 1, window_size, 1).contiguous()
+    return window_h, window_v
+
+
+@lru_cache(maxsize=None)
+def _msssim_weights(dtype, device):
+    return torch.tensor(MSSSIM_WEIGHTS, dtype=dtype, device=device)
+
+
+def _value_range(img1, val_range):
+    if val_range is not None:
+        return val_range
     # Value range can be different from 255. Other common ranges are 1 (sigmoid) and 2 (tanh).
-    if val_range is None:
-        if torch.max(img1) > 128:
-            max_val = 255
-        else:
-            max_val = 1
-
-        if torch.min(img1) < -0.5:
-            min_val = -1
-        else:
-            min_val = 0
-        L = max_val - min_val
-    else:
-        L = val_range
+    # Guessing it costs two full reductions and a host sync, pass val_range explicitly when known.
+    max_val = 255 if torch.max(img1) > 128 else 1
+    min_val = -1 if torch.min(img1) < -0.5 else 0
+    return max_val - min_val
 
-    padd = 0
+
+def _moments(img1, img2, window_size):
+    # mu1, mu2, E[x^2], E[y^2], E[xy] from one grouped separable convolution
     (_, channel, height, width) = img1.size()
-    if window is None:
-        real_size = min(window_size, height, width)
-        window = create_window(real_size, channel=channel).to(img1.device)
+    real_size = min(window_size, height, width)
+    window_h, window_v = _separable_window(real_size, 5 * channel, img1.dtype, img1.device)
+    stacked = torch.cat((img1, img2, img1 * img1, img2 * img2, img1 * img2), dim=1)
+    stacked = F.conv2d(stacked, window_h, groups=5 * channel)
+    stacked = F.conv2d(stacked, window_v, groups=5 * channel)
+    return stacked.chunk(5, dim=1)
+
 
-    mu1 = F.conv2d(img1, window, padding=padd, groups=channel)
-    mu2 = F.conv2d(img2, window, padding=padd, groups=channel)
+def _ssim_and_cs(img1, img2, window_size, L):
+    mu1, mu2, e11, e22, e12 = _moments(img1, img2, window_size)
 
     mu1_sq = mu1.pow(2)
     mu2_sq = mu2.pow(2)
     mu1_mu2 = mu1 * mu2
 
-    sigma1_sq = F.conv2d(img1 * img1, window, padding=padd, groups=channel) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, padding=padd, groups=channel) - mu2_sq
-    sigma12 = F.conv2d(img1 * img2, window, padding=padd, groups=channel) - mu1_mu2
+    sigma1_sq = e11 - mu1_sq
+    sigma2_sq = e22 - mu2_sq
+    sigma12 = e12 - mu1_mu2
 
     C1 = (0.01 * L) ** 2
     C2 = (0.03 * L) ** 2
 
     v1 = 2.0 * sigma12 + C2
     v2 = sigma1_sq + sigma2_sq + C2
-    cs = torch.mean(v1 / v2)  # contrast sensitivity
+    cs_map = v1 / v2  # contrast sensitivity
+    ssim_map = ((2 * mu1_mu2 + C1) / (mu1_sq + mu2_sq + C1)) * cs_map
+    return ssim_map, cs_map
 
-    ssim_map = ((2 * mu1_mu2 + C1) * v1) / ((mu1_sq + mu2_sq + C1) * v2)
+
+def ssim(img1, img2, window_size=11, window=None, size_average=True, full=False, val_range=None):
+    # `window` is kept for backwards compatibility only: the separable gaussian window is
+    # cached internally and a custom window is not supported anymore.
+    if window is not None:
+        warnings.warn(
+            "ssim(window=...) is ignored, the gaussian window of `window_size` is always used",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    L = _value_range(img1, val_range)
+    ssim_map, cs_map = _ssim_and_cs(img1, img2, window_size, L)
+    cs = torch.mean(cs_map)
 
     if size_average:
         ret = ssim_map.mean()
@@ -69,18 +102,18 @@ def ssim(img1, img2, window_size=11, window=None, size_average=True, full=False,
 
 
 def msssim(img1, img2, window_size=11, size_average=True, val_range=None, normalize=False):
-    device = img1.device
-    weights = torch.FloatTensor([0.0448, 0.2856, 0.3001, 0.2363, 0.1333]).to(device)
+    weights = _msssim_weights(img1.dtype, img1.device)
     levels = weights.size()[0]
     mssim = []
     mcs = []
-    for _ in range(levels):
+    for level in range(levels):
         sim, cs = ssim(img1, img2, window_size=window_size, size_average=size_average, full=True, val_range=val_range)
         mssim.append(sim)
         mcs.append(cs)
 
-        img1 = F.avg_pool2d(img1, (2, 2))
-        img2 = F.avg_pool2d(img2, (2, 2))
+        if level < levels - 1:
+            img1 = F.avg_pool2d(img1, (2, 2))
+            img2 = F.avg_pool2d(img2, (2, 2))
 
     mssim = torch.stack(mssim)
     mcs = torch.stack(mcs)
@@ -105,29 +138,17 @@ class SSIM(torch.nn.Module):
         self.size_average = size_average
         self.val_range = val_range
 
-        # Assume 1 channel for SSIM
-        self.channel = 1
-        self.window = create_window(window_size)
-
     def forward(self, img1, img2):
-        (_, channel, _, _) = img1.size()
-
-        if channel == self.channel and self.window.dtype == img1.dtype:
-            window = self.window
-        else:
-            window = create_window(self.window_size, channel).to(img1.device).type(img1.dtype)
-            self.window = window
-            self.channel = channel
-
-        return ssim(img1, img2, window=window, window_size=self.window_size, size_average=self.size_average)
+        return ssim(img1, img2, window_size=self.window_size, size_average=self.size_average, val_range=self.val_range)
 
 class MSSSIM(torch.nn.Module):
-    def __init__(self, window_size=11, size_average=True, channel=3):
+    def __init__(self, window_size=11, size_average=True, channel=3, val_range=None, normalize=False):
         super(MSSSIM, self).__init__()
         self.window_size = window_size
         self.size_average = size_average
         self.channel = channel
+        self.val_range = val_range
+        self.normalize = normalize
 
     def forward(self, img1, img2):
-        # TODO: store window between calls if possible
-        return msssim(img1, img2, window_size=self.window_size, size_average=self.size_average)
+        return msssim(img1, img2, window_size=self.window_size, size_average=self.size_average, val_range=self.val_range, normalize=self.normalize)
@@ -0,0 +1,202 @@
+"""Post-training static int8 quantization of the generator for CPU serving.
+
+Every nn.Linear (the ConvNeXt pwconv1 / pwconv2, which dominate the FLOPs) and every dense
+nn.Conv2d (groups == 1) is wrapped in QuantWrapper: the activation is quantized on the way in
+and dequantized on the way out. LayerNorm, depthwise convs, GELU, the attention gates and the
+tanh head stay in float. Activation ranges come from a calibration pass over random crops of
+training images; weights are quantized per output channel.
+
+The quantized model is saved as a state dict (*.int8.pt). load_quantized() rebuilds the same
+structure, so predict.py can load it like any other checkpoint (use the CPU backend).
+
+Usage:
+    python quantize.py CKPT OUT.int8.pt [--dataset_root ./dehaze_data_1/] [--calib_tiles 16]
+        [--report 4]
+"""
+
+import argparse
+import copy
+import os
+import time
+import warnings
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import (
+    MinMaxObserver,
+    QConfig,
+    QuantWrapper,
+    convert,
+    get_default_qconfig,
+    prepare,
+)
+
+
+SKIP = ("segmentation_head1",)  # 输出头 (conv + tanh) 保持浮点
+
+
+def quantization_targets(model, skip=SKIP):
+    """需要量化的 (父模块, 子模块名)：nn.Linear 与 groups == 1 的 nn.Conv2d"""
+    targets = []
+    for name, parent in model.named_modules():
+        if any(name == s or name.startswith(s + ".") for s in skip):
+            continue
+        for child_name, child in parent.named_children():
+            if type(child) is nn.Linear or (type(child) is nn.Conv2d and child.groups == 1):
+                targets.append((parent, child_name))
+    return targets
+
+
+def make_qconfig(backend="x86", observer="histogram"):
+    if observer == "histogram":
+        return get_default_qconfig(backend)
+    default = get_default_qconfig(backend)
+    return QConfig(
+        activation=MinMaxObserver.with_args(reduce_range=backend in ("x86", "fbgemm")),
+        weight=default.weight,
+    )
+
+
+def prepare_int8(model, backend="x86", observer="histogram", skip=SKIP, inplace=False):
+    """返回插入了 observer 的模型；默认为副本，原模型不变"""
+    torch.backends.quantized.engine = backend
+    if not inplace:
+        model = copy.deepcopy(model)
+    model = model.float().cpu().eval()
+    qconfig = make_qconfig(backend, observer)
+    for parent, name in quantization_targets(model, skip):
+        wrapper = QuantWrapper(getattr(parent, name))
+        wrapper.qconfig = qconfig
+        setattr(parent, name, wrapper)
+    return prepare(model, inplace=True)
+
+
+def convert_int8(model):
+    convert(model, inplace=True)
+    model.int8 = True
+    return model
+
+
+def random_tiles(paths, count, size, seed=0):
+    """从图像中随机裁剪 count 个 size x size 的 uint8 tile"""
+    rng = np.random.default_rng(seed)
+    tiles = []
+    for i in range(count):
+        image = cv2.imread(paths[i % len(paths)])
+        top = rng.integers(0, image.shape[0] - size + 1)
+        left = rng.integers(0, image.shape[1] - size + 1)
+        tiles.append(image[top : top + size, left : left + size])
+    return tiles
+
+
+@torch.inference_mode()
+def calibrate(model, tiles, batch_size=2):
+    for start in range(0, len(tiles), batch_size):
+        batch = np.stack(tiles[start : start + batch_size])
+        model(torch.from_numpy(batch).permute(0, 3, 1, 2).float() / 127.5 - 1)
+
+
+def quantize(model, tiles, backend="x86", observer="histogram", skip=SKIP, batch_size=2):
+    prepared = prepare_int8(model, backend, observer, skip)
+    calibrate(prepared, tiles, batch_size)
+    return convert_int8(prepared)
+
+
+def save_quantized(model, path, backend="x86", skip=SKIP, bias=False, fused=False):
+    torch.save(
+        {
+            "format": "int8",
+            "backend": backend,
+            "skip": list(skip),
+            "bias": bias,
+            "fused": fused,
+            "state_dict": model.state_dict(),
+        },
+        path,
+    )
+
+
+def load_quantized(path):
+    """按保存时的设置重建量化结构后载入 int8 权重。
+
+    浮点结构在 meta device 上构建，再分配未初始化的存储 (不读取预训练权重、不做随机初始化)，
+    原地插入 observer 并转换，内存中只有一份浮点模型，且随着各层被替换为 int8 逐步释放。
+    """
+    from models.fusenet import convnext_plus_head
+
+    ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    with torch.device("meta"):
+        model = convnext_plus_head(bias=ckpt["bias"], pretrained=False)
+    model = model.to_empty(device="cpu").eval()
+    if ckpt.get("fused"):
+        from models.fuse import fuse_for_inference
+
+        fuse_for_inference(model)
+    # observer 未经校准，convert 只用于生成与保存时相同的模块结构，数值随后被 state_dict 覆盖
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        model = prepare_int8(model, ckpt["backend"], "minmax", tuple(ckpt["skip"]), inplace=True)
+        model = convert_int8(model)
+    model.load_state_dict(ckpt["state_dict"])
+    return model.eval()
+
+
+def report(float_model, int8_model, names, dataset_root, tile=1024, overlap=256):
+    """在验证集图像上比较 float 与 int8 的 PSNR / SSIM 和耗时"""
+    from skimage.metrics import peak_signal_noise_ratio as psnr
+    from skimage.metrics import structural_similarity as ssim
+
+    from tiling import ArraySink, Tiler, predict_image
+
+    tiler = Tiler(tile, overlap, 1, "cpu")
+    rows = {"float": [], "int8": []}
+    for name in names:
+        image = cv2.imread(os.path.join(dataset_root, "train", "input", name))
+        gt = cv2.imread(os.path.join(dataset_root, "train", "gt", name))
+        for key, model in (("float", float_model), ("int8", int8_model)):
+            start = time.perf_counter()
+            sink = predict_image(model, image, tiler, ArraySink(*image.shape[:2], np.uint8))
+            seconds = time.perf_counter() - start
+            rows[key].append(
+                (psnr(gt, sink.array, data_range=255), ssim(gt, sink.array, data_range=255, channel_axis=2), seconds)
+            )
+    f, q = (np.mean(rows[k], axis=0) for k in ("float", "int8"))
+    print(f"{'':<8}{'PSNR':>8}{'SSIM':>8}{'s/img':>8}")
+    print(f"{'float':<8}{f[0]:>8.3f}{f[1]:>8.4f}{f[2]:>8.2f}")
+    print(f"{'int8':<8}{q[0]:>8.3f}{q[1]:>8.4f}{q[2]:>8.2f}")
+    print(f"delta PSNR {q[0] - f[0]:+.3f} dB, SSIM {q[1] - f[1]:+.4f}, speedup {f[2] / q[2]:.2f}x")
+
+
+if __name__ == "__main__":
+    from checkpoint import load_inference_model
+    from dataset import split_image_list
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ckpt", type=str, help="checkpoint, slim checkpoint directory or .safetensors")
+    parser.add_argument("out", type=str, help="output .int8.pt")
+    parser.add_argument("--dataset_root", type=str, default="./dehaze_data_1/")
+    parser.add_argument("--valid_image_rate", type=float, default=0.12)
+    parser.add_argument("--calib_tiles", type=int, default=16)
+    parser.add_argument("--calib_size", type=int, default=512)
+    parser.add_argument("--observer", type=str, default="histogram", choices=["histogram", "minmax"])
+    parser.add_argument("--backend", type=str, default="x86", choices=["x86", "fbgemm", "qnnpack"])
+    parser.add_argument("--report", type=int, default=0, help="number of validation images for the report")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # 先做等价的结构折叠，量化的层更少、更大
+    model = load_inference_model(args.ckpt, fuse=True)
+    bias = model.convnext_branch.attention0.conv1.bias is not None
+    train_names, valid_names = split_image_list(args.dataset_root, args.valid_image_rate)
+    paths = [os.path.join(args.dataset_root, "train", "input", n) for n in sorted(train_names)]
+    tiles = random_tiles(paths, args.calib_tiles, args.calib_size)
+
+    int8_model = quantize(model, tiles, args.backend, args.observer)
+    save_quantized(int8_model, args.out, args.backend, bias=bias, fused=True)
+    print(f"Saved {len(quantization_targets(model))} quantized layers to {args.out}")
+    if args.report:
+        report(model, int8_model, sorted(valid_names)[: args.report], args.dataset_root)
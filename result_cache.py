@@ -0,0 +1,145 @@
+"""Content-addressed cache of per-image results on local disk.
+
+The key is the hash of the input file bytes, the model weights and the inference settings
+(tiling, TTA, blend, backend, ...). An unchanged image therefore hits the cache under the same
+model and settings, and any change to one of them misses. Every entry stores the output array
+unchanged as .npy (float32 for tiled inference), so metrics on a hit match those of a fresh run,
+plus a JSON metadata file for metrics and similar values. A float32 entry takes 12 bytes per
+pixel (about 290 MB for 6000x4000), so set max_bytes accordingly.
+Entries are written atomically. When the total size exceeds max_bytes, the least recently
+used entries are evicted. The access time is kept in the file mtime, so several processes
+can share one cache directory.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+
+def file_digest(path, chunk=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _update(digest, value):
+    if torch.is_tensor(value):
+        if value.is_quantized:
+            digest.update(f"{value.qscheme()}".encode())
+            value = value.dequantize()
+        value = value.detach().contiguous().cpu()
+        digest.update(f"{tuple(value.shape)}:{value.dtype};".encode())
+        digest.update(value.reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _update(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+def model_digest(model, skip=()):
+    """state_dict 中所有权重的 sha256 (包含名称、形状和 dtype)，与设备无关；名称含 skip 中子串的项不参与"""
+    digest = hashlib.sha256()
+    for name, value in model.state_dict().items():
+        if any(s in name for s in skip):
+            continue
+        digest.update(f"{name};".encode())
+        _update(digest, value)
+    return digest.hexdigest()
+
+
+def settings_digest(settings):
+    """推理设置 (可 JSON 序列化的 dict) 的 sha256，键的顺序无关"""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def cache_key(input_digest, model_id, settings_id):
+    return hashlib.sha256(f"{input_digest}|{model_id}|{settings_id}".encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root, max_bytes=20 * 2**30):
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _paths(self, key):
+        directory = os.path.join(self.root, key[:2])
+        return os.path.join(directory, f"{key}.npy"), os.path.join(directory, f"{key}.json")
+
+    def get(self, key):
+        """命中时返回 (输出, metadata) 并刷新访问时间，否则返回 None；输出的 dtype 与 put 时相同"""
+        image_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            output = np.load(image_path)
+        except (OSError, ValueError, EOFError):
+            output = None
+        if output is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        for path in (image_path, meta_path):
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        self.hits += 1
+        return output, meta
+
+    def put(self, key, output, meta=None):
+        image_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        # 先写输出再写 metadata，get 只在两者都存在时命中；临时文件名带 pid，多进程写同一个 key 也安全
+        tmp = f"{image_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(output))
+        os.replace(tmp, image_path)
+        tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta or {}, f)
+        os.replace(tmp, meta_path)
+        self.evict()
+
+    def entries(self):
+        """key -> (最近访问时间, 字节数)"""
+        entries = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if ".tmp" in name:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                key = name.split(".")[0]
+                atime, size = entries.get(key, (0.0, 0))
+                entries[key] = (max(atime, stat.st_mtime), size + stat.st_size)
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return f"result cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
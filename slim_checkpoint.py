@@ -0,0 +1,134 @@
+"""Lightning 训练用的异步精简 checkpoint；读取见 checkpoint.py (不依赖 Lightning)。"""
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import lightning.pytorch as pl
+
+
+class AsyncSlimCheckpoint(pl.Callback):
+    """按监控指标保存 top-k 的精简 checkpoint，写盘在后台线程完成。
+
+    每个 checkpoint 是一个目录，包含可单独加载的 generator.pt / ema.pt / discriminator.pt，
+    由 checkpoint.generator_state_dict / load_part 读取，用于推理和 --init_ckpt，不含优化器状态。
+    冻结的 lpips 不保存；LoRA 模式下生成器只保存 adapter，lora.pt 记录 rank / alpha 和基础权重。
+    训练只在把张量拷贝到 (复用的) pinned 内存时停顿，之后由后台线程序列化并原子地 rename 到目标文件。
+
+    Args:
+        shard: 每个 rank 写 generator / ema / discriminator 中 1/world_size 的张量，并行写盘
+    """
+
+    def __init__(
+        self,
+        dirpath,
+        monitor="valid_psnr",
+        mode="max",
+        save_top_k=2,
+        shard=False,
+    ):
+        super().__init__()
+        self.dirpath = dirpath
+        self.monitor = monitor
+        self.mode = mode
+        self.save_top_k = save_top_k
+        self.shard = shard
+        self.best = []  # [(score, path)]，从好到差
+        self._buffers = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def _better(self, a, b):
+        return a > b if self.mode == "max" else a < b
+
+    def _snapshot(self, obj, key):
+        # 拷贝到复用的 pinned buffer；调用前必须保证上一次写盘已经完成
+        if torch.is_tensor(obj):
+            buf = self._buffers.get(key)
+            if buf is None or buf.shape != obj.shape or buf.dtype != obj.dtype:
+                buf = torch.empty(
+                    obj.shape, dtype=obj.dtype, device="cpu", pin_memory=obj.is_cuda
+                )
+                self._buffers[key] = buf
+            return buf.copy_(obj.detach(), non_blocking=True)
+        if isinstance(obj, dict):
+            return {k: self._snapshot(v, f"{key}/{k}") for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(v, f"{key}/{i}") for i, v in enumerate(obj))
+        return obj
+
+    def _parts(self, trainer, pl_module):
+        generator = pl_module.model.state_dict()
+        if pl_module.opt.lora_rank > 0:
+            generator = {k: v for k, v in generator.items() if "lora_" in k}
+        parts = {"generator": generator, "discriminator": pl_module.DNet.state_dict()}
+        if pl_module.ema is not None:
+            parts["ema"] = dict(pl_module.ema.shadow)
+
+        if self.shard and trainer.world_size > 1:
+            rank, world = trainer.global_rank, trainer.world_size
+            parts = {
+                f"{name}.rank{rank:03d}-of-{world:03d}": {
+                    k: v for i, (k, v) in enumerate(state.items()) if i % world == rank
+                }
+                for name, state in parts.items()
+            }
+        elif trainer.global_rank != 0:
+            parts = {}
+
+        if pl_module.opt.lora_rank > 0 and trainer.global_rank == 0:
+            opt = pl_module.opt
+            parts["lora"] = {"rank": opt.lora_rank, "alpha": opt.lora_alpha, "base": opt.init_ckpt}
+        return parts
+
+    def _write(self, dirpath, parts, remove):
+        if parts:
+            os.makedirs(dirpath, exist_ok=True)
+        for name, state in parts.items():
+            path = os.path.join(dirpath, f"{name}.pt")
+            torch.save(state, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        if remove is not None:
+            shutil.rmtree(remove, ignore_errors=True)
+
+    def wait(self):
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def on_validation_end(self, trainer, pl_module):
+        if trainer.sanity_checking or self.monitor not in trainer.callback_metrics:
+            return
+        # 各 rank 的验证指标可能不同，以 rank 0 的结果决定是否保存
+        score = trainer.strategy.broadcast(
+            float(trainer.callback_metrics[self.monitor]), src=0
+        )
+        if len(self.best) >= self.save_top_k and not self._better(score, self.best[-1][0]):
+            return
+
+        dirpath = os.path.join(
+            self.dirpath, f"epoch={trainer.current_epoch}-{self.monitor}={score:.4f}"
+        )
+        self.best.append((score, dirpath))
+        self.best.sort(key=lambda item: item[0], reverse=self.mode == "max")
+        remove = None
+        if len(self.best) > self.save_top_k:
+            remove = self.best.pop()[1]
+
+        self.wait()
+        if remove is not None and trainer.world_size > 1:
+            # 删除由 rank 0 负责，要等所有 rank 的上一次 (可能正是要删除的目录的) 分片写完
+            trainer.strategy.barrier("slim_checkpoint_rotate")
+        if trainer.global_rank != 0:
+            remove = None
+        snapshot = self._snapshot(self._parts(trainer, pl_module), "")
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self._pending = self._executor.submit(self._write, dirpath, snapshot, remove)
+
+    def on_train_end(self, trainer, pl_module):
+        self.wait()
+
+    def on_exception(self, trainer, pl_module, exception):
+        self.wait()
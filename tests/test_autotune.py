@@ -0,0 +1,54 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from autotune import autotune, measure, plan_key
+
+
+class Tiny(nn.Module):
+    def __init__(self, max_batch=None):
+        super().__init__()
+        self.conv = nn.Conv2d(3, 3, 3, padding=1)
+        self.max_batch = max_batch
+
+    def forward(self, x):
+        if self.max_batch is not None and len(x) > self.max_batch:
+            raise RuntimeError("CUDA error: out of memory")
+        return torch.tanh(self.conv(x))
+
+
+def test_plan_key_depends_on_weights():
+    a, b = Tiny(), Tiny()
+    key = plan_key(a, "cpu", 64, 64)
+    assert key == plan_key(a, "cpu", 64, 64)
+    assert key != plan_key(b, "cpu", 64, 64)
+
+
+def test_cpu_peak_is_measured():
+    seconds, peak = measure(Tiny(), "cpu", 32, 2)
+    assert seconds > 0
+    assert peak is None or peak > 0
+
+
+def test_runtime_oom_stops_larger_batches():
+    plan = autotune(Tiny(max_batch=2), "cpu", 64, 64, tile_sizes=(32,), batch_sizes=(1, 2, 4), verbose=False)
+    assert plan["batch_size"] in (1, 2)
+
+
+def test_other_runtime_errors_propagate():
+    class Broken(Tiny):
+        def forward(self, x):
+            raise RuntimeError("shape mismatch")
+
+    with pytest.raises(RuntimeError, match="shape mismatch"):
+        measure(Broken(), "cpu", 32, 1)
+
+
+def test_budget_applies_on_cpu():
+    _, peak = measure(Tiny(), "cpu", 32, 1)
+    if peak is None:
+        with pytest.raises(ValueError, match="memory_budget"):
+            autotune(Tiny(), "cpu", 64, 64, memory_budget=2**30, tile_sizes=(32,), batch_sizes=(1,), verbose=False)
+    else:
+        with pytest.raises(RuntimeError, match="no tile"):
+            autotune(Tiny(), "cpu", 64, 64, memory_budget=1, tile_sizes=(32,), batch_sizes=(1,), verbose=False)
@@ -0,0 +1,67 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from models.fuse import fuse_for_inference
+from models.fusenet import Block, ConvLayer, ConvNeXt, convnext_plus_head
+
+
+def randomize(model, seed=0):
+    """随机化所有参数和 BN 统计量，避免 gamma = 1e-6、LayerNorm = 恒等这类初始值掩盖折叠错误"""
+    generator = torch.Generator().manual_seed(seed)
+    with torch.no_grad():
+        for name, tensor in model.state_dict().items():
+            if name.endswith("running_var"):
+                tensor.copy_(torch.rand(tensor.shape, generator=generator) + 0.5)
+            elif tensor.is_floating_point():
+                tensor.copy_(torch.randn(tensor.shape, generator=generator) * 0.2)
+    return model.double().eval()
+
+
+def assert_fused_equal(model, x, expected_counts):
+    with torch.no_grad():
+        expected = model(x)
+        model, counts = fuse_for_inference(model)
+        actual = model(x)
+    for key, value in expected_counts.items():
+        assert counts[key] == value, (key, counts)
+    torch.testing.assert_close(actual, expected, rtol=0, atol=1e-10)
+    return model
+
+
+def test_conv_layer_bn():
+    model = randomize(ConvLayer(4, 6, 3, bias=True))
+    model = assert_fused_equal(model, torch.randn(2, 4, 9, 9, dtype=torch.float64), {"bn": 1})
+    assert model.norm is None
+
+
+def test_block_layer_scale_and_norm_affine():
+    model = randomize(Block(8))
+    model = assert_fused_equal(
+        model, torch.randn(2, 8, 9, 9, dtype=torch.float64), {"layer_scale": 1, "norm_affine": 1}
+    )
+    assert model.gamma is None and model.norm.weight is None
+
+
+def test_encoder_downsample_norm_affine():
+    model = randomize(ConvNeXt(Block, depths=[1, 1, 2], dims=[8, 16, 32]))
+    x = torch.randn(1, 3, 32, 32, dtype=torch.float64)
+    with torch.no_grad():
+        expected = model(x)
+        model, counts = fuse_for_inference(model)
+        actual = model(x)
+    # 4 个 Block 的 pwconv1 加 2 个下采样层 (stem 的 LayerNorm 在卷积之后，不折叠)
+    assert counts["norm_affine"] == 6 and counts["layer_scale"] == 4
+    for a, e in zip(actual, expected):
+        torch.testing.assert_close(a, e, rtol=0, atol=1e-10)
+
+
+def test_generator():
+    model = randomize(convnext_plus_head(bias=True, pretrained=False))
+    model = assert_fused_equal(model, torch.rand(1, 3, 64, 64, dtype=torch.float64) * 2 - 1, {"layer_scale": 33})
+    assert not any(isinstance(m, Block) and m.gamma is not None for m in model.modules())
+
+
+def test_requires_eval():
+    with pytest.raises(RuntimeError, match="eval"):
+        fuse_for_inference(Block(8))
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from backend import GraphBackend, make_backend
+from graph_export import export_onnx, export_program
+from tiling import ArraySink, predict_image
+
+
+def tiny_model():
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Conv2d(3, 8, 3, padding=1), nn.GELU(), nn.Conv2d(8, 3, 3, padding=1), nn.Tanh()).eval()
+
+
+@pytest.fixture
+def threads():
+    before = torch.get_num_threads()
+    yield
+    torch.set_num_threads(before)
+
+
+@pytest.mark.parametrize("suffix", [".onnx", ".pt2"])
+def test_graph_backend_matches_eager(tmp_path, suffix, threads):
+    if suffix == ".onnx":
+        pytest.importorskip("onnxruntime")
+    model = tiny_model()
+    path = os.path.join(tmp_path, f"model{suffix}")
+    (export_onnx if suffix == ".onnx" else export_program)(model, path, tile=32, batch=2, tta="hflip")
+
+    backend = make_backend({"name": "graph", "path": path, "threads": 1, "overlap": 8})
+    assert isinstance(backend, GraphBackend)
+    assert torch.get_num_threads() == 1
+    assert (backend.tile_size, backend.batch_size) == (32, 2)
+
+    image = np.random.default_rng(0).integers(0, 256, (64, 72, 3), dtype=np.uint8)
+    # 9 个 tile：最后一批不足图的 batch，需要补齐
+    tiler = backend.tiler()
+    actual = predict_image(backend.prepare(), image, tiler, ArraySink(64, 72)).array
+    expected = predict_image(model, image, tiler, ArraySink(64, 72), "hflip").array
+    # uint8 截断前的浮点误差可能让个别像素差 1
+    assert np.abs(actual - expected).max() <= 1
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+from checkpoint import generator_state_dict
+from models.fuse import fuse_for_inference
+from models.fusenet import Block, CP_Attention_block, default_conv
+from models.lora import LORA_MODULES, apply_lora, lora_state_dict, merge_lora_state_dict
+
+
+def tiny_model():
+    torch.manual_seed(0)
+    model = nn.Sequential(Block(8, layer_scale_init_value=0.5), CP_Attention_block(default_conv, 8, 3, True))
+    return model.double().eval()
+
+
+def with_adapter(model, rank=2, alpha=4.0):
+    apply_lora(model, rank, alpha)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, LORA_MODULES):
+                module.lora_B.normal_()
+    return model
+
+
+def test_merge_state_dict_matches_adapter():
+    base = tiny_model()
+    base_sd = {k: v.clone() for k, v in base.state_dict().items()}
+    model = with_adapter(base)
+    x = torch.randn(2, 8, 12, 12, dtype=torch.float64)
+    expected = model(x)
+
+    plain = tiny_model()
+    plain.load_state_dict(merge_lora_state_dict(base_sd, lora_state_dict(model), 2, 4.0))
+    torch.testing.assert_close(plain(x), expected)
+
+
+def test_fuse_unwraps_merged_lora():
+    model = with_adapter(tiny_model())
+    x = torch.randn(2, 8, 12, 12, dtype=torch.float64)
+    expected = model(x)
+    model, counts = fuse_for_inference(model)
+    assert counts["lora"] > 0
+    assert not any(isinstance(m, LORA_MODULES) for m in model.modules())
+    assert counts["layer_scale"] == 1 and counts["norm_affine"] == 1
+    torch.testing.assert_close(model(x), expected)
+
+
+def test_generator_state_dict_merges_lora_checkpoint(tmp_path):
+    base = tiny_model()
+    base_sd = {k: v.clone() for k, v in base.state_dict().items()}
+    base_path = os.path.join(tmp_path, "base.ckpt")
+    torch.save({"state_dict": {f"model.{k}": v for k, v in base_sd.items()}}, base_path)
+
+    model = with_adapter(base)
+    adapter = {f"model.{k}": v for k, v in lora_state_dict(model).items()}
+    lora_path = os.path.join(tmp_path, "lora.ckpt")
+    torch.save({"state_dict": adapter, "lora": {"rank": 2, "alpha": 4.0, "base": base_path}}, lora_path)
+
+    x = torch.randn(1, 8, 12, 12, dtype=torch.float64)
+    plain = tiny_model()
+    plain.load_state_dict(generator_state_dict(lora_path))
+    torch.testing.assert_close(plain(x), model(x))
+
+    torch.save({"state_dict": adapter, "lora": {"rank": 2, "alpha": 4.0, "base": None}}, lora_path)
+    with pytest.raises(ValueError, match="LoRA adapter"):
+        generator_state_dict(lora_path)
@@ -0,0 +1,63 @@
+import pytest
+import torch
+
+from benchmarks.msssim import reference_msssim, reference_ssim
+from pytorch_msssim import MSSSIM, SSIM, create_window, msssim, ssim
+
+
+# 两种实现的 gaussian 权重都先取 float32 再转 float64，分离与二维窗口的舍入不同
+ATOL = 1e-7
+CASES = [
+    # shape, val_range, size_average
+    ((2, 3, 64, 64), 2, True),
+    ((2, 3, 64, 64), None, True),
+    ((1, 3, 48, 40), None, False),
+    ((3, 1, 32, 32), 1, True),
+]
+
+
+def pair(shape, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    y = torch.rand(shape, generator=generator, dtype=torch.float64) * 2 - 1
+    x = (y + 0.1 * torch.randn(shape, generator=generator, dtype=torch.float64)).clamp(-1, 1)
+    return x, y
+
+
+@pytest.mark.parametrize("shape, val_range, size_average", CASES)
+def test_ssim_matches_dense_reference(shape, val_range, size_average):
+    x, y = pair(shape)
+    s, cs = ssim(x, y, size_average=size_average, full=True, val_range=val_range)
+    s_ref, cs_ref = reference_ssim(x, y, size_average=size_average, full=True, val_range=val_range)
+    torch.testing.assert_close(s, s_ref, atol=ATOL, rtol=0)
+    torch.testing.assert_close(cs, cs_ref, atol=ATOL, rtol=0)
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_msssim_value_and_gradient_match_reference(normalize):
+    x, y = pair((2, 3, 96, 96), seed=1)
+    x_new = x.clone().requires_grad_(True)
+    x_ref = x.clone().requires_grad_(True)
+    m = msssim(x_new, y, val_range=2, normalize=normalize)
+    m_ref = reference_msssim(x_ref, y, val_range=2, normalize=normalize)
+    torch.testing.assert_close(m, m_ref, atol=ATOL, rtol=0)
+    m.backward()
+    m_ref.backward()
+    torch.testing.assert_close(x_new.grad, x_ref.grad, atol=ATOL, rtol=1e-6)
+
+
+def test_identical_images_score_one():
+    x, _ = pair((1, 3, 64, 64))
+    torch.testing.assert_close(ssim(x, x, val_range=2), torch.tensor(1.0, dtype=x.dtype))
+    torch.testing.assert_close(msssim(x, x, val_range=2), torch.tensor(1.0, dtype=x.dtype))
+
+
+def test_modules_match_functions():
+    x, y = pair((2, 3, 64, 64))
+    torch.testing.assert_close(SSIM(val_range=2)(x, y), ssim(x, y, val_range=2))
+    torch.testing.assert_close(MSSSIM(val_range=2)(x, y), msssim(x, y, val_range=2))
+
+
+def test_custom_window_warns():
+    x, y = pair((1, 3, 32, 32))
+    with pytest.warns(DeprecationWarning):
+        ssim(x, y, window=create_window(11, 3), val_range=2)
@@ -0,0 +1,66 @@
+import pytest
+import torch
+
+from benchmarks.pixel_loss import WEIGHTS, separate_losses
+from utils import CharbonnierLoss, FusedPixelLoss, SmoothFocalL1Loss, SqrtLoss
+
+
+def pair(shape=(2, 3, 24, 24), seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    y = torch.rand(shape, generator=generator, dtype=torch.float64) * 2 - 1
+    # 包含 |d| > threshold 的元素和 d == 0 的元素
+    x = y + 1.5 * torch.randn(shape, generator=generator, dtype=torch.float64)
+    x[0, 0, 0] = y[0, 0, 0]
+    return x, y
+
+
+def value_and_grad(loss_fn, x, y):
+    x = x.clone().requires_grad_(True)
+    y = y.clone().requires_grad_(True)
+    loss = loss_fn(x, y)
+    loss.backward()
+    return loss.detach(), x.grad, y.grad
+
+
+@pytest.mark.parametrize(
+    "term, reference",
+    [
+        ("l1", torch.nn.L1Loss()),
+        ("charbonnier", CharbonnierLoss()),
+        ("focal", SmoothFocalL1Loss()),
+        ("sqrt", SqrtLoss()),
+    ],
+)
+def test_single_term_matches_separate_loss(term, reference):
+    x, y = pair()
+    weights = {"l1": 0.0, "charbonnier": 0.0, "focal": 0.0, "sqrt": 0.0, term: 1.0}
+    fused = value_and_grad(FusedPixelLoss(**weights), x, y)
+    expected = value_and_grad(reference, x, y)
+    for actual, wanted in zip(fused, expected):
+        torch.testing.assert_close(actual, wanted, atol=1e-12, rtol=1e-9)
+
+
+def test_weighted_mix_matches_sum_of_losses():
+    x, y = pair(seed=1)
+    fused = value_and_grad(FusedPixelLoss(**WEIGHTS), x, y)
+    expected = value_and_grad(separate_losses(), x, y)
+    for actual, wanted in zip(fused, expected):
+        torch.testing.assert_close(actual, wanted, atol=1e-12, rtol=1e-9)
+
+
+@pytest.mark.parametrize("reduction", ["mean", "sum"])
+def test_hand_written_backward_matches_elementwise_autograd(reduction):
+    # elementwise 是 compile=True 时交给 torch.compile 的纯 PyTorch 形式
+    x, y = pair(seed=2)
+    loss = FusedPixelLoss(**WEIGHTS, reduction=reduction)
+    fused = value_and_grad(loss, x, y)
+    expected = value_and_grad(loss.elementwise, x, y)
+    for actual, wanted in zip(fused, expected):
+        torch.testing.assert_close(actual, wanted, atol=1e-12, rtol=1e-9)
+
+
+def test_gradcheck():
+    x, y = pair((1, 1, 4, 4), seed=3)
+    x = x.requires_grad_(True)
+    loss = FusedPixelLoss(**WEIGHTS)
+    assert torch.autograd.gradcheck(lambda a: loss(a, y), (x,))
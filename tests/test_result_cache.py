@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+
+from result_cache import ResultCache
+
+
+def test_float_output_round_trips_exactly(tmp_path):
+    cache = ResultCache(os.path.join(tmp_path, "cache"))
+    output = np.random.default_rng(0).uniform(0, 255, (5, 7, 3)).astype(np.float32)
+    assert cache.get("ab" * 32) is None
+    cache.put("ab" * 32, output, {"psnr": 30.5})
+    cached, meta = cache.get("ab" * 32)
+    assert cached.dtype == np.float32
+    np.testing.assert_array_equal(cached, output)
+    assert meta == {"psnr": 30.5}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    output = np.zeros((16, 16, 3), np.float32)
+    cache = ResultCache(os.path.join(tmp_path, "cache"), max_bytes=1 << 40)
+    keys = [f"{i:02d}" * 32 for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, output)
+        for path in cache._paths(key):
+            os.utime(path, (i, i))
+    entry = sum(size for _, size in cache.entries().values()) // 3
+    cache.get(keys[0])  # 刷新访问时间，keys[1] 变为最久未用
+    cache.max_bytes = 2 * entry
+    cache.evict()
+    assert set(cache.entries()) == {keys[0], keys[2]}
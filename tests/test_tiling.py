@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from benchmarks.seam_error import crop_tile_per_patch, padded_tiles
+from tiling import crop_tile, tile_coords
+
+
+@pytest.mark.parametrize("height, width", [(40, 56), (37, 50), (64, 64)])
+def test_reflection_matches_per_patch_padding_unless_padding_exceeds_crop(height, width):
+    size, overlap = 32, 8
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    for x, y in tile_coords(height, width, size, overlap):
+        same = not padded_tiles(height, width, [(x, y)], size)
+        tile = crop_tile(image, x, y, size)
+        assert tile.shape == (size, size, 3)
+        np.testing.assert_array_equal(tile[: height - x, : width - y], image[x : x + size, y : y + size])
+        if same:
+            np.testing.assert_array_equal(tile, crop_tile_per_patch(image, x, y, size))
+
+
+def test_long_padding_reflects_into_the_image():
+    # 4000 列、2048 tile、512 重叠：最后一列 tile 只有 928 列在图像内，需要 1120 列填充
+    width, size = 4000, 2048
+    image = np.tile(np.arange(width, dtype=np.uint16)[None, :, None], (1, 1, 3))
+    coords = [c for c in tile_coords(1, width, size, 512) if c[1] == 3072]
+    assert padded_tiles(1, width, coords, size) == 1
+    tile = crop_tile(image, 0, 3072, size)[0, :, 0]
+    old = crop_tile_per_patch(image, 0, 3072, size)[0, :, 0]
+    # 整图反射取到裁剪起点之前的真实列，旧方式在裁剪内来回反射
+    assert tile[-1] == 3072 - (1120 - 928) and old[-1] != tile[-1]
+    assert tile.min() < 3072 <= old.min()
@@ -0,0 +1,74 @@
+import pytest
+import torch
+
+from tta import POLICIES, TRANSFORMS, forward_transform, inverse_transform, resolve, tta_forward
+
+
+def image(shape=(2, 3, 6, 6)):
+    return torch.arange(torch.Size(shape).numel(), dtype=torch.float32).reshape(shape)
+
+
+class Positional(torch.nn.Module):
+    """与位置有关的非等变模型：输出依赖像素坐标，变换错位会改变结果"""
+
+    def forward(self, x):
+        h, w = x.shape[-2:]
+        ramp = torch.arange(h * w, dtype=x.dtype).reshape(h, w)
+        return x * 2 + ramp
+
+
+@pytest.mark.parametrize("name", list(TRANSFORMS))
+def test_inverse_undoes_forward(name):
+    x = image()
+    torch.testing.assert_close(inverse_transform(forward_transform(x, name), name), x, rtol=0, atol=0)
+    torch.testing.assert_close(forward_transform(inverse_transform(x, name), name), x, rtol=0, atol=0)
+
+
+def test_transforms_are_the_eight_symmetries():
+    x = image((1, 1, 4, 4))
+    expected = {
+        "identity": x,
+        "hflip": x.flip(3),
+        "vflip": x.flip(2),
+        "rot180": x.flip(2).flip(3),
+        "transpose": x.transpose(2, 3),
+        "transverse": x.flip(2).flip(3).transpose(2, 3),
+    }
+    outputs = {name: forward_transform(x, name) for name in TRANSFORMS}
+    assert len({tuple(o.flatten().tolist()) for o in outputs.values()}) == 8
+    for name, value in expected.items():
+        torch.testing.assert_close(outputs[name], value, rtol=0, atol=0)
+
+
+def test_true_is_the_original_hflip_average():
+    model = Positional()
+    x = image()
+    expected = (model(x) + torch.flip(model(torch.flip(x, [3])), [3])) / 2
+    assert resolve(True) == POLICIES["hflip"]
+    torch.testing.assert_close(tta_forward(model, x, True), expected)
+
+
+@pytest.mark.parametrize("policy", list(POLICIES))
+def test_policy_is_the_mean_of_inverted_outputs(policy):
+    model = Positional()
+    x = image()
+    names = resolve(policy)
+    expected = sum(inverse_transform(model(forward_transform(x, n)), n) for n in names) / len(names)
+    torch.testing.assert_close(tta_forward(model, x, policy), expected)
+    torch.testing.assert_close(tta_forward(model, x, policy, max_batch=3), expected)
+
+
+@pytest.mark.parametrize("policy", list(POLICIES))
+def test_equivariant_model_is_unchanged(policy):
+    model = torch.nn.Tanh()
+    x = image() / 100
+    torch.testing.assert_close(tta_forward(model, x, policy), model(x))
+
+
+def test_rotations_need_square_tiles():
+    x = image((1, 3, 4, 6))
+    assert tta_forward(Positional(), x, "flips").shape == x.shape
+    with pytest.raises(ValueError, match="square"):
+        tta_forward(Positional(), x, "rot")
+    with pytest.raises(ValueError, match="unknown"):
+        resolve(["identity", "shear"])
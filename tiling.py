@@ -0,0 +1,263 @@
+"""Batched tiled inference for images larger than the training crops.
+
+Tiles are taken as views of the input image (edge tiles gather reflected rows/columns, so the
+image is never padded or copied as a whole and may be a memmap). They are packed into a reusable
+pinned uint8 buffer, moved to the device with one copy per micro-batch and run through the model
+in a single call. StreamingReconstructor blends the predicted tiles back in raster order and
+hands finished row bands to a sink, so peak memory depends on the tile size and image width
+rather than on the image area.
+
+Edge tiles are reflected about the image border, not about the edge of their own crop as the
+old per-patch copyMakeBorder did. The two agree while the padding is no longer than the part of
+the tile inside the image. Beyond that, the old path bounced back off the crop's far edge and
+repeated the crop, while the tiler keeps reflecting into the real image before the crop. An
+example is the last 928-px column of a 4000-px image with 2048 tiles and 512 overlap, which has
+1120 px of padding. benchmarks/seam_error.py reports both against whole-image inference.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import torch
+
+from tta import resolve, tta_forward
+
+
+BLEND_MODES = ("mean", "linear", "cosine", "gaussian")
+
+
+def tile_coords(height, width, size, overlap):
+    """光栅顺序的 tile 左上角坐标 (行, 列)"""
+    stride = size - overlap
+    return [(x, y) for x in range(0, height, stride) for y in range(0, width, stride)]
+
+
+@lru_cache(maxsize=None)
+def blend_window(size, overlap, mode="mean"):
+    """size x size 的 float32 融合权重，重叠区域按权重加权平均。
+
+    mean 为全 1 (等同于计数平均)；linear / cosine 只在距边缘 overlap 以内渐变，相邻 tile 的权重和为 1；
+    gaussian 以 tile 中心为峰值，sigma = size / 8。返回的数组只读，各处共享。
+    """
+    if mode not in BLEND_MODES:
+        raise ValueError(f"unknown blend mode {mode!r}, expected one of {BLEND_MODES}")
+    index = np.arange(size, dtype=np.float64)
+    if mode == "mean" or (overlap == 0 and mode != "gaussian"):
+        weight = np.ones(size)
+    elif mode == "gaussian":
+        sigma = size / 8
+        weight = np.exp(-0.5 * ((index - (size - 1) / 2) / sigma) ** 2)
+    else:
+        ramp = np.clip((np.minimum(index, size - 1 - index) + 0.5) / overlap, 0, 1)
+        weight = ramp if mode == "linear" else 0.5 - 0.5 * np.cos(np.pi * ramp)
+    # 保证权重为正，只被一个 tile 覆盖的图像边缘也能归一化
+    weight = np.maximum(weight, 1e-3)
+    window = np.outer(weight, weight).astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+@lru_cache(maxsize=None)
+def blend_window_tensor(size, overlap, mode, device):
+    return torch.from_numpy(blend_window(size, overlap, mode).copy()).to(device)
+
+
+def reflect_index(start, size, length):
+    """[start, start + size) 越界部分按 cv2.BORDER_REFLECT (重复边缘像素) 映射回 [0, length)"""
+    index = np.arange(start, start + size) % (2 * length)
+    return np.where(index < length, index, 2 * length - 1 - index)
+
+
+def crop_tile(image, x, y, size):
+    """以 (x, y) 为左上角的 size x size tile，越界部分按整图 (而不是 tile 自身的裁剪) 反射"""
+    h, w = image.shape[:2]
+    if 0 <= x and x + size <= h and 0 <= y and y + size <= w:
+        return image[x : x + size, y : y + size]
+    return image[np.ix_(reflect_index(x, size, h), reflect_index(y, size, w))]
+
+
+class Tiler:
+    """把 HxWx3 uint8 图像切成 size x size 的 tile，按 batch_size 个一组送到 device。
+
+    两个 pinned buffer 交替使用：填充下一批时，上一批的拷贝可以还在进行。
+    """
+
+    def __init__(self, size=2048, overlap=512, batch_size=4, device="cuda"):
+        if not 0 <= overlap < size:
+            raise ValueError(f"overlap must be in [0, {size}), got {overlap}")
+        self.size = size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self._buffers = None
+        self._events = None
+
+    def _buffer(self, index):
+        if self._buffers is None:
+            pin = self.device.type == "cuda"
+            shape = (self.batch_size, self.size, self.size, 3)
+            self._buffers = [
+                torch.empty(shape, dtype=torch.uint8, pin_memory=pin)
+                for _ in range(2 if pin else 1)
+            ]
+            self._events = [None] * len(self._buffers)
+        index %= len(self._buffers)
+        if self._events[index] is not None:
+            # 等待这个 buffer 上一次的 H2D 拷贝完成后再覆盖
+            self._events[index].synchronize()
+        return index, self._buffers[index]
+
+    def coords(self, height, width):
+        return tile_coords(height, width, self.size, self.overlap)
+
+    def batches(self, image, coords=None):
+        """产出 (coords, tiles)：tiles 为 device 上的 N x 3 x size x size uint8 张量。
+
+        coords 默认为 self.coords()；可以传入任意左上角坐标 (允许为负或越界，按反射取值)。
+        """
+        if coords is None:
+            coords = self.coords(*image.shape[:2])
+        for step, start in enumerate(range(0, len(coords), self.batch_size)):
+            batch = coords[start : start + self.batch_size]
+            index, buffer = self._buffer(step)
+            host = buffer.numpy()
+            for i, (x, y) in enumerate(batch):
+                host[i] = crop_tile(image, x, y, self.size)
+            tiles = buffer[: len(batch)].to(self.device, non_blocking=True)
+            if self.device.type == "cuda":
+                self._events[index] = torch.cuda.current_stream(self.device).record_event()
+            yield batch, tiles.permute(0, 3, 1, 2)
+
+
+@torch.inference_mode()
+def predict_tiles(model, image, tiler, tta=False, coords=None):
+    """逐个 micro-batch 推理，产出 (coords, outputs)：outputs 为 device 上的 N x size x size x 3 uint8。
+
+    tta 见 tta.resolve：False / True (水平翻转) / 策略名 / 变换名列表，所有变换在一次前向中完成。
+    """
+    # 没有参数的模型 (如 onnxruntime 封装) 按 float32 输入
+    dtype = next(model.parameters(), torch.empty(0)).dtype
+    transforms = resolve(tta)
+    for coords, tiles in tiler.batches(image, coords):
+        x = tiles.to(dtype) / 127.5 - 1
+        output = tta_forward(model, x, transforms)
+        # 与原来的 .type(torch.uint16) 一样截断而不是四舍五入
+        output = ((output + 1) * 127.5).clamp(0, 255).to(torch.uint8)
+        yield coords, output.permute(0, 2, 3, 1)
+
+
+class ArraySink:
+    """把完成的行带写入内存中的数组"""
+
+    def __init__(self, height, width, dtype=np.float32):
+        self.array = np.empty((height, width, 3), dtype=dtype)
+
+    def write(self, top, band):
+        if np.issubdtype(self.array.dtype, np.integer):
+            band = np.clip(np.rint(band), 0, 255)
+        self.array[top : top + len(band)] = band
+
+    def close(self):
+        pass
+
+
+class MemmapSink(ArraySink):
+    """写入 .npy 内存映射文件，整幅图像不需要放进内存"""
+
+    def __init__(self, path, height, width, dtype=np.uint8):
+        self.array = np.lib.format.open_memmap(
+            path, mode="w+", dtype=dtype, shape=(height, width, 3)
+        )
+
+    def close(self):
+        self.array.flush()
+
+
+class StreamingReconstructor:
+    """按光栅顺序接收 tile，对重叠区域取平均。
+
+    只保留当前 tile 行覆盖的 size 行 (float32 加权和 + 权重和)；下一行 tile 开始时，
+    它上方的行不会再被覆盖，立即归一化交给 sink.write(top, band) 并移出缓冲区。
+    window 为 blend_window 的权重，None 时等同于计数平均。
+    """
+
+    def __init__(self, height, width, size, sink, window=None):
+        self.height = height
+        self.width = width
+        self.size = size
+        self.sink = sink
+        self.window = window
+        self.top = 0  # 缓冲区第 0 行对应的图像行
+        self.sum = np.zeros((size, width, 3), dtype=np.float32)
+        self.weights = np.zeros((size, width), dtype=np.float32)
+
+    def _emit(self, rows):
+        rows = min(rows, self.height - self.top)
+        if rows <= 0:
+            return
+        weights = np.where(self.weights[:rows] > 0, self.weights[:rows], 1)[..., None]
+        self.sink.write(self.top, self.sum[:rows] / weights)
+        self.sum[:-rows] = self.sum[rows:]
+        self.sum[-rows:] = 0
+        self.weights[:-rows] = self.weights[rows:]
+        self.weights[-rows:] = 0
+        self.top += rows
+
+    def add(self, coords, tiles):
+        """tiles: N x size x size x 3 (numpy 或 CPU 张量)，coords 必须按光栅顺序"""
+        for (x, y), tile in zip(coords, np.asarray(tiles)):
+            if x < self.top:
+                raise ValueError(f"tile at row {x} arrived after row {self.top} was emitted")
+            self._emit(x - self.top)
+            h = min(self.size, self.height - x)
+            w = min(self.size, self.width - y)
+            if self.window is None:
+                self.sum[:h, y : y + w] += tile[:h, :w]
+                self.weights[:h, y : y + w] += 1
+            else:
+                window = self.window[:h, :w]
+                self.sum[:h, y : y + w] += tile[:h, :w] * window[..., None]
+                self.weights[:h, y : y + w] += window
+
+    def close(self):
+        self._emit(self.size)
+        self.sink.close()
+
+
+def predict_image(model, image, tiler, sink, tta=False, progress=None, blend="mean"):
+    """分块推理并流式重建到 sink，返回 sink"""
+    h, w = image.shape[:2]
+    window = None if blend == "mean" else blend_window(tiler.size, tiler.overlap, blend)
+    reconstructor = StreamingReconstructor(h, w, tiler.size, sink, window)
+    batches = predict_tiles(model, image, tiler, tta)
+    if progress is not None:
+        batches = progress(batches, total=-(-len(tiler.coords(h, w)) // tiler.batch_size))
+    for coords, outputs in batches:
+        reconstructor.add(coords, outputs.cpu().numpy())
+    reconstructor.close()
+    return sink
+
+
+if __name__ == "__main__":
+    # python tiling.py MODEL INPUT OUTPUT：.npy 的输入输出都按内存映射处理，适合超大的航拍拼接图
+    import sys
+
+    import cv2
+
+    from checkpoint import load_inference_model
+
+    model_path, input_path, output_path = sys.argv[1:4]
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_inference_model(model_path, device)
+    if input_path.endswith(".npy"):
+        image = np.load(input_path, mmap_mode="r")
+    else:
+        image = cv2.imread(input_path)
+    h, w = image.shape[:2]
+    if output_path.endswith(".npy"):
+        sink = MemmapSink(output_path, h, w)
+    else:
+        sink = ArraySink(h, w, dtype=np.uint8)
+    predict_image(model, image, Tiler(device=device), sink)
+    if not output_path.endswith(".npy"):
+        cv2.imwrite(output_path, sink.array)
@@ -0,0 +1,77 @@
+"""Batched dihedral test-time augmentation.
+
+Each transform is a horizontal flip (optional) followed by k quarter turns, which covers the 8
+symmetries of a square tile. All transformed copies of a batch go through the model in one
+forward call (optionally chunked), are mapped back on the device and averaged.
+"""
+
+import torch
+
+
+# name -> (quarter turns, horizontal flip first)
+TRANSFORMS = {
+    "identity": (0, False),
+    "rot90": (1, False),
+    "rot180": (2, False),
+    "rot270": (3, False),
+    "hflip": (0, True),
+    "transpose": (1, True),
+    "vflip": (2, True),
+    "transverse": (3, True),
+}
+POLICIES = {
+    "none": ("identity",),
+    "hflip": ("identity", "hflip"),
+    "flips": ("identity", "hflip", "vflip", "rot180"),
+    "rot": ("identity", "rot90", "rot180", "rot270"),
+    "d4": tuple(TRANSFORMS),
+}
+
+
+def resolve(tta):
+    """把 predict.py 中的 tta 配置转换为变换名列表：False / True (= hflip，原来的行为) / 策略名 / 变换名列表"""
+    if tta is False or tta is None:
+        return POLICIES["none"]
+    if tta is True:
+        return POLICIES["hflip"]
+    names = POLICIES[tta] if isinstance(tta, str) else tuple(tta)
+    unknown = [name for name in names if name not in TRANSFORMS]
+    if unknown:
+        raise ValueError(f"unknown TTA transforms {unknown}, expected names from {list(TRANSFORMS)}")
+    return names
+
+
+def forward_transform(x, name):
+    k, flip = TRANSFORMS[name]
+    if flip:
+        x = torch.flip(x, [3])
+    return torch.rot90(x, k, [2, 3]) if k else x
+
+
+def inverse_transform(x, name):
+    k, flip = TRANSFORMS[name]
+    if k:
+        x = torch.rot90(x, -k, [2, 3])
+    return torch.flip(x, [3]) if flip else x
+
+
+def tta_forward(model, x, transforms=("identity",), max_batch=None):
+    """对 N x C x H x W 的 x 做 TTA，返回 float32 的平均输出。
+
+    旋转要求 H == W。所有变换拼成 N * len(transforms) 的一个 batch 推理，
+    max_batch 限制单次前向的 batch 大小 (显存不足时分块)。
+    """
+    transforms = resolve(transforms)
+    if transforms == ("identity",):
+        return model(x).float()
+    if x.shape[-1] != x.shape[-2] and any(TRANSFORMS[t][0] % 2 for t in transforms):
+        raise ValueError("90-degree rotations need square tiles")
+    n = x.shape[0]
+    stacked = torch.cat([forward_transform(x, t) for t in transforms])
+    chunk = max_batch or len(stacked)
+    outputs = torch.cat([model(part) for part in stacked.split(chunk)]).float()
+    total = None
+    for i, name in enumerate(transforms):
+        output = inverse_transform(outputs[i * n : (i + 1) * n], name)
+        total = output if total is None else total + output
+    return total / len(transforms)